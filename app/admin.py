@@ -1,12 +1,13 @@
 from django.contrib import admin
 from django.contrib import messages
-from .models import Property, PropertyImage, Amenity, Booking, Review, UserProfile, HostApplication, Post
+from . import outbox, payments, webhooks
+from .models import Property, PropertyImage, Amenity, Booking, Review, UserProfile, HostApplication, Post, SchedulerLease, OutboxEmail, WebhookEvent
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
 from django.urls import reverse
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
-from django.core.mail import send_mail
 from django.conf import settings
 
 @admin.register(UserProfile)
@@ -90,7 +91,41 @@ class PropertyImageAdmin(admin.ModelAdmin):
 
 @admin.register(Amenity)
 class AmenityAdmin(admin.ModelAdmin):
-    list_display = ['name']
+    list_display = ['name', 'slug']
+    prepopulated_fields = {'slug': ('name',)}
+
+@admin.register(SchedulerLease)
+class SchedulerLeaseAdmin(admin.ModelAdmin):
+    list_display = ['name', 'owner', 'expires_at', 'last_run_at', 'last_duration_ms', 'last_processed', 'last_backlog']
+    readonly_fields = list_display
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['subject', 'recipients']
+    readonly_fields = ['attempts', 'last_error', 'created_at', 'sent_at']
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        """Send failed or waiting e-mails on the worker's next pass"""
+        updated = queryset.exclude(status='sent').update(status='pending', next_attempt_at=timezone.now())
+        self.message_user(request, f'Successfully queued {updated} e-mails for sending.')
+    retry_now.short_description = "Retry selected e-mails now"
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['event_id', 'type', 'status', 'result', 'attempts', 'stripe_created', 'processed_at']
+    list_filter = ['status', 'type']
+    search_fields = ['event_id']
+    readonly_fields = ['event_id', 'type', 'payload', 'stripe_created', 'result', 'attempts', 'last_error', 'received_at', 'processed_at']
+    actions = ['replay']
+
+    def replay(self, request, queryset):
+        """Apply the selected events again on the worker's next pass"""
+        updated = webhooks.requeue(queryset)
+        self.message_user(request, f'Successfully queued {updated} events for replay.')
+    replay.short_description = "Replay selected events"
 
 # Custom filter for bookings expiring soon
 class ExpiringSoonFilter(admin.SimpleListFilter):
@@ -107,49 +142,30 @@ class ExpiringSoonFilter(admin.SimpleListFilter):
 
     def queryset(self, request, queryset):
         now = timezone.now()
+        holds = queryset.filter(status='pending', payment_status='pending')
         
         if self.value() == 'expiring_soon':
             # Bookings expiring in less than 10 minutes
-            cutoff_time = now + timedelta(minutes=10)
-            return queryset.filter(
-                status='pending',
-                payment_status='pending',
-                created_at__lt=cutoff_time - timedelta(minutes=30)
-            )
+            return holds.filter(expires_at__lt=now + timedelta(minutes=10))
         
         elif self.value() == 'expiring_very_soon':
             # Bookings expiring in less than 5 minutes
-            cutoff_time = now + timedelta(minutes=5)
-            return queryset.filter(
-                status='pending',
-                payment_status='pending',
-                created_at__lt=cutoff_time - timedelta(minutes=30)
-            )
+            return holds.filter(expires_at__lt=now + timedelta(minutes=5))
         
         elif self.value() == 'expired':
             # Already expired bookings
-            cutoff_time = now - timedelta(minutes=30)
-            return queryset.filter(
-                status='pending',
-                payment_status='pending',
-                created_at__lt=cutoff_time
-            )
+            return holds.filter(expires_at__lt=now)
         
         elif self.value() == 'not_expiring':
             # Bookings not expiring soon (more than 10 minutes left)
-            cutoff_time = now + timedelta(minutes=10)
-            return queryset.filter(
-                status='pending',
-                payment_status='pending',
-                created_at__gte=cutoff_time - timedelta(minutes=30)
-            )
+            return holds.filter(expires_at__gte=now + timedelta(minutes=10))
 
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
     list_display = ['property_obj', 'guest', 'check_in', 'check_out', 'status', 'payment_status', 'created_at', 'reservation_expires_at_display']
     list_filter = ['status', 'payment_status', 'created_at', ExpiringSoonFilter]
     search_fields = ['property_obj__title', 'guest__username', 'stripe_session_id']
-    readonly_fields = ['created_at', 'updated_at', 'stripe_session_id', 'reservation_expires_at', 'is_expired', 'time_remaining_seconds']
+    readonly_fields = ['created_at', 'updated_at', 'stripe_session_id', 'expires_at', 'is_expired', 'time_remaining_seconds']
     ordering = ['-created_at']
     
     actions = [
@@ -181,25 +197,25 @@ class BookingAdmin(admin.ModelAdmin):
     
     def confirm_pending_bookings(self, request, queryset):
         """Manually confirm pending bookings"""
-        to_confirm = queryset.filter(status='pending', payment_status='paid')
+        to_confirm = queryset.filter(status='pending', payment_status='paid').select_related('guest', 'property_obj')
         updated = 0
         for booking in to_confirm:
-            booking.status = 'confirmed'
-            booking.save()
-            # Send confirmation email
-            send_mail(
-                subject='Your booking is confirmed!',
-                message=f'Dear {booking.guest.get_full_name() or booking.guest.username},\n\nYour booking for {booking.property_obj.title} from {booking.check_in} to {booking.check_out} has been confirmed by the admin.\n\nThank you for booking with us!',
-                from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
-                recipient_list=[booking.guest.email],
-                fail_silently=True,
-            )
+            with transaction.atomic():
+                booking.status = 'confirmed'
+                booking.save()
+                # Queue confirmation email
+                outbox.queue_mail(
+                    subject='Your booking is confirmed!',
+                    message=f'Dear {booking.guest.get_full_name() or booking.guest.username},\n\nYour booking for {booking.property_obj.title} from {booking.check_in} to {booking.check_out} has been confirmed by the admin.\n\nThank you for booking with us!',
+                    from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
+                    recipient_list=[booking.guest.email],
+                )
             updated += 1
-        self.message_user(request, f'Successfully confirmed {updated} paid pending bookings and sent confirmation emails.')
+        self.message_user(request, f'Successfully confirmed {updated} paid pending bookings and queued confirmation emails.')
     
     def cancel_pending_bookings(self, request, queryset):
         """Cancel pending bookings"""
-        updated = queryset.filter(status='pending').update(
+        updated = queryset.filter(status='pending').release(
             status='cancelled',
             payment_status='failed'
         )
@@ -208,33 +224,23 @@ class BookingAdmin(admin.ModelAdmin):
     
     def cancel_expired_bookings(self, request, queryset):
         """Cancel expired pending bookings"""
-        expired_count = 0
-        for booking in queryset.filter(status='pending'):
-            if booking.is_expired:
-                booking.status = 'cancelled'
-                booking.payment_status = 'failed'
-                booking.save()
-                expired_count += 1
+        expired_count = queryset.expire_holds()
         
         self.message_user(request, f'Successfully cancelled {expired_count} expired bookings.')
     cancel_expired_bookings.short_description = "Cancel expired bookings"
     
     def mark_as_completed(self, request, queryset):
         """Mark confirmed bookings as completed"""
-        updated = queryset.filter(status='confirmed').update(status='completed')
+        updated = queryset.filter(status='confirmed').release(status='completed')
         self.message_user(request, f'Successfully marked {updated} bookings as completed.')
     mark_as_completed.short_description = "Mark selected bookings as completed"
     
     def resend_payment_link(self, request, queryset):
         """Resend payment link for pending bookings"""
-        import stripe
-        from django.conf import settings
-        
-        stripe.api_key = settings.STRIPE_SECRET_KEY
         success_count = 0
         error_count = 0
         
-        for booking in queryset.filter(status='pending', payment_status='pending'):
+        for booking in queryset.filter(status='pending', payment_status='pending').select_related('guest', 'property_obj'):
             try:
                 # Check if booking has expired
                 if booking.is_expired:
@@ -246,36 +252,12 @@ class BookingAdmin(admin.ModelAdmin):
                     error_count += 1
                     continue
                 
-                # Calculate nights and total price
-                nights = (booking.check_out - booking.check_in).days
-                total_price = booking.total_price
-                
                 # Create new Stripe session
-                session = stripe.checkout.Session.create(
-                    payment_method_types=['card'],
-                    line_items=[{
-                        'price_data': {
-                            'currency': 'usd',
-                            'product_data': {
-                                'name': f'Booking for {booking.property_obj.title}',
-                                'description': f'{nights} nights from {booking.check_in} to {booking.check_out}',
-                            },
-                            'unit_amount': int(total_price * 100),
-                        },
-                        'quantity': 1,
-                    }],
-                    mode='payment',
-                    success_url=request.build_absolute_uri(f'/booking/success/?booking_id={booking.id}'),
-                    cancel_url=request.build_absolute_uri(f'/booking/cancel/?booking_id={booking.id}'),
-                    customer_email=booking.guest.email,
-                    metadata={
-                        'booking_id': str(booking.id),
-                        'property_id': str(booking.property_obj.id),
-                    }
-                )
+                session = payments.create_checkout_session(booking, request)
                 
-                # Update booking with new session ID
-                booking.stripe_session_id = session.id
+                # Update booking with the new session's details
+                for name, value in payments.session_fields(session).items():
+                    setattr(booking, name, value)
                 booking.save()
                 
                 success_count += 1
@@ -0,0 +1,169 @@
+"""
+Per-property availability index.
+
+The active bookings of a property are loaded once, merged into sorted,
+non-overlapping half-open night intervals and kept in the Django cache.
+Overlap checks are a single bisect and "unavailable nights" queries only walk
+the intervals intersecting the requested window. Booking writes invalidate the
+cached entry through the receivers in app/signals.py.
+"""
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+CACHE_KEY = 'availability:property:{}'
+# Upper bound on staleness when the cache is not shared between processes
+CACHE_TIMEOUT = 300
+
+ACTIVE_STATUSES = ('pending', 'confirmed')
+
+
+def _to_date(value):
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+
+class AvailabilityIndex:
+    """Sorted, merged night intervals for a single property."""
+
+    def __init__(self, starts, ends):
+        # Parallel lists of date ordinals; ends are exclusive (check-out day)
+        self.starts = starts
+        self.ends = ends
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """Build an index from (check_in, check_out) pairs in any order."""
+        starts, ends = [], []
+        for check_in, check_out in sorted(ranges):
+            start, end = check_in.toordinal(), check_out.toordinal()
+            if end <= start:
+                continue
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        return cls(starts, ends)
+
+    def _first_after(self, ordinal):
+        """Index of the first interval ending after the given night."""
+        return bisect_right(self.ends, ordinal)
+
+    def is_available(self, check_in, check_out):
+        check_in, check_out = _to_date(check_in), _to_date(check_out)
+        i = self._first_after(check_in.toordinal())
+        return i == len(self.starts) or self.starts[i] >= check_out.toordinal()
+
+    def unavailable_dates(self, start_date, end_date):
+        """Booked nights in [start_date, end_date), sorted."""
+        start, end = start_date.toordinal(), end_date.toordinal()
+        nights = []
+        i = self._first_after(start)
+        while i < len(self.starts) and self.starts[i] < end:
+            first = max(self.starts[i], start)
+            last = min(self.ends[i], end)
+            nights.extend(date.fromordinal(night) for night in range(first, last))
+            i += 1
+        return nights
+
+
+def _load(property_id):
+    from .models import Booking
+
+    ranges = Booking.objects.filter(
+        property_obj_id=property_id,
+        status__in=ACTIVE_STATUSES,
+    ).values_list('check_in', 'check_out')
+    return AvailabilityIndex.from_ranges(ranges)
+
+
+def get_index(property_id):
+    """Return the availability index for a property, loading it on a miss."""
+    key = CACHE_KEY.format(property_id)
+    cached = cache.get(key)
+    if cached is not None:
+        return AvailabilityIndex(*cached)
+    index = _load(property_id)
+    cache.set(key, (index.starts, index.ends), CACHE_TIMEOUT)
+    return index
+
+
+async def _aload(property_id):
+    from .models import Booking
+
+    ranges = Booking.objects.filter(
+        property_obj_id=property_id,
+        status__in=ACTIVE_STATUSES,
+    ).values_list('check_in', 'check_out')
+    return AvailabilityIndex.from_ranges([stay async for stay in ranges])
+
+
+async def aget_index(property_id):
+    """Async version of get_index() for the async API views."""
+    key = CACHE_KEY.format(property_id)
+    cached = await cache.aget(key)
+    if cached is not None:
+        return AvailabilityIndex(*cached)
+    index = await _aload(property_id)
+    await cache.aset(key, (index.starts, index.ends), CACHE_TIMEOUT)
+    return index
+
+
+def _window(start_date, end_date):
+    if not start_date:
+        start_date = timezone.now().date()
+    if not end_date:
+        end_date = _to_date(start_date) + timedelta(days=365)
+    return _to_date(start_date), _to_date(end_date)
+
+
+def is_available(property_id, check_in, check_out):
+    return get_index(property_id).is_available(check_in, check_out)
+
+
+async def ais_available(property_id, check_in, check_out):
+    return (await aget_index(property_id)).is_available(check_in, check_out)
+
+
+def unavailable_dates(property_id, start_date=None, end_date=None):
+    return get_index(property_id).unavailable_dates(*_window(start_date, end_date))
+
+
+async def aunavailable_dates(property_id, start_date=None, end_date=None):
+    return (await aget_index(property_id)).unavailable_dates(*_window(start_date, end_date))
+
+
+def invalidate(*property_ids):
+    """Drop cached indexes; call after writes that bypass Booking signals."""
+    cache.delete_many([CACHE_KEY.format(property_id) for property_id in set(property_ids)])
+
+
+def batch_is_available(queries):
+    """
+    Answer many (property_id, check_in, check_out) queries with a single read
+    of the claimed nights covering all of them. Dates must be date objects.
+    """
+    from .models import PropertyNight
+
+    if not queries:
+        return []
+    claimed = {}
+    nights = PropertyNight.objects.filter(
+        property_id__in={property_id for property_id, _, _ in queries},
+        night__gte=min(check_in for _, check_in, _ in queries),
+        night__lt=max(check_out for _, _, check_out in queries),
+    ).order_by('property_id', 'night').values_list('property_id', 'night')
+    for property_id, night in nights:
+        claimed.setdefault(property_id, []).append(night.toordinal())
+
+    results = []
+    for property_id, check_in, check_out in queries:
+        taken = claimed.get(property_id, [])
+        # First claimed night on or after check-in must fall after the stay
+        i = bisect_left(taken, check_in.toordinal())
+        results.append(i == len(taken) or taken[i] >= check_out.toordinal())
+    return results
@@ -0,0 +1,121 @@
+"""
+Booking status broadcasts.
+
+Whenever a booking's status changes (a webhook applied, a hold swept, an admin
+decision), publish() announces it once the transaction commits, and watch()
+delivers it to the guest waiting on the payment page through the
+booking_status_stream view, either as Server-Sent Events or a long poll
+(under ASGI; WSGI workers answer polls at once).
+
+Messages go through the broker named by settings.BOOKING_BROKER. LocalBroker
+delivers within this process; a broker with the same publish() and
+subscribe() methods backed by Redis pub/sub (or a local stand-in for it) can
+replace it when producers and streams run in separate processes. Watchers also
+re-read the booking every RECHECK_INTERVAL seconds, so a change published
+elsewhere is still seen, only later.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Booking
+
+# Seconds between database reads of a watched booking when nothing is
+# published; the payment page used to poll this often
+RECHECK_INTERVAL = 5
+
+
+class LocalBroker:
+    """Pub/sub between the threads and event loops of one process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+            except RuntimeError:
+                # The subscriber's event loop has closed
+                pass
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        """Yield a queue receiving the messages published on ``channel``."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers[channel].add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                self._subscribers[channel].discard(subscriber)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(settings.BOOKING_BROKER)()
+
+
+def channel(booking_id):
+    return f'booking:{booking_id}'
+
+
+def publish(booking_id, **fields):
+    """Announce a booking's new status and/or payment_status once the current transaction commits."""
+    message = {name: value for name, value in fields.items() if name in ('status', 'payment_status')}
+    if not message:
+        return
+    transaction.on_commit(lambda: get_broker().publish(channel(booking_id), message))
+
+
+def state(booking):
+    return booking.status, booking.payment_status, booking.is_expired
+
+
+def is_final(booking):
+    """Whether the payment page has nothing more to wait for."""
+    return booking.status != 'pending' or booking.is_expired
+
+
+async def watch(booking, until):
+    """
+    Yield ``booking`` each time its status changes, until the loop time
+    ``until``, updating it in place. Yields None when a recheck found no
+    change, so streams can send keepalives.
+    """
+    loop = asyncio.get_running_loop()
+    last = state(booking)
+    async with get_broker().subscribe(channel(booking.pk)) as queue:
+        while loop.time() < until:
+            timeout = min(RECHECK_INTERVAL, until - loop.time())
+            if booking.status == 'pending' and not booking.is_expired:
+                # Wake up when the hold runs out even if nothing is published
+                timeout = min(timeout, max((booking.expires_at - timezone.now()).total_seconds(), 0) + 0.1)
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout)
+            except TimeoutError:
+                current = await Booking.objects.filter(pk=booking.pk).values('status', 'payment_status').afirst()
+                if current is None:
+                    # Deleted, e.g. when its payment session could not be created
+                    current = {'status': 'cancelled', 'payment_status': 'failed'}
+                message = current
+            for name, value in message.items():
+                setattr(booking, name, value)
+            if state(booking) != last:
+                last = state(booking)
+                yield booking
+            else:
+                yield None
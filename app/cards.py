@@ -0,0 +1,73 @@
+"""
+Rendered-fragment cache for property cards.
+
+Each card template under templates/cards/ renders the static part of one
+property's card; anything that depends on the viewer (wishlist state, CSRF
+forms) stays in the page around it. A page of cards is fetched with one
+get_many, only the missing cards are rendered, and those are stored with one
+set_many.
+
+The key covers the property id, updated_at and the language, plus the
+denormalized columns a card shows that change without a save (rating, amenity
+mask) and the primary image with its derivatives, so a changed card gets a
+new key and the old entry ages out. Amenity names are shared by every card, so amenity writes
+replace a version that is part of every key.
+"""
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+VERSION_KEY = 'cards:version'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex[:12], None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate():
+    """Drop every cached card; call after writes that change what all cards show."""
+    cache.set(VERSION_KEY, uuid.uuid4().hex[:12], None)
+
+
+def image_key(image):
+    if image is None:
+        return None
+    return image.image.name, image.variants.get('source'), tuple(image.variants.get('widths', ()))
+
+
+def card_key(property, template_name, language, version):
+    parts = (
+        template_name, language, version, property.pk, property.updated_at.isoformat(),
+        property.rating_avg, property.rating_count, property.amenity_mask, image_key(property.primary_image_object),
+    )
+    return 'cards:' + hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def render_cards(properties, template_name, language='en'):
+    """Pair each of ``properties`` with its rendered card, rendering only cache misses."""
+    properties = list(properties)
+    version = get_version()
+    keys = [card_key(property, template_name, language, version) for property in properties]
+    cached = cache.get_many(keys)
+
+    rendered = {}
+    for property, key in zip(properties, keys):
+        if key not in cached and key not in rendered:
+            rendered[key] = render_to_string(template_name, {
+                'property': property,
+                'user_language': language,
+                'is_french': language == 'fr',
+            })
+    if rendered:
+        cache.set_many(rendered, CACHE_TIMEOUT)
+
+    cached.update(rendered)
+    return [(property, mark_safe(cached[key])) for property, key in zip(properties, keys)]
@@ -0,0 +1,153 @@
+"""
+Geographic search over property coordinates.
+
+On SQLite every property with coordinates has a point in the R-tree created by
+migration 0016, kept current by triggers on app_property (reinstalled after
+every migrate, like the search index triggers). Viewport and radius queries
+join the R-tree on id to find candidates in O(log n), then filter on the exact
+latitude/longitude columns, since R-tree boxes are stored as 32-bit floats.
+
+Other backends skip the R-tree and filter the columns directly. There is no
+B-tree index on the columns: on SQLite the planner would prefer it to the
+R-tree and scan a whole latitude band.
+"""
+import math
+from collections import namedtuple
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import ASin, Cast, Cos, Power, Radians, Sin, Sqrt
+
+GEO_TABLE = 'app_property_geo'
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {GEO_TABLE}_insert AFTER INSERT ON app_property
+    WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+        INSERT INTO {GEO_TABLE} VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {GEO_TABLE}_delete AFTER DELETE ON app_property BEGIN
+        DELETE FROM {GEO_TABLE} WHERE id = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {GEO_TABLE}_update AFTER UPDATE OF latitude, longitude ON app_property BEGIN
+        DELETE FROM {GEO_TABLE} WHERE id = old.id;
+        INSERT INTO {GEO_TABLE}
+            SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+            WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+    END
+    """,
+]
+
+_rtree_available = {}
+
+
+class BoundingBox(namedtuple('BoundingBox', 'south west north east')):
+    """A viewport in degrees. ``west > east`` means it spans the antimeridian."""
+
+    @classmethod
+    def parse(cls, value):
+        """Parse "south,west,north,east", raising ValueError when malformed."""
+        try:
+            south, west, north, east = (float(part) for part in value.split(','))
+        except (AttributeError, TypeError):
+            raise ValueError('Bounding box must be "south,west,north,east"')
+        if not (-90 <= south <= north <= 90):
+            raise ValueError('Latitudes must satisfy -90 <= south <= north <= 90')
+        if not (-180 <= west <= 180 and -180 <= east <= 180):
+            raise ValueError('Longitudes must be between -180 and 180')
+        return cls(south, west, north, east)
+
+    @classmethod
+    def around(cls, latitude, longitude, radius_km):
+        """Smallest box containing the circle of ``radius_km`` around a point."""
+        lat_delta = radius_km / KM_PER_DEGREE
+        south, north = max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0)
+        # Near the poles the circle covers every longitude
+        cos_lat = math.cos(math.radians(max(abs(south), abs(north))))
+        if cos_lat <= 0 or radius_km / (KM_PER_DEGREE * cos_lat) >= 180:
+            return cls(south, -180.0, north, 180.0)
+        lng_delta = radius_km / (KM_PER_DEGREE * cos_lat)
+        west = (longitude - lng_delta + 540) % 360 - 180
+        east = (longitude + lng_delta + 540) % 360 - 180
+        return cls(south, west, north, east)
+
+
+def parse_point(latitude, longitude, radius_km):
+    """Validate a radius search, raising ValueError when malformed."""
+    latitude, longitude, radius_km = float(latitude), float(longitude), float(radius_km)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('Coordinates are out of range')
+    if radius_km <= 0:
+        raise ValueError('Radius must be positive')
+    return latitude, longitude, radius_km
+
+
+def rtree_enabled():
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _rtree_available:
+        _rtree_available[name] = GEO_TABLE in connection.introspection.table_names()
+    return _rtree_available[name]
+
+
+def _longitude_filter(prefix, west, east):
+    if west <= east:
+        return Q(**{f'{prefix}__gte': west, f'{prefix}__lte': east})
+    return Q(**{f'{prefix}__gte': west}) | Q(**{f'{prefix}__lte': east})
+
+
+def within_bbox(queryset, bbox):
+    """Restrict a Property queryset to listings inside ``bbox``."""
+    if rtree_enabled():
+        queryset = queryset.filter(
+            Q(geo_point__max_lat__gte=bbox.south, geo_point__min_lat__lte=bbox.north)
+            & (
+                Q(geo_point__max_lng__gte=bbox.west, geo_point__min_lng__lte=bbox.east)
+                if bbox.west <= bbox.east else
+                Q(geo_point__max_lng__gte=bbox.west) | Q(geo_point__min_lng__lte=bbox.east)
+            )
+        )
+    return queryset.filter(
+        Q(latitude__gte=bbox.south, latitude__lte=bbox.north)
+        & _longitude_filter('longitude', bbox.west, bbox.east)
+    )
+
+
+def distance_km(latitude, longitude):
+    """Haversine distance in km from a point to each property's coordinates."""
+    lat = Radians(Cast(F('latitude'), FloatField()))
+    lng = Radians(Cast(F('longitude'), FloatField()))
+    origin_lat, origin_lng = math.radians(latitude), math.radians(longitude)
+    half_chord = (
+        Power(Sin((lat - origin_lat) / 2), 2)
+        + math.cos(origin_lat) * Cos(lat) * Power(Sin((lng - origin_lng) / 2), 2)
+    )
+    return 2 * EARTH_RADIUS_KM * ASin(Sqrt(half_chord))
+
+
+def within_radius(queryset, latitude, longitude, radius_km):
+    """
+    Restrict a Property queryset to listings within ``radius_km`` of a point,
+    annotated with ``distance_km``.
+    """
+    queryset = within_bbox(queryset, BoundingBox.around(latitude, longitude, radius_km))
+    return queryset.annotate(
+        distance_km=distance_km(latitude, longitude),
+    ).filter(distance_km__lte=radius_km)
+
+
+def install_triggers(using=None):
+    """(Re)create the triggers that keep the R-tree in sync, if it exists."""
+    conn = connections[using or DEFAULT_DB_ALIAS]
+    if conn.vendor != 'sqlite' or GEO_TABLE not in conn.introspection.table_names():
+        return
+    with conn.cursor() as cursor:
+        for statement in TRIGGERS:
+            cursor.execute(statement)
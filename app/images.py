@@ -0,0 +1,129 @@
+"""
+Responsive derivatives of property photos.
+
+Hosts upload photos at whatever size their camera produces, and listing cards
+used to load those originals. When a PropertyImage is saved with a new file,
+generate() writes downscaled copies next to the original, one per width in
+WIDTHS and format in FORMATS (properties/x.jpg -> properties/x.480w.webp,
+properties/x.480w.jpg, ...), and records which widths exist on the image's
+``variants`` field. Templates then offer them as srcset candidates through
+the responsive_image tag, so browsers fetch the smallest file that fills the
+slot; images without derivatives keep serving the original. Widths are never
+upscaled: a photo narrower than a width gets one derivative at its own width.
+
+Photos uploaded before this existed are processed by
+`manage.py generate_image_variants`. Derivatives are deleted with their image
+and when its file is replaced. Reading AVIF uploads needs the optional
+pillow-avif-plugin package; without it they are served as uploaded.
+"""
+import logging
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+try:
+    # Registers AVIF with Pillow, which only reads it natively from 11.2
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# Derivative widths in pixels: listing cards, the detail page gallery, and
+# the full-width hero
+WIDTHS = {'card': 480, 'gallery': 960, 'hero': 1600}
+# Pillow format names with the extension and MIME type of their files
+FORMATS = {
+    'WEBP': ('webp', 'image/webp'),
+    'JPEG': ('jpg', 'image/jpeg'),
+}
+QUALITY = 80
+
+logger = logging.getLogger(__name__)
+
+
+def variant_name(name, width, image_format):
+    """Storage name of the ``width`` pixel derivative of the file ``name``."""
+    root, _ = posixpath.splitext(name)
+    return f'{root}.{width}w.{FORMATS[image_format][0]}'
+
+
+def target_widths(original_width):
+    return sorted({min(width, original_width) for width in WIDTHS.values()})
+
+
+def generate(image_field):
+    """
+    Write the derivatives of an ImageField's file to its storage. Returns the
+    ``variants`` value describing them, or an empty dict when the file is
+    missing or not an image.
+    """
+    storage, name = image_field.storage, image_field.name
+    if not name or not storage.exists(name):
+        return {}
+    try:
+        with storage.open(name) as f:
+            original = Image.open(f)
+            original = ImageOps.exif_transpose(original)
+            original.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        logger.warning('Cannot create derivatives of %s: %s', name, e)
+        return {}
+
+    widths = target_widths(original.width)
+    for width in widths:
+        height = max(1, round(original.height * width / original.width))
+        resized = original.resize((width, height), Image.Resampling.LANCZOS) if width != original.width else original
+        for image_format in FORMATS:
+            output = resized
+            if image_format == 'JPEG' and output.mode != 'RGB':
+                output = output.convert('RGB')
+            elif output.mode not in ('RGB', 'RGBA'):
+                output = output.convert('RGBA' if 'A' in output.getbands() else 'RGB')
+            buffer = BytesIO()
+            output.save(buffer, image_format, quality=QUALITY, optimize=image_format == 'JPEG')
+            target = variant_name(name, width, image_format)
+            # Storage.save() would pick another name rather than overwrite
+            if storage.exists(target):
+                storage.delete(target)
+            storage.save(target, ContentFile(buffer.getvalue()))
+    return {'source': name, 'widths': widths}
+
+
+def refresh(image):
+    """
+    Generate the derivatives of a PropertyImage and record them on it. The
+    derivatives of a file it replaced are deleted.
+    """
+    if image.variants and not is_current(image):
+        # First, as the new file's derivatives may reuse their names
+        delete(image.image.storage, image.variants)
+    image.variants = generate(image.image)
+    type(image).objects.filter(pk=image.pk).update(variants=image.variants)
+    return image.variants
+
+
+def delete(storage, variants):
+    """Delete the derivative files described by a ``variants`` value."""
+    name = variants.get('source')
+    if not name:
+        return
+    for width in variants.get('widths', []):
+        for image_format in FORMATS:
+            storage.delete(variant_name(name, width, image_format))
+
+
+def is_current(image):
+    """Whether ``image`` (a PropertyImage) has derivatives of its current file."""
+    return image.variants.get('source') == image.image.name
+
+
+def srcset(image, image_format):
+    """The srcset attribute listing the derivatives of ``image`` in one format."""
+    if not is_current(image):
+        return ''
+    storage, name = image.image.storage, image.image.name
+    return ', '.join(
+        f'{storage.url(variant_name(name, width, image_format))} {width}w'
+        for width in image.variants['widths']
+    )
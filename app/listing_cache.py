@@ -0,0 +1,181 @@
+"""
+Result cache for the listings page.
+
+The listing GET parameters are normalized into a canonical key (known
+parameters only, sorted, multi-values deduplicated, numbers and dates in one
+spelling) and each page of results is stored as the ordered property ids plus
+the cursors and facet counts, never as model instances. Entries live under a
+version that the receivers in app/signals.py replace on every Property,
+PropertyImage, Amenity, Booking, Review, PropertyComment and Wishlist write,
+so a write makes all entries unreachable at once and they age out by timeout.
+
+Only plain cache operations are used (get, set, add, incr), so this works with
+the local-memory, file and database backends alike. Hit and miss counters are
+kept in the cache too; with backends whose incr is not atomic (file, database)
+they are approximate under concurrency.
+"""
+import hashlib
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+
+from . import facets
+
+KEY_PREFIX = 'listing:results'
+VERSION_KEY = f'{KEY_PREFIX}:version'
+HITS_KEY = f'{KEY_PREFIX}:hits'
+MISSES_KEY = f'{KEY_PREFIX}:misses'
+# Upper bound on staleness for writes that bypass the signals (e.g. bulk updates)
+CACHE_TIMEOUT = 300
+
+MULTI_VALUED = ('type', 'space_type', 'amenities')
+SORTS = ('price_asc', 'price_desc', 'rating', 'newest', 'distance')
+
+
+def _number(value, kind):
+    try:
+        number = kind(value)
+    except (TypeError, ValueError, InvalidOperation):
+        return None
+    if kind is Decimal:
+        return str(number.normalize()) if number.is_finite() else None
+    return repr(number)
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date().isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize(params):
+    """
+    Canonical (name, value) pairs for the listing parameters in ``params``, so
+    equivalent query strings share one cache entry. Values that the listing
+    filters would ignore are dropped.
+    """
+    normalized = []
+    for name in MULTI_VALUED:
+        for value in sorted({value for value in params.getlist(name) if value}):
+            normalized.append((name, value))
+
+    location = ' '.join(params.get('location', '').lower().split())
+    if location:
+        normalized.append(('location', location))
+    bedrooms = params.get('bedrooms', '')
+    if bedrooms.isdigit():
+        normalized.append(('bedrooms', str(int(bedrooms))))
+    guests = params.get('guests', '')
+    if guests.isdigit():
+        normalized.append(('guests', str(int(guests))))
+    for name in ('min_price', 'max_price'):
+        value = _number(params.get(name) or None, Decimal)
+        if value is not None:
+            normalized.append((name, value))
+    for name in ('lat', 'lng', 'radius'):
+        value = _number(params.get(name) or None, float)
+        if value is not None:
+            normalized.append((name, value))
+    check_in, check_out = _date(params.get('check_in')), _date(params.get('check_out'))
+    if check_in and check_out:
+        normalized += [('check_in', check_in), ('check_out', check_out)]
+    if params.get('bbox'):
+        parts = [_number(part, float) for part in params['bbox'].split(',')]
+        if None not in parts:
+            normalized.append(('bbox', ','.join(parts)))
+    if params.get('superhost'):
+        normalized.append(('superhost', '1'))
+    if params.get('sort') in SORTS:
+        normalized.append(('sort', params['sort']))
+    if params.get('cursor'):
+        normalized.append(('cursor', params['cursor']))
+    return sorted(normalized)
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, _new_version(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _new_version():
+    # Random rather than counting up, so a version evicted from the cache
+    # never comes back and revives entries written under it
+    return uuid.uuid4().hex[:12]
+
+
+def bump_version():
+    """Make every cached page unreachable; call after writes that bypass the signals."""
+    cache.set(VERSION_KEY, _new_version(), None)
+
+
+def make_key(params):
+    digest = hashlib.sha1(repr(normalize(params)).encode()).hexdigest()
+    return f'{KEY_PREFIX}:{get_version()}:{digest}'
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # First use, or evicted: start the counter
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get(key):
+    """The cached entry under ``key``, or None, counting the hit or miss."""
+    entry = cache.get(key)
+    _count(HITS_KEY if entry is not None else MISSES_KEY)
+    return entry
+
+
+def store(key, page, facet_counts):
+    facet_counts = dict(facet_counts, amenities=[
+        (item['amenity'].pk, item['count']) for item in facet_counts['amenities']
+    ])
+    cache.set(key, {
+        'ids': [property.pk for property in page],
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+        'facets': facet_counts,
+    }, CACHE_TIMEOUT)
+
+
+def facets_of(entry, params, amenity_choices):
+    """
+    The entry's facet counts with amenity ids swapped back for ``amenity_choices``
+    and price links rebuilt from this request's ``params``.
+    """
+    amenities = {amenity.pk: amenity for amenity in amenity_choices}
+    return dict(
+        entry['facets'],
+        amenities=[
+            {'amenity': amenities[pk], 'count': count}
+            for pk, count in entry['facets']['amenities'] if pk in amenities
+        ],
+        prices=[
+            dict(price, query=facets.price_query(params, price['min'], price['max']))
+            for price in entry['facets']['prices']
+        ],
+    )
+
+
+def stats():
+    counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counts.get(HITS_KEY, 0), counts.get(MISSES_KEY, 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+        'version': cache.get(VERSION_KEY),
+    }
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,435 @@
+import hashlib
+import hmac
+import json
+import random
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection
+from django.http import QueryDict
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from app import views
+from app.models import Amenity, Booking, Property
+
+SCENARIOS = [
+    'properties', 'properties_filtered', 'property_detail', 'dashboard',
+    'check_availability_api', 'unavailable_dates_api', 'batch_availability_api', 'stripe_webhook',
+    'booking_status_api', 'stripe_session_url',
+]
+
+# Listing pages the properties scenario spreads its requests over
+LISTING_PAGES = 5
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingWSGIServer(WSGIServer):
+    daemon_threads = True
+
+    def process_request(self, request, client_address):
+        thread = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+        thread.daemon = True
+        thread.start()
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class TestClientTransport:
+    """Send requests through the Django test client, in process."""
+
+    def __init__(self, user):
+        self.client = Client()
+        self.anonymous = Client()
+        if user:
+            self.client.force_login(user)
+
+    def request(self, method, path, body=None, headers=None, authenticated=False):
+        client = self.client if authenticated else self.anonymous
+        extra = {f'HTTP_{name.upper().replace("-", "_")}': value for name, value in (headers or {}).items()}
+        if method == 'POST':
+            response = client.post(path, body, content_type='application/json', **extra)
+        else:
+            response = client.get(path, **extra)
+        return response.status_code, response.get('X-DB-Query-Count')
+
+
+class WSGIServerRunner:
+    """The WSGI application on a local threaded server."""
+
+    def __init__(self, port):
+        self.server = make_server(
+            '127.0.0.1', port, WSGIHandler(),
+            server_class=ThreadingWSGIServer, handler_class=QuietRequestHandler,
+        )
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ASGIServerRunner:
+    """pfa.asgi's application on a local uvicorn server (one event loop, like a uvicorn worker)."""
+
+    def __init__(self, port):
+        try:
+            import uvicorn
+        except ImportError:
+            raise CommandError('--mode asgi requires uvicorn (pip install uvicorn)')
+        from pfa.asgi import application
+
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', port))
+        self.port = sock.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(application, log_level='warning', lifespan='off'))
+        self.thread = threading.Thread(target=self.server.run, kwargs={'sockets': [sock]}, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+
+    def close(self):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+class HTTPTransport:
+    """Send requests over HTTP to a local WSGI or ASGI server."""
+
+    def __init__(self, user, port, runner=WSGIServerRunner):
+        self.server = runner(port)
+        self.base_url = f'http://127.0.0.1:{self.server.port}'
+        self.cookie = None
+        if user:
+            client = Client()
+            client.force_login(user)
+            session = client.cookies[settings.SESSION_COOKIE_NAME].value
+            self.cookie = f'{settings.SESSION_COOKIE_NAME}={session}'
+
+    def request(self, method, path, body=None, headers=None, authenticated=False):
+        headers = dict(headers or {})
+        data = None
+        if method == 'POST':
+            data = body.encode() if isinstance(body, str) else body
+            headers['Content-Type'] = 'application/json'
+        if authenticated and self.cookie:
+            headers['Cookie'] = self.cookie
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status, response.headers.get('X-DB-Query-Count')
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, e.headers.get('X-DB-Query-Count')
+
+    def close(self):
+        self.server.close()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the main pages and APIs and write latency, throughput and query counts to JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per scenario')
+        parser.add_argument(
+            '--mode', choices=['client', 'server', 'asgi'], default='client',
+            help='Drive the views with the test client, or over HTTP against a local WSGI server '
+                 'or (with uvicorn installed) the ASGI application',
+        )
+        parser.add_argument('--concurrency', type=int, default=1, help='Parallel requests (server and asgi modes)')
+        parser.add_argument('--port', type=int, default=0, help='Port of the local server (0 picks a free one)')
+        parser.add_argument(
+            '--scenario', action='append', choices=SCENARIOS, dest='scenarios',
+            help='Scenario to run; repeat to run several (default: all)',
+        )
+        parser.add_argument('--output', help='JSON report path (default: benchmark-<timestamp>.json)')
+        parser.add_argument('--compare', help='Earlier JSON report to print deltas against')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for picking properties and dates')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be positive')
+        if options['concurrency'] > 1 and options['mode'] == 'client':
+            raise CommandError('--concurrency requires --mode server or asgi')
+
+        self.random = random.Random(options['seed'])
+        self.property_ids = list(Property.objects.order_by('?').values_list('id', flat=True)[:1000])
+        if not self.property_ids:
+            raise CommandError('No properties found; run seed_large_dataset first')
+        self.booking_ids = list(
+            Booking.objects.filter(status='pending').order_by('?').values_list('id', flat=True)[:1000]
+        )
+        self.today = timezone.now().date()
+        self.listing_cursors = self.collect_listing_cursors(LISTING_PAGES)
+
+        # The polled booking endpoints only answer the booking's guest
+        guest_id = Booking.objects.filter(status='pending').values_list('guest', flat=True).first()
+        if guest_id is None:
+            raise CommandError('No pending bookings found; run seed_large_dataset first')
+        user = User.objects.get(pk=guest_id)
+        if options['mode'] == 'server':
+            transport = HTTPTransport(user, options['port'])
+        elif options['mode'] == 'asgi':
+            transport = HTTPTransport(user, options['port'], runner=ASGIServerRunner)
+        else:
+            transport = TestClientTransport(user)
+
+        hold = self.create_hold(user)
+        self.hold_ids = [hold.pk]
+        self.own_booking_ids = list(
+            Booking.objects.filter(guest=user, status='pending').values_list('id', flat=True)[:1000]
+        )
+        results = {}
+        try:
+            for name in options['scenarios'] or SCENARIOS:
+                results[name] = self.run_scenario(name, transport, options)
+                self.print_result(name, results[name])
+        finally:
+            if isinstance(transport, HTTPTransport):
+                transport.close()
+            hold.delete()
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'git_commit': self.git_commit(),
+            'mode': options['mode'],
+            'concurrency': options['concurrency'],
+            'requests_per_scenario': options['requests'],
+            'database': connection.vendor,
+            'dataset': {
+                'properties': Property.objects.count(),
+                'bookings': Booking.objects.count(),
+                'users': User.objects.count(),
+            },
+            'scenarios': results,
+        }
+        output = options['output'] or f'benchmark-{timezone.now():%Y%m%d-%H%M%S}.json'
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        if options['compare']:
+            self.print_comparison(options['compare'], results)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully wrote benchmark report to {output}'))
+
+    def run_scenario(self, name, transport, options):
+        build = getattr(self, f'build_{name}')
+
+        def send(_):
+            method, path, body, headers, authenticated = build()
+            start = time.perf_counter()
+            status, query_count = transport.request(method, path, body, headers, authenticated)
+            return time.perf_counter() - start, status, query_count
+
+        for i in range(options['warmup']):
+            send(i)
+
+        started = time.perf_counter()
+        if options['concurrency'] > 1:
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                samples = list(executor.map(send, range(options['requests'])))
+        else:
+            samples = [send(i) for i in range(options['requests'])]
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(duration * 1000 for duration, _, _ in samples)
+        query_counts = [int(count) for _, _, count in samples if count is not None]
+        return {
+            'requests': len(samples),
+            # Error pages answer fast, so any of them skews the timings
+            'errors': sum(1 for _, status, _ in samples if not 200 <= status < 400),
+            'status_codes': {
+                str(code): sum(1 for _, status, _ in samples if status == code)
+                for code in sorted({status for _, status, _ in samples})
+            },
+            'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 2) if latencies else None,
+                'p50': round(percentile(latencies, 50), 2) if latencies else None,
+                'p95': round(percentile(latencies, 95), 2) if latencies else None,
+                'p99': round(percentile(latencies, 99), 2) if latencies else None,
+                'max': round(latencies[-1], 2) if latencies else None,
+            },
+            'queries': {
+                'mean': round(sum(query_counts) / len(query_counts), 2) if query_counts else None,
+                'max': max(query_counts) if query_counts else None,
+            },
+        }
+
+    def create_hold(self, user):
+        """
+        A pending booking of ``user`` with an open Checkout session, which the
+        Stripe session endpoint needs and seeded bookings lack. Deleted when
+        the run ends.
+        """
+        check_in = self.today + timedelta(days=self.random.randint(3 * 365, 4 * 365))
+        for property_id in self.property_ids:
+            try:
+                return Booking.objects.create(
+                    property_obj_id=property_id,
+                    guest=user,
+                    check_in=check_in,
+                    check_out=check_in + timedelta(days=1),
+                    guests=1,
+                    total_price=0,
+                    stripe_session_id=f'cs_bench_{self.random.getrandbits(48):x}',
+                    stripe_session_url='https://checkout.stripe.com/c/pay/cs_bench',
+                    stripe_session_status='open',
+                    stripe_session_expires_at=timezone.now() + timedelta(days=1),
+                    expires_at=timezone.now() + timedelta(days=1),
+                )
+            except IntegrityError:
+                continue
+        raise CommandError(f'No property is free on {check_in} for the benchmark booking')
+
+    def random_stay(self):
+        check_in = self.today + timedelta(days=self.random.randint(1, 180))
+        return check_in, check_in + timedelta(days=self.random.randint(1, 10))
+
+    def collect_listing_cursors(self, pages):
+        """
+        The cursors of the listing's first ``pages`` pages (None for the first),
+        followed through each page's next cursor as the page's links do.
+        """
+        amenity_choices = list(Amenity.objects.order_by('name'))
+        cursors = [None]
+        while len(cursors) < pages:
+            params = QueryDict(urllib.parse.urlencode({'cursor': cursors[-1]}) if cursors[-1] else '')
+            page, _ = views.listing_page(params, amenity_choices)
+            if not page.next_cursor:
+                break
+            cursors.append(page.next_cursor)
+        return cursors
+
+    def build_properties(self):
+        cursor = self.random.choice(self.listing_cursors)
+        query = f'?{urllib.parse.urlencode({"cursor": cursor})}' if cursor else ''
+        return 'GET', f'{reverse("properties")}{query}', None, None, False
+
+    def build_properties_filtered(self):
+        check_in, check_out = self.random_stay()
+        query = f'check_in={check_in}&check_out={check_out}&guests=2&sort=rating'
+        return 'GET', f'{reverse("properties")}?{query}', None, None, False
+
+    def build_property_detail(self):
+        path = reverse('property_detail', kwargs={'pk': self.random.choice(self.property_ids)})
+        return 'GET', path, None, None, True
+
+    def build_dashboard(self):
+        return 'GET', reverse('dashboard'), None, None, True
+
+    def build_check_availability_api(self):
+        check_in, check_out = self.random_stay()
+        path = reverse('check_availability_api', kwargs={'property_id': self.random.choice(self.property_ids)})
+        return 'GET', f'{path}?check_in={check_in}&check_out={check_out}', None, None, False
+
+    def build_unavailable_dates_api(self):
+        path = reverse('get_unavailable_dates_api', kwargs={'property_id': self.random.choice(self.property_ids)})
+        return 'GET', path, None, None, False
+
+    def build_batch_availability_api(self):
+        queries = []
+        for property_id in self.random.sample(self.property_ids, min(50, len(self.property_ids))):
+            check_in, check_out = self.random_stay()
+            queries.append([property_id, str(check_in), str(check_out)])
+        return 'POST', reverse('batch_availability_api'), json.dumps({'queries': queries}), None, False
+
+    def build_booking_status_api(self):
+        booking_id = self.random.choice(self.own_booking_ids)
+        return 'GET', reverse('get_booking_status_api', kwargs={'booking_id': booking_id}), None, None, True
+
+    def build_stripe_session_url(self):
+        booking_id = self.random.choice(self.hold_ids)
+        return 'GET', reverse('get_stripe_session_url', kwargs={'booking_id': booking_id}), None, None, True
+
+    def build_stripe_webhook(self):
+        # A signed checkout.session.completed event for a pending booking, or an
+        # ignored event type when the dataset has none, so the view does real work
+        booking_id = self.random.choice(self.booking_ids) if self.booking_ids else None
+        event = {
+            'id': f'evt_bench_{self.random.getrandbits(48):x}',
+            'object': 'event',
+            'type': 'checkout.session.completed' if booking_id else 'customer.created',
+            'data': {'object': {
+                'id': f'cs_bench_{booking_id}',
+                'object': 'checkout.session',
+                'metadata': {'booking_id': str(booking_id)} if booking_id else {},
+                'payment_status': 'paid',
+                'status': 'complete',
+            }},
+        }
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = hmac.new(
+            settings.STRIPE_WEBHOOK_SECRET.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256
+        ).hexdigest()
+        headers = {'Stripe-Signature': f't={timestamp},v1={signature}'}
+        return 'POST', reverse('stripe_webhook'), payload, headers, False
+
+    def print_result(self, name, result):
+        latency = result['latency_ms']
+        self.stdout.write(
+            f'{name:<26} p50 {latency["p50"]:>8} ms  p95 {latency["p95"]:>8} ms  p99 {latency["p99"]:>8} ms  '
+            f'{result["throughput_rps"]:>8} req/s  {result["queries"]["mean"]} queries  {result["errors"]} errors'
+        )
+
+    def print_comparison(self, path, results):
+        with open(path) as f:
+            previous = json.load(f)['scenarios']
+        self.stdout.write(f'\nChange against {path}:')
+        for name, result in results.items():
+            if name not in previous:
+                continue
+            before, after = previous[name], result
+            deltas = []
+            for pct in ('p50', 'p95', 'p99'):
+                old, new = before['latency_ms'][pct], after['latency_ms'][pct]
+                if old:
+                    deltas.append(f'{pct} {(new - old) / old:+.1%}')
+            old_queries, new_queries = before['queries']['mean'], after['queries']['mean']
+            if old_queries is not None and new_queries is not None:
+                deltas.append(f'queries {new_queries - old_queries:+.2f}')
+            self.stdout.write(f'{name:<26} ' + '  '.join(deltas))
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -1,6 +1,4 @@
 from django.core.management.base import BaseCommand
-from django.utils import timezone
-from django.db import transaction
 from app.models import Booking
 
 class Command(BaseCommand):
@@ -12,40 +10,38 @@ class Command(BaseCommand):
             action='store_true',
             help='Show what would be cleaned up without actually doing it',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of bookings cancelled or completed per statement',
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
         
-        # Find expired pending bookings using the new expiry logic
-        expired_bookings = Booking.objects.filter(
-            status='pending',
-            payment_status='pending'
-        )
-        
-        # Filter to only include actually expired bookings
-        expired_bookings = [booking for booking in expired_bookings if booking.is_expired]
+        # Expired holds are found by the indexed expires_at column
+        expired_bookings = Booking.objects.expired()
         
         # Find past bookings that should be marked as completed
-        past_bookings = Booking.objects.filter(
-            status='confirmed',
-            check_out__lt=timezone.now().date()
-        )
+        past_bookings = Booking.objects.finished()
         
         if dry_run:
+            expired_total = expired_bookings.count()
             self.stdout.write(
                 self.style.WARNING(
-                    f'DRY RUN - Would clean up {len(expired_bookings)} expired bookings and mark {past_bookings.count()} as completed'
+                    f'DRY RUN - Would clean up {expired_total} expired bookings and mark {past_bookings.count()} as completed'
                 )
             )
             
-            if expired_bookings:
+            if expired_total:
                 self.stdout.write('\nExpired bookings that would be cancelled:')
-                for booking in expired_bookings[:10]:  # Show first 10
+                for booking in expired_bookings.select_related('property_obj')[:10]:  # Show first 10
                     self.stdout.write(
-                        f'  - Booking {booking.id}: {booking.property_obj.title} ({booking.check_in} to {booking.check_out}) - Expired at {booking.reservation_expires_at}'
+                        f'  - Booking {booking.id}: {booking.property_obj.title} ({booking.check_in} to {booking.check_out}) - Expired at {booking.expires_at}'
                     )
-                if len(expired_bookings) > 10:
-                    self.stdout.write(f'  ... and {len(expired_bookings) - 10} more')
+                if expired_total > 10:
+                    self.stdout.write(f'  ... and {expired_total - 10} more')
             
             if past_bookings.exists():
                 self.stdout.write('\nPast bookings that would be marked as completed:')
@@ -56,20 +52,14 @@ class Command(BaseCommand):
                 if past_bookings.count() > 10:
                     self.stdout.write(f'  ... and {past_bookings.count() - 10} more')
         else:
-            with transaction.atomic():
-                # Cancel expired bookings
-                expired_count = 0
-                for booking in expired_bookings:
-                    booking.status = 'cancelled'
-                    booking.payment_status = 'failed'
-                    booking.save()
-                    expired_count += 1
-                
-                # Mark past bookings as completed
-                completed_count = past_bookings.update(status='completed')
-                
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f'Successfully cleaned up {expired_count} expired bookings and marked {completed_count} as completed'
-                    )
-                ) 
\ No newline at end of file
+            # Cancel expired bookings, a batch per transaction
+            expired_count = expired_bookings.expire_holds(batch_size=options['batch_size'])
+            
+            # Mark past bookings as completed, also in batches
+            completed_count = past_bookings.complete_finished(batch_size=options['batch_size'])
+            
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Successfully cleaned up {expired_count} expired bookings and marked {completed_count} as completed'
+                )
+            ) 
\ No newline at end of file
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from app import images
+from app.models import PropertyImage
+
+class Command(BaseCommand):
+    help = 'Generate the responsive derivatives of property images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate the derivatives of every image, e.g. after changing images.WIDTHS',
+        )
+
+    def handle(self, *args, **options):
+        generated = skipped = 0
+        for image in PropertyImage.objects.order_by('id').iterator():
+            if not options['force'] and images.is_current(image):
+                continue
+            if images.refresh(image):
+                generated += 1
+            else:
+                skipped += 1
+                self.stdout.write(self.style.WARNING(f'Skipped image {image.pk}: {image.image.name} is missing or unreadable'))
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully generated derivatives of {generated} image(s), skipped {skipped}')
+        )
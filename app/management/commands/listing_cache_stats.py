@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from app import listing_cache
+
+class Command(BaseCommand):
+    help = 'Show the hit and miss counters of the listing result cache (needs a cache shared between processes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after showing them')
+        parser.add_argument('--clear', action='store_true', help='Drop every cached listing page')
+
+    def handle(self, *args, **options):
+        stats = listing_cache.stats()
+        self.stdout.write(
+            f'Hits: {stats["hits"]}  Misses: {stats["misses"]}  '
+            f'Hit rate: {stats["hit_rate"]:.1%}  Version: {stats["version"]}'
+        )
+        if options['clear']:
+            listing_cache.bump_version()
+            self.stdout.write(self.style.SUCCESS('Successfully cleared the listing cache'))
+        if options['reset']:
+            listing_cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Successfully reset the listing cache counters'))
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+from app import scheduler, webhooks
+
+LEASE_NAME = 'stripe-webhooks'
+
+class Command(BaseCommand):
+    help = 'Apply the Stripe webhook events recorded in the ledger, in order; one worker processes at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of events applied per pass',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2,
+            help='Seconds to wait when no event is due',
+        )
+        parser.add_argument(
+            '--lease-ttl',
+            type=int,
+            default=120,
+            help='Seconds before an unrenewed lease can be taken by another worker',
+        )
+        parser.add_argument('--once', action='store_true', help='Apply the events due now and exit')
+
+    def handle(self, *args, **options):
+        owner = scheduler.worker_name()
+        processed = failed = 0
+        try:
+            while True:
+                if not scheduler.acquire_lease(owner, options['lease_ttl'], name=LEASE_NAME):
+                    if options['once']:
+                        self.stdout.write(self.style.WARNING('Another worker holds the lease; nothing done'))
+                        return
+                    time.sleep(options['interval'])
+                    continue
+                result = webhooks.process(options['batch_size'])
+                processed += result['processed']
+                failed += result['failed']
+                if result['processed'] or result['failed']:
+                    self.stdout.write(f'Processed {result["processed"]}, failed {result["failed"]}')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            scheduler.release_lease(owner, name=LEASE_NAME)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully processed {processed} webhook events ({failed} failed attempts)'))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from app import facets, listing_cache
+from app.models import Property
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized rating and wishlist counters and amenity masks on all properties'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of properties updated per statement',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated_count = 0
+        last_id = 0
+
+        # Walk the primary key in ranges so each UPDATE stays short
+        while True:
+            batch_ids = list(
+                Property.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not batch_ids:
+                break
+            batch = Property.objects.filter(id__gte=batch_ids[0], id__lte=batch_ids[-1])
+            updated_count += batch.refresh_aggregates()
+            batch.refresh_amenity_mask()
+            last_id = batch_ids[-1]
+        facets.invalidate()
+        listing_cache.bump_version()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully rebuilt aggregates for {updated_count} properties'
+            )
+        )
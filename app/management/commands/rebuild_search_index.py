@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from app import search
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over property listings'
+
+    def handle(self, *args, **options):
+        if not search.fts_enabled():
+            raise CommandError('The search index is only available on SQLite with FTS5')
+
+        search.install_triggers()
+        search.rebuild_index()
+
+        self.stdout.write(
+            self.style.SUCCESS('Successfully rebuilt the property search index')
+        )
@@ -0,0 +1,67 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from app import payments, webhooks
+from app.models import WebhookEvent
+
+class Command(BaseCommand):
+    help = 'Queue Stripe webhook events again, or backfill missed ones from the Stripe API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event-id', action='append', default=[], help='Replay this event (repeatable)')
+        parser.add_argument('--since', help='Only events created on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--type', action='append', default=[], help='Only events of this type (repeatable)')
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Replay processed events too, not only failed ones',
+        )
+        parser.add_argument(
+            '--fetch',
+            action='store_true',
+            help='Record the events Stripe has since --since that are missing from the ledger',
+        )
+        parser.add_argument('--process', action='store_true', help='Apply the queued events now instead of leaving them to the worker')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = timezone.make_aware(datetime.strptime(options['since'], '%Y-%m-%d'))
+            except ValueError:
+                raise CommandError('--since must be a date in YYYY-MM-DD format')
+
+        if options['fetch']:
+            if since is None:
+                raise CommandError('--fetch needs --since')
+            known = set(WebhookEvent.objects.filter(stripe_created__gte=since).values_list('event_id', flat=True))
+            fetched = 0
+            for event in payments.list_events(since, options['type'] or list(webhooks.HANDLERS)):
+                if event['id'] not in known:
+                    webhooks.record(event)
+                    fetched += 1
+            self.stdout.write(f'Recorded {fetched} events missing from the ledger')
+        else:
+            events = WebhookEvent.objects.all()
+            if options['event_id']:
+                events = events.filter(event_id__in=options['event_id'])
+            elif not options['all']:
+                events = events.filter(status='failed')
+            if since:
+                events = events.filter(stripe_created__gte=since)
+            if options['type']:
+                events = events.filter(type__in=options['type'])
+            self.stdout.write(f'Queued {webhooks.requeue(events)} events for replay')
+
+        if options['process']:
+            processed = failed = 0
+            while True:
+                result = webhooks.process()
+                processed += result['processed']
+                failed += result['failed']
+                if not result['processed'] and not result['failed']:
+                    break
+            self.stdout.write(f'Processed {processed}, failed {failed}')
+
+        self.stdout.write(self.style.SUCCESS('Successfully replayed webhook events'))
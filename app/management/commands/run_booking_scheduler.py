@@ -0,0 +1,74 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app import scheduler
+from app.models import SchedulerLease
+
+class Command(BaseCommand):
+    help = 'Run booking maintenance (expired holds, finished stays) every few seconds; one worker sweeps at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=settings.BOOKING_SCHEDULER_INTERVAL,
+            help='Seconds between sweeps',
+        )
+        parser.add_argument(
+            '--lease-ttl',
+            type=int,
+            default=settings.BOOKING_SCHEDULER_LEASE_TTL,
+            help='Seconds before an unrenewed lease can be taken by another worker',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of bookings cancelled per statement',
+        )
+        parser.add_argument('--once', action='store_true', help='Run a single sweep and exit')
+        parser.add_argument('--status', action='store_true', help='Show the lease holder and last run, then exit')
+
+    def handle(self, *args, **options):
+        if options['status']:
+            self.show_status()
+            return
+
+        if options['lease_ttl'] <= options['interval']:
+            self.stderr.write(self.style.WARNING('The lease TTL should be well above the interval, or workers will alternate'))
+
+        owner = scheduler.worker_name()
+        self.stdout.write(f'Scheduler worker {owner} sweeping every {options["interval"]:g}s')
+        try:
+            while True:
+                result = scheduler.run_once(owner, options['lease_ttl'], options['batch_size'])
+                if result is None:
+                    if options['once']:
+                        self.stdout.write(self.style.WARNING('Another worker holds the lease; nothing done'))
+                        return
+                elif result['processed'] or options['once']:
+                    self.stdout.write(
+                        f'Processed {result["processed"]} of {result["backlog"]} due bookings in {result["duration_ms"]:.0f} ms'
+                    )
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Hand over right away rather than after the TTL
+            scheduler.release_lease(owner)
+
+        self.stdout.write(self.style.SUCCESS('Successfully stopped the booking scheduler'))
+
+    def show_status(self):
+        lease = SchedulerLease.objects.filter(name=scheduler.LEASE_NAME).first()
+        if lease is None or lease.last_run_at is None:
+            self.stdout.write('The booking scheduler has not run yet')
+            return
+        self.stdout.write(
+            f'Holder: {lease.owner or "none"} (until {lease.expires_at})\n'
+            f'Last run: {lease.last_run_at}  Duration: {lease.last_duration_ms:.0f} ms  '
+            f'Backlog: {lease.last_backlog}  Processed: {lease.last_processed}'
+        )
@@ -0,0 +1,240 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from app.models import (
+    Amenity, Booking, Property, PropertyImage, PropertyNight, Review, UserProfile, Wishlist,
+)
+
+CITIES = [
+    'Paris', 'Lyon', 'Marseille', 'Nice', 'Bordeaux', 'Casablanca', 'Marrakech',
+    'Rabat', 'Fes', 'Tangier', 'Agadir', 'Barcelona', 'Lisbon', 'Rome', 'London',
+]
+AMENITY_ICONS = ['fas fa-wifi', 'fas fa-swimming-pool', 'fas fa-parking', 'fas fa-snowflake', 'fas fa-utensils']
+REVIEW_TEXTS = ['Great stay', 'Lovely host', 'Would come back', 'Clean and quiet', 'Good value']
+SEED_PREFIX = 'seed_'
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Bulk-create a large synthetic dataset for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20000, help='Number of guest users')
+        parser.add_argument('--hosts', type=int, default=2000, help='Number of host users')
+        parser.add_argument('--properties', type=int, default=100000, help='Number of properties')
+        parser.add_argument('--bookings', type=int, default=1000000, help='Number of bookings')
+        parser.add_argument('--reviews', type=int, default=500000, help='Number of reviews')
+        parser.add_argument('--wishlists', type=int, default=300000, help='Number of wishlist entries')
+        parser.add_argument('--images-per-property', type=int, default=3, help='Images attached to each property')
+        parser.add_argument('--amenities', type=int, default=30, help='Number of amenities')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk_create statement')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, so runs are reproducible')
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['hosts'], options['properties'], options['batch_size']) < 1:
+            raise CommandError('--users, --hosts, --properties and --batch-size must be positive')
+
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.today = timezone.now().date()
+        # Offset usernames so the command can be run again on top of an earlier seed
+        self.offset = User.objects.filter(username__startswith=SEED_PREFIX).count()
+        self.password = make_password('password')
+
+        guest_ids = self.create_users('guest', options['users'], role='user')
+        host_ids = self.create_users('host', options['hosts'], role='host')
+        amenity_ids = self.create_amenities(options['amenities'])
+        self.stdout.write(f'Created {len(guest_ids)} guests, {len(host_ids)} hosts and {len(amenity_ids)} amenities')
+
+        counts = dict.fromkeys(['properties', 'images', 'bookings', 'nights', 'reviews', 'wishlists'], 0)
+        total = options['properties']
+        per_property = {
+            key: options[key] / total for key in ('bookings', 'reviews', 'wishlists')
+        }
+
+        # Properties are created batch by batch and everything hanging off a
+        # batch is created straight away, so memory stays flat at any volume
+        for start in range(0, total, self.batch_size):
+            size = min(self.batch_size, total - start)
+            with transaction.atomic():
+                properties = Property.objects.bulk_create(
+                    [self.build_property(start + i, host_ids) for i in range(size)]
+                )
+                counts['properties'] += len(properties)
+                counts['images'] += self.create_images(properties, options['images_per_property'])
+                self.link_amenities(properties, amenity_ids)
+                bookings, nights = self.create_bookings(properties, guest_ids, per_property['bookings'])
+                counts['bookings'] += bookings
+                counts['nights'] += nights
+                counts['reviews'] += self.create_reviews(properties, guest_ids, per_property['reviews'])
+                counts['wishlists'] += self.create_wishlists(properties, guest_ids, per_property['wishlists'])
+            self.stdout.write(f'  {counts["properties"]}/{total} properties')
+
+        # bulk_create skips the signals that maintain the denormalized counters and amenity masks
+        call_command('rebuild_property_aggregates', batch_size=self.batch_size, stdout=self.stdout)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                'Successfully seeded ' + ', '.join(f'{count} {name}' for name, count in counts.items())
+            )
+        )
+
+    def quota(self, rate):
+        """Round a fractional per-property rate up or down at random, keeping the expected total."""
+        whole = int(rate)
+        return whole + (self.random.random() < rate - whole)
+
+    def create_users(self, kind, count, role):
+        ids = []
+        for batch in batched(range(count), self.batch_size):
+            with transaction.atomic():
+                users = User.objects.bulk_create([
+                    User(
+                        username=f'{SEED_PREFIX}{kind}_{self.offset + n}',
+                        email=f'{SEED_PREFIX}{kind}_{self.offset + n}@example.com',
+                        password=self.password,
+                    )
+                    for n in batch
+                ])
+                # bulk_create bypasses the post_save signal that creates profiles
+                UserProfile.objects.bulk_create([UserProfile(user=user, role=role) for user in users])
+            ids.extend(user.pk for user in users)
+        return ids
+
+    def create_amenities(self, count):
+        # bulk_create skips Amenity.save, which assigns the slug and mask bit
+        free_bits = Amenity.free_bits()
+        if count > len(free_bits):
+            raise CommandError(f'Only {len(free_bits)} more amenities fit in the amenity bitmask')
+        amenities = Amenity.objects.bulk_create([
+            Amenity(
+                name=f'Amenity {self.offset + n}',
+                slug=f'{SEED_PREFIX}amenity-{self.offset + n}',
+                icon=AMENITY_ICONS[n % len(AMENITY_ICONS)],
+                bit=free_bits[n],
+            )
+            for n in range(count)
+        ])
+        return [amenity.pk for amenity in amenities]
+
+    def build_property(self, n, host_ids):
+        rng = self.random
+        bedrooms = rng.randint(1, 6)
+        return Property(
+            host_id=rng.choice(host_ids),
+            title=f'Seed property {self.offset + n}',
+            description='Synthetic property created for load testing.',
+            property_type=rng.choice(Property.PROPERTY_TYPES)[0],
+            space_type=rng.choice(Property.SPACE_TYPES)[0],
+            location=rng.choice(CITIES),
+            price_per_night=Decimal(rng.randint(30, 900)),
+            bedrooms=bedrooms,
+            bathrooms=rng.randint(1, bedrooms),
+            beds=bedrooms + rng.randint(0, 2),
+            max_guests=bedrooms * 2,
+            cleaning_fee=Decimal(rng.randint(0, 80)),
+            service_fee=Decimal(rng.randint(5, 40)),
+            latitude=Decimal(f'{rng.uniform(27.0, 51.0):.6f}'),
+            longitude=Decimal(f'{rng.uniform(-10.0, 13.0):.6f}'),
+            is_superhost=rng.random() < 0.1,
+        )
+
+    def create_images(self, properties, per_property):
+        images = [
+            PropertyImage(property=property, image=f'properties/seed-{property.pk}-{i}.jpg', is_primary=i == 0)
+            for property in properties
+            for i in range(per_property)
+        ]
+        PropertyImage.objects.bulk_create(images, batch_size=self.batch_size)
+        return len(images)
+
+    def link_amenities(self, properties, amenity_ids):
+        if not amenity_ids:
+            return
+        through = Amenity.properties.through
+        links = [
+            through(property_id=property.pk, amenity_id=amenity_id)
+            for property in properties
+            for amenity_id in self.random.sample(amenity_ids, self.random.randint(1, min(8, len(amenity_ids))))
+        ]
+        through.objects.bulk_create(links, batch_size=self.batch_size)
+
+    def create_bookings(self, properties, guest_ids, rate):
+        """
+        Lay each property's bookings end to end with random gaps so they never
+        overlap, then claim the nights of the active ones as Booking.save would.
+        """
+        rng = self.random
+        bookings = []
+        for property in properties:
+            count = self.quota(rate)
+            # Roughly the last fifth of each calendar lies in the future
+            night = self.today - timedelta(days=count * 5)
+            for _ in range(count):
+                night += timedelta(days=rng.randint(0, 3))
+                stay = rng.randint(1, 7)
+                if night + timedelta(days=stay) <= self.today:
+                    status = rng.choice(['completed', 'completed', 'completed', 'cancelled'])
+                else:
+                    status = rng.choice(['pending', 'confirmed', 'confirmed'])
+                bookings.append(Booking(
+                    property_obj=property,
+                    guest_id=rng.choice(guest_ids),
+                    check_in=night,
+                    check_out=night + timedelta(days=stay),
+                    guests=rng.randint(1, property.max_guests),
+                    total_price=property.price_per_night * stay + property.cleaning_fee + property.service_fee,
+                    status=status,
+                    payment_status='paid' if status != 'cancelled' else 'failed',
+                ))
+                night += timedelta(days=stay)
+
+        night_count = 0
+        for batch in batched(bookings, self.batch_size):
+            Booking.objects.bulk_create(batch)
+            nights = [
+                PropertyNight(property_id=booking.property_obj_id, booking=booking, night=night)
+                for booking in batch
+                if booking.status in Booking.ACTIVE_STATUSES
+                for night in booking.iter_nights()
+            ]
+            PropertyNight.objects.bulk_create(nights, batch_size=self.batch_size)
+            night_count += len(nights)
+        return len(bookings), night_count
+
+    def create_reviews(self, properties, guest_ids, rate):
+        reviews = [
+            Review(
+                property=property,
+                user_id=self.random.choice(guest_ids),
+                rating=self.random.choices([1, 2, 3, 4, 5], weights=[1, 1, 3, 8, 10])[0],
+                comment=self.random.choice(REVIEW_TEXTS),
+            )
+            for property in properties
+            for _ in range(self.quota(rate))
+        ]
+        Review.objects.bulk_create(reviews, batch_size=self.batch_size)
+        return len(reviews)
+
+    def create_wishlists(self, properties, guest_ids, rate):
+        wishlists = [
+            Wishlist(property=property, user_id=user_id)
+            for property in properties
+            for user_id in self.random.sample(guest_ids, min(self.quota(rate), len(guest_ids)))
+        ]
+        Wishlist.objects.bulk_create(wishlists, batch_size=self.batch_size)
+        return len(wishlists)
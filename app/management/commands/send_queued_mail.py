@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+from app import outbox, scheduler
+
+LEASE_NAME = 'email-outbox'
+
+class Command(BaseCommand):
+    help = 'Send the e-mails queued in the outbox, retrying failures with backoff; one worker sends at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of e-mails sent per connection',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Seconds to wait when the outbox is empty',
+        )
+        parser.add_argument(
+            '--lease-ttl',
+            type=int,
+            default=120,
+            help='Seconds before an unrenewed lease can be taken by another worker',
+        )
+        parser.add_argument('--once', action='store_true', help='Send what is due now and exit')
+
+    def handle(self, *args, **options):
+        owner = scheduler.worker_name()
+        sent = failed = 0
+        try:
+            while True:
+                if not scheduler.acquire_lease(owner, options['lease_ttl'], name=LEASE_NAME):
+                    if options['once']:
+                        self.stdout.write(self.style.WARNING('Another worker holds the lease; nothing done'))
+                        return
+                    time.sleep(options['interval'])
+                    continue
+                result = outbox.drain(options['batch_size'])
+                sent += result['sent']
+                failed += result['failed']
+                if result['sent'] or result['failed']:
+                    self.stdout.write(f'Sent {result["sent"]}, failed {result["failed"]}')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            scheduler.release_lease(owner, name=LEASE_NAME)
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully sent {sent} e-mails ({failed} failed attempts)'))
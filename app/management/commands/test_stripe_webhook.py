@@ -2,8 +2,10 @@ from django.core.management.base import BaseCommand
 from django.test import Client
 from django.urls import reverse
 import json
+import uuid
 import stripe
 from django.conf import settings
+from app import webhooks
 
 class Command(BaseCommand):
     help = 'Test Stripe webhook functionality'
@@ -34,7 +36,7 @@ class Command(BaseCommand):
         # Create test webhook event
         if event_type == 'checkout.session.completed':
             event_data = {
-                'id': 'evt_test_webhook',
+                'id': f'evt_test_{uuid.uuid4().hex}',
                 'object': 'event',
                 'api_version': '2020-08-27',
                 'created': 1234567890,
@@ -60,7 +62,7 @@ class Command(BaseCommand):
             }
         elif event_type == 'payment_intent.succeeded':
             event_data = {
-                'id': 'evt_test_webhook',
+                'id': f'evt_test_{uuid.uuid4().hex}',
                 'object': 'event',
                 'api_version': '2020-08-27',
                 'created': 1234567890,
@@ -84,7 +86,7 @@ class Command(BaseCommand):
             }
         elif event_type == 'payment_intent.payment_failed':
             event_data = {
-                'id': 'evt_test_webhook',
+                'id': f'evt_test_{uuid.uuid4().hex}',
                 'object': 'event',
                 'api_version': '2020-08-27',
                 'created': 1234567890,
@@ -145,6 +147,9 @@ class Command(BaseCommand):
         self.stdout.write(f'Response content: {response.content.decode()}')
         
         if response.status_code == 200:
+            # The view only records the event; apply it as the worker would
+            result = webhooks.process()
+            self.stdout.write(f'Processed: {result["processed"]}, failed: {result["failed"]}')
             self.stdout.write(
                 self.style.SUCCESS('Webhook test PASSED')
             )
@@ -0,0 +1,65 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger('app.queries')
+
+
+class QueryStats:
+    """Database execute wrapper counting queries and their cumulative time."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class QueryCountMiddleware:
+    """
+    Record the number of SQL queries and the time spent in them for every
+    request. The figures are sent back as X-DB-Query-Count and
+    X-DB-Query-Time-Ms headers and logged to the 'app.queries' logger,
+    at WARNING level once QUERY_COUNT_WARNING_THRESHOLD is exceeded.
+
+    Under ASGI, queries run on a thread shared by all requests and cannot be
+    attributed to one, so requests pass through uncounted. The middleware is
+    async-capable so that waiting async views (booking_status_stream) do not
+    hold that thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'QUERY_COUNT_WARNING_THRESHOLD', 50)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+        stats = QueryStats()
+        with connection.execute_wrapper(stats):
+            response = self.get_response(request)
+
+        duration_ms = stats.duration * 1000
+        response['X-DB-Query-Count'] = str(stats.count)
+        response['X-DB-Query-Time-Ms'] = f'{duration_ms:.1f}'
+
+        level = logging.WARNING if stats.count > self.threshold else logging.DEBUG
+        logger.log(
+            level,
+            '%s %s -> %s: %d queries in %.1f ms',
+            request.method, request.path, response.status_code, stats.count, duration_ms,
+        )
+        return response
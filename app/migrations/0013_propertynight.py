@@ -0,0 +1,48 @@
+# Generated by Django 5.0.2 on 2026-10-18 18:27
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def claim_active_booking_nights(apps, schema_editor):
+    Booking = apps.get_model('app', 'Booking')
+    PropertyNight = apps.get_model('app', 'PropertyNight')
+    nights = []
+    bookings = Booking.objects.filter(status__in=['pending', 'confirmed']).order_by('created_at')
+    for booking in bookings.iterator():
+        night = booking.check_in
+        while night < booking.check_out:
+            nights.append(PropertyNight(property_id=booking.property_obj_id, booking_id=booking.id, night=night))
+            night += timedelta(days=1)
+    # Pre-existing overlaps keep the night with the earliest booking
+    PropertyNight.objects.bulk_create(nights, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_propertycomment'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='booking',
+            unique_together=set(),
+        ),
+        migrations.CreateModel(
+            name='PropertyNight',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('night', models.DateField()),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='nights', to='app.booking')),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='claimed_nights', to='app.property')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='propertynight',
+            constraint=models.UniqueConstraint(fields=('property', 'night'), name='unique_property_night'),
+        ),
+        migrations.RunPython(claim_active_booking_nights, migrations.RunPython.noop),
+    ]
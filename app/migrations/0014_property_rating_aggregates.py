@@ -0,0 +1,53 @@
+# Generated by Django 5.0.2 on 2026-10-18 18:30
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Cast, Coalesce, Greatest
+
+
+def backfill_property_aggregates(apps, schema_editor):
+    Property = apps.get_model('app', 'Property')
+
+    def subquery(model_name, aggregate):
+        model = apps.get_model('app', model_name)
+        values = model.objects.filter(property=models.OuterRef('pk')).order_by().values('property')
+        return Coalesce(models.Subquery(values.annotate(value=aggregate).values('value')), 0)
+
+    rating_count = subquery('Review', models.Count('id')) + subquery('PropertyComment', models.Count('id'))
+    rating_sum = subquery('Review', models.Sum('rating')) + subquery('PropertyComment', models.Sum('rating'))
+    Property.objects.update(
+        rating_count=rating_count,
+        rating_avg=Cast(rating_sum, models.FloatField()) / Greatest(rating_count, 1),
+        wishlist_count=subquery('Wishlist', models.Count('id')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_propertynight'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='rating_avg',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='wishlist_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(fields=['-rating_avg', '-rating_count'], name='app_property_rating_idx'),
+        ),
+        migrations.RunPython(backfill_property_aggregates, migrations.RunPython.noop),
+    ]
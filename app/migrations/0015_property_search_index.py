@@ -0,0 +1,83 @@
+import app.models
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+FTS_TABLE = 'app_property_fts'
+COLUMNS = 'title, description, location, highlights'
+NEW_VALUES = 'new.id, new.title, new.description, new.location, new.highlights'
+OLD_VALUES = 'old.id, old.title, old.description, old.location, old.highlights'
+
+CREATE_STATEMENTS = [
+    f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        {COLUMNS},
+        content='app_property', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON app_property BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {COLUMNS}) VALUES ({NEW_VALUES});
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON app_property BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {COLUMNS}) VALUES ('delete', {OLD_VALUES});
+    END
+    """,
+    # Only text changes touch the index; counter refreshes leave it alone
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF {COLUMNS} ON app_property BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {COLUMNS}) VALUES ('delete', {OLD_VALUES});
+        INSERT INTO {FTS_TABLE}(rowid, {COLUMNS}) VALUES ({NEW_VALUES});
+    END
+    """,
+    # Rank by bm25 weighting title, description, location and highlights
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', 'bm25(10.0, 1.0, 8.0, 4.0)')",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+
+def create_search_index(apps, schema_editor):
+    # Other backends use the unindexed fallback in app.search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(CREATE_STATEMENTS[0])
+    except OperationalError:
+        # SQLite built without FTS5
+        return
+    for statement in CREATE_STATEMENTS[1:]:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for suffix in ('insert', 'delete', 'update'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_property_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.CreateModel(
+            name='PropertySearchDocument',
+            fields=[
+                ('property', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='app.property')),
+                ('document', app.models.SearchDocumentField(db_column='app_property_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'app_property_fts',
+                'managed': False,
+            },
+        ),
+    ]
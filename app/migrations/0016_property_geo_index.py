@@ -0,0 +1,79 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+GEO_TABLE = 'app_property_geo'
+
+CREATE_STATEMENTS = [
+    f"CREATE VIRTUAL TABLE {GEO_TABLE} USING rtree(id, min_lat, max_lat, min_lng, max_lng)",
+    f"""
+    CREATE TRIGGER {GEO_TABLE}_insert AFTER INSERT ON app_property
+    WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+        INSERT INTO {GEO_TABLE} VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {GEO_TABLE}_delete AFTER DELETE ON app_property BEGIN
+        DELETE FROM {GEO_TABLE} WHERE id = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER {GEO_TABLE}_update AFTER UPDATE OF latitude, longitude ON app_property BEGIN
+        DELETE FROM {GEO_TABLE} WHERE id = old.id;
+        INSERT INTO {GEO_TABLE}
+            SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+            WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+    END
+    """,
+    f"""
+    INSERT INTO {GEO_TABLE}
+        SELECT id, latitude, latitude, longitude, longitude FROM app_property
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    """,
+]
+
+
+def create_geo_index(apps, schema_editor):
+    # Other backends filter the coordinate columns directly, see app.geo
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(CREATE_STATEMENTS[0])
+    except OperationalError:
+        # SQLite built without the R-tree module
+        return
+    for statement in CREATE_STATEMENTS[1:]:
+        schema_editor.execute(statement)
+
+
+def drop_geo_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for suffix in ('insert', 'delete', 'update'):
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {GEO_TABLE}_{suffix}')
+    schema_editor.execute(f'DROP TABLE IF EXISTS {GEO_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_property_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_geo_index, drop_geo_index),
+        migrations.CreateModel(
+            name='PropertyGeoPoint',
+            fields=[
+                ('property', models.OneToOneField(db_column='id', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='geo_point', serialize=False, to='app.property')),
+                ('min_lat', models.FloatField()),
+                ('max_lat', models.FloatField()),
+                ('min_lng', models.FloatField()),
+                ('max_lng', models.FloatField()),
+            ],
+            options={
+                'db_table': 'app_property_geo',
+                'managed': False,
+            },
+        ),
+    ]
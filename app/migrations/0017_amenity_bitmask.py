@@ -0,0 +1,68 @@
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+from django.utils.text import slugify
+
+MASK_BITS = 63
+
+
+def backfill_amenity_bits(apps, schema_editor):
+    Amenity = apps.get_model('app', 'Amenity')
+    Property = apps.get_model('app', 'Property')
+
+    amenities = list(Amenity.objects.order_by('id'))
+    if len(amenities) > MASK_BITS:
+        raise RuntimeError(f'Found {len(amenities)} amenities; the amenity bitmask holds at most {MASK_BITS}')
+
+    slugs = set()
+    for bit, amenity in enumerate(amenities):
+        slug = base = slugify(amenity.name) or f'amenity-{amenity.id}'
+        suffix = 1
+        while slug in slugs:
+            suffix += 1
+            slug = f'{base}-{suffix}'
+        slugs.add(slug)
+        amenity.slug, amenity.bit = slug, bit
+    Amenity.objects.bulk_update(amenities, ['slug', 'bit'])
+
+    bits = Amenity.properties.through.objects.filter(
+        property=models.OuterRef('pk')
+    ).order_by().values('property').annotate(
+        mask=models.Sum(models.Value(1, output_field=models.BigIntegerField()).bitleftshift(models.F('amenity__bit')))
+    ).values('mask')
+    Property.objects.update(amenity_mask=Coalesce(models.Subquery(bits), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_property_geo_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='amenity',
+            name='slug',
+            field=models.SlugField(max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='amenity',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='amenity_mask',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_amenity_bits, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='amenity',
+            name='slug',
+            field=models.SlugField(max_length=100, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='amenity',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, unique=True),
+        ),
+    ]
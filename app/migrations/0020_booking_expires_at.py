@@ -0,0 +1,34 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:10
+
+from datetime import timedelta
+
+import app.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_expires_at(apps, schema_editor):
+    # Holds used to be computed as 30 minutes after creation
+    Booking = apps.get_model('app', 'Booking')
+    Booking.objects.update(expires_at=models.F('created_at') + timedelta(minutes=30))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_booking_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='expires_at',
+            field=models.DateTimeField(default=app.models.hold_expiry),
+        ),
+        migrations.RunPython(backfill_expires_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['status', 'payment_status', 'expires_at'], name='app_booking_expiry_idx'),
+        ),
+    ]
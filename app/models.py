@@ -1,9 +1,64 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Cast, Coalesce, Greatest
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.text import slugify
 from datetime import timedelta, datetime
 
+class PropertyQuerySet(models.QuerySet):
+    def available_between(self, check_in, check_out):
+        """Properties with no night claimed in [check_in, check_out), as one anti-join."""
+        claimed = PropertyNight.objects.filter(
+            property=models.OuterRef('pk'),
+            night__gte=check_in,
+            night__lt=check_out
+        )
+        return self.filter(~models.Exists(claimed))
+
+    def with_images(self):
+        """Prefetch images so primary_image resolves without per-card queries."""
+        return self.prefetch_related('images')
+
+    def with_amenities(self, amenities):
+        """Properties having every one of ``amenities``, as a single bitmask test."""
+        mask = 0
+        for amenity in amenities:
+            mask |= amenity.mask
+        if not mask:
+            return self
+        return self.alias(amenity_match=models.F('amenity_mask').bitand(mask)).filter(amenity_match=mask)
+
+    def refresh_amenity_mask(self):
+        """Recompute amenity_mask from the amenity links with a single UPDATE."""
+        bits = Amenity.properties.through.objects.filter(
+            property=models.OuterRef('pk')
+        ).order_by().values('property').annotate(
+            # Each amenity is linked at most once, so summing the bits ORs them
+            mask=models.Sum(models.Value(1, output_field=models.BigIntegerField()).bitleftshift(models.F('amenity__bit')))
+        ).values('mask')
+        return self.update(amenity_mask=Coalesce(models.Subquery(bits), 0))
+
+    def refresh_aggregates(self):
+        """
+        Recompute the denormalized rating and wishlist counters from their
+        source tables with a single UPDATE of correlated subqueries.
+        """
+        def subquery(model, aggregate):
+            values = model.objects.filter(property=models.OuterRef('pk')).order_by().values('property')
+            return Coalesce(models.Subquery(values.annotate(value=aggregate).values('value')), 0)
+
+        # Ratings left through reviews and through post-stay comments both count
+        rating_count = subquery(Review, models.Count('id')) + subquery(PropertyComment, models.Count('id'))
+        rating_sum = subquery(Review, models.Sum('rating')) + subquery(PropertyComment, models.Sum('rating'))
+        return self.update(
+            rating_count=rating_count,
+            rating_avg=Cast(rating_sum, models.FloatField()) / Greatest(rating_count, 1),
+            wishlist_count=subquery(Wishlist, models.Count('id')),
+        )
+
 class Property(models.Model):
     PROPERTY_TYPES = (
         ('house', 'House'),
@@ -46,21 +101,41 @@ class Property(models.Model):
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     is_superhost = models.BooleanField(default=False)
     highlights = models.CharField(max_length=200, blank=True)  # Store comma-separated highlights
+    # Denormalized counters, maintained by app/signals.py
+    rating_avg = models.FloatField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    wishlist_count = models.PositiveIntegerField(default=0)
+    # One bit per linked amenity (see Amenity.bit), maintained by app/signals.py
+    amenity_mask = models.BigIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PropertyQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
+    @cached_property
+    def primary_image_object(self):
+        """The PropertyImage shown on cards: the primary one, else the first."""
+        # Resolve from prefetched images when available; filter() would bypass
+        # the prefetch cache and cost up to two queries per card
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('images')
+        if prefetched is not None:
+            images = sorted(prefetched, key=lambda image: image.pk)
+            primary = next((image for image in images if image.is_primary), None)
+            # fallback to any image if no primary
+            any_image = images[0] if images else None
+        else:
+            primary = self.images.filter(is_primary=True).first()
+            any_image = None if primary else self.images.first()
+        return primary or any_image
+
     @property
     def primary_image(self):
-        primary = self.images.filter(is_primary=True).first()
-        if primary:
-            return primary.image.url
-        # fallback to any image if no primary
-        any_image = self.images.first()
-        if any_image:
-            return any_image.image.url
+        image = self.primary_image_object
+        if image:
+            return image.image.url
         return None
 
     def get_highlights_list(self):
@@ -71,24 +146,183 @@ class Property(models.Model):
     class Meta:
         verbose_name_plural = 'Properties'
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination seeks on (sort key, id), so every sortable index ends with id
+            models.Index(fields=['-rating_avg', '-rating_count', '-id'], name='app_property_rating_idx'),
+            models.Index(fields=['price_per_night', 'id'], name='app_property_price_idx'),
+            models.Index(fields=['created_at', 'id'], name='app_property_created_idx'),
+        ]
+
+class SearchDocumentField(models.TextField):
+    """The hidden column named after an FTS5 table, which full-text queries match against."""
+
+@SearchDocumentField.register_lookup
+class FullTextMatch(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+class PropertySearchDocument(models.Model):
+    """
+    Row of the SQLite FTS5 index over listing text, maintained by triggers
+    (see app.search). ``rank`` is only defined in queries filtering on
+    ``document__match``.
+    """
+    property = models.OneToOneField(
+        Property, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', related_name='search_document'
+    )
+    document = SearchDocumentField(db_column='app_property_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'app_property_fts'
+
+class PropertyGeoPoint(models.Model):
+    """
+    Entry of the SQLite R-tree over property coordinates, maintained by
+    triggers (see app.geo). Each point is a degenerate box.
+    """
+    property = models.OneToOneField(
+        Property, on_delete=models.DO_NOTHING, primary_key=True, db_column='id', related_name='geo_point'
+    )
+    min_lat = models.FloatField()
+    max_lat = models.FloatField()
+    min_lng = models.FloatField()
+    max_lng = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'app_property_geo'
 
 class PropertyImage(models.Model):
     property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='properties/')
     is_primary = models.BooleanField(default=False)
+    # Downscaled copies of the file, {'source': name, 'widths': [...]}, maintained by app/images.py
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Image for {self.property.title}"
 
 class Amenity(models.Model):
+    # Bits available in Property.amenity_mask, a signed 64-bit integer
+    MASK_BITS = 63
+
     name = models.CharField(max_length=100)
+    slug = models.SlugField(max_length=100, unique=True)
     icon = models.CharField(max_length=50)
+    # Position of the amenity in Property.amenity_mask
+    bit = models.PositiveSmallIntegerField(unique=True, editable=False)
     properties = models.ManyToManyField(Property, related_name='amenities')
 
     def __str__(self):
         return self.name
 
+    @property
+    def mask(self):
+        return 1 << self.bit
+
+    @classmethod
+    def free_bits(cls):
+        used = set(cls.objects.values_list('bit', flat=True))
+        return [bit for bit in range(cls.MASK_BITS) if bit not in used]
+
+    def clean(self):
+        if self._state.adding and not self.free_bits():
+            raise ValidationError(f'At most {self.MASK_BITS} amenities can be defined.')
+
+    def save(self, *args, **kwargs):
+        if not self.slug:
+            self.slug = slugify(self.name)
+        if self.bit is None:
+            free_bits = self.free_bits()
+            if not free_bits:
+                raise ValueError(f'At most {self.MASK_BITS} amenities can be defined.')
+            self.bit = free_bits[0]
+        super().save(*args, **kwargs)
+
+class BookingQuerySet(models.QuerySet):
+    def release(self, **fields):
+        """
+        Bulk-update bookings into an inactive state and free their claimed nights.
+        Use instead of update() whenever the new status is cancelled or completed.
+        """
+        from . import availability, broadcast, listing_cache
+
+        rows = list(self.values_list('id', 'property_obj_id'))
+        if not rows:
+            return 0
+        booking_ids = [booking_id for booking_id, _ in rows]
+        with transaction.atomic():
+            updated = self.model.objects.filter(id__in=booking_ids).update(**fields)
+            PropertyNight.objects.filter(booking_id__in=booking_ids).delete()
+            for booking_id in booking_ids:
+                broadcast.publish(booking_id, **fields)
+        availability.invalidate(*[property_id for _, property_id in rows])
+        # update() skips the Booking signals that version the listing cache
+        listing_cache.bump_version()
+        return updated
+
+    def expired(self, now=None):
+        """Pending, unpaid bookings whose hold has run out."""
+        return self.filter(status='pending', payment_status='pending', expires_at__lt=now or timezone.now())
+
+    def expire_holds(self, now=None, batch_size=500):
+        """
+        Cancel the expired holds in this queryset and free their nights, one
+        UPDATE per ``batch_size`` bookings. Returns the number cancelled.
+        """
+        now = now or timezone.now()
+        cancelled = 0
+        while True:
+            with transaction.atomic():
+                # Lock the batch so a payment confirmed meanwhile is not cancelled
+                batch_ids = list(
+                    self.expired(now).select_for_update().order_by('expires_at', 'id').values_list('id', flat=True)[:batch_size]
+                )
+                if not batch_ids:
+                    break
+                cancelled += self.model.objects.filter(id__in=batch_ids).release(
+                    status='cancelled',
+                    payment_status='failed',
+                )
+        return cancelled
+
+    def finished(self, today=None):
+        """Confirmed bookings whose stay is over and should be marked completed."""
+        return self.filter(status='confirmed', check_out__lt=today or timezone.now().date())
+
+    def complete_finished(self, today=None, batch_size=500):
+        """
+        Mark the finished stays in this queryset completed and free their
+        nights, one UPDATE per ``batch_size`` bookings. Returns the number completed.
+        """
+        today = today or timezone.now().date()
+        completed = 0
+        while True:
+            with transaction.atomic():
+                # Lock the batch so a cancellation made meanwhile is not overwritten
+                batch_ids = list(
+                    self.finished(today).select_for_update().order_by('check_out', 'id').values_list('id', flat=True)[:batch_size]
+                )
+                if not batch_ids:
+                    break
+                completed += self.model.objects.filter(id__in=batch_ids).release(status='completed')
+        return completed
+
+def hold_expiry():
+    """Expiry of a booking hold placed now."""
+    return timezone.now() + Booking.HOLD_DURATION
+
 class Booking(models.Model):
+    ACTIVE_STATUSES = ('pending', 'confirmed')
+    # How long a pending booking holds its nights while awaiting payment
+    HOLD_DURATION = timedelta(minutes=30)
+
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('confirmed', 'Confirmed'),
@@ -111,33 +345,72 @@ class Booking(models.Model):
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='pending')
-    stripe_session_id = models.CharField(max_length=255, blank=True, null=True)
+    stripe_session_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    # Checkout session details stored when it is created, so polls need not ask Stripe
+    stripe_session_url = models.URLField(max_length=2048, blank=True)
+    stripe_session_status = models.CharField(max_length=20, blank=True)
+    stripe_session_expires_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(default=hold_expiry)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BookingQuerySet.as_manager()
+
     def __str__(self):
         return f"Booking for {self.property_obj.title} by {self.guest.username}"
+
+    def save(self, *args, **kwargs):
+        # Persist the booking and its night claims together so an overlapping
+        # stay is rejected by the PropertyNight unique constraint
+        update_fields = kwargs.get('update_fields')
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if update_fields is None or {'status', 'check_in', 'check_out'} & set(update_fields):
+                self.sync_nights()
+
+    def iter_nights(self):
+        night = self.check_in
+        while night < self.check_out:
+            yield night
+            night += timedelta(days=1)
+
+    def sync_nights(self):
+        """
+        Claim the booked nights while the booking is active and release them
+        otherwise. Raises IntegrityError if another booking holds a night.
+        """
+        if self.status not in self.ACTIVE_STATUSES:
+            self.nights.all().delete()
+            return
+        wanted = set(self.iter_nights())
+        claimed = set(self.nights.values_list('night', flat=True))
+        if claimed - wanted:
+            self.nights.filter(night__in=claimed - wanted).delete()
+        PropertyNight.objects.bulk_create([
+            PropertyNight(property_id=self.property_obj_id, booking=self, night=night)
+            for night in sorted(wanted - claimed)
+        ])
     
     @property
     def reservation_expires_at(self):
         """
-        Calculate when the reservation expires (30 minutes from creation)
+        When the reservation expires (HOLD_DURATION after creation)
         """
-        return self.created_at + timedelta(minutes=30)
+        return self.expires_at
     
     @property
     def is_expired(self):
         """
         Check if the reservation has expired
         """
-        return timezone.now() > self.reservation_expires_at
+        return timezone.now() > self.expires_at
     
     @property
     def time_remaining_seconds(self):
         """
         Get time remaining in seconds (negative if expired)
         """
-        remaining = self.reservation_expires_at - timezone.now()
+        remaining = self.expires_at - timezone.now()
         return int(remaining.total_seconds())
     
     def clean(self):
@@ -158,20 +431,18 @@ class Booking(models.Model):
         if isinstance(check_out, str):
             check_out = datetime.strptime(check_out, '%Y-%m-%d').date()
         
-        # Query for conflicting bookings
-        conflicting_bookings = cls.objects.filter(
-            property_obj=property,
-            status__in=['pending', 'confirmed'],  # Only check active bookings
-            # Check for date range overlaps
-            check_in__lt=check_out,
-            check_out__gt=check_in
+        # Any night in the range claimed by an active booking is a conflict
+        claimed_nights = PropertyNight.objects.filter(
+            property=property,
+            night__gte=check_in,
+            night__lt=check_out
         )
         
         # Exclude the current booking if we're updating
         if exclude_booking:
-            conflicting_bookings = conflicting_bookings.exclude(id=exclude_booking.id)
+            claimed_nights = claimed_nights.exclude(booking_id=exclude_booking.id)
         
-        return not conflicting_bookings.exists()
+        return not claimed_nights.exists()
     
     @classmethod
     def get_unavailable_dates(cls, property, start_date=None, end_date=None):
@@ -184,33 +455,34 @@ class Booking(models.Model):
         if not end_date:
             end_date = start_date + timedelta(days=365)
         
-        # Get all active bookings in the date range
-        bookings = cls.objects.filter(
-            property_obj=property,
-            status__in=['pending', 'confirmed'],
-            check_in__lte=end_date,
-            check_out__gte=start_date
-        )
-        
-        unavailable_dates = set()
-        for booking in bookings:
-            current_date = max(booking.check_in, start_date)
-            end_booking = min(booking.check_out, end_date)
-            
-            while current_date < end_booking:
-                unavailable_dates.add(current_date)
-                current_date += timedelta(days=1)
-        
-        return sorted(list(unavailable_dates))
+        # Claimed nights are unique per property, so this is one index range scan
+        return list(PropertyNight.objects.filter(
+            property=property,
+            night__gte=start_date,
+            night__lt=end_date
+        ).order_by('night').values_list('night', flat=True))
 
     class Meta:
-        # Add unique constraint to prevent double bookings at database level
-        unique_together = [
-            ('property_obj', 'check_in', 'check_out', 'status'),
-        ]
+        # Double bookings are prevented by the PropertyNight unique constraint
         indexes = [
             models.Index(fields=['property_obj', 'check_in', 'check_out']),
             models.Index(fields=['status', 'payment_status']),
+            models.Index(fields=['created_at', 'id'], name='app_booking_created_idx'),
+            models.Index(fields=['status', 'payment_status', 'expires_at'], name='app_booking_expiry_idx'),
+        ]
+
+class PropertyNight(models.Model):
+    """A night of a property claimed by a pending or confirmed booking."""
+    property = models.ForeignKey(Property, on_delete=models.CASCADE, related_name='claimed_nights')
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='nights')
+    night = models.DateField()
+
+    def __str__(self):
+        return f"{self.property_id} - {self.night}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['property', 'night'], name='unique_property_night'),
         ]
 
 class Review(models.Model):
@@ -355,4 +627,81 @@ class PropertyComment(models.Model):
 
     class Meta:
         ordering = ['-created_at']
-        unique_together = ['property', 'user']  # One comment per user per property
\ No newline at end of file
+        unique_together = ['property', 'user']  # One comment per user per property
+
+class SchedulerLease(models.Model):
+    """
+    A lease that lets one scheduler worker at a time run a periodic job, with
+    the figures of the job's last run.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    owner = models.CharField(max_length=255, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+    last_duration_ms = models.FloatField(null=True, blank=True)
+    last_processed = models.PositiveIntegerField(default=0)
+    last_backlog = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} (held by {self.owner or 'nobody'})"
+
+class OutboxEmail(models.Model):
+    """
+    An e-mail waiting to be sent by the send_queued_mail worker. Rows are
+    written in the same transaction as the change they announce.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.recipients)} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='app_outbox_due_idx'),
+        ]
+
+class WebhookEvent(models.Model):
+    """
+    A Stripe webhook event, recorded once per event id when it is received and
+    processed later by the process_webhook_events worker.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    stripe_created = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    result = models.CharField(max_length=100, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.type} {self.event_id} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='app_webhook_due_idx'),
+        ]
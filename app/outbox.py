@@ -0,0 +1,98 @@
+"""
+Transactional outbox for outbound e-mail.
+
+Views call queue_mail() instead of send_mail(): it only inserts an OutboxEmail
+row, inside whatever transaction the view is in, so the mail goes out if and
+only if the change it announces commits and no SMTP round trip happens during
+the request. The send_queued_mail command drains the table with drain(), a
+batch at a time over one open connection of the configured EMAIL_BACKEND
+(SMTP in production, the file or locmem backend locally). Failed sends are
+retried with exponential backoff and given up on after MAX_ATTEMPTS.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+MAX_ATTEMPTS = 8
+# Retry delays double from BACKOFF_BASE up to BACKOFF_MAX
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+
+logger = logging.getLogger(__name__)
+
+
+def queue_mail(subject, message, from_email, recipient_list):
+    """Queue an e-mail for the worker; takes the same arguments as send_mail."""
+    recipients = [address for address in recipient_list if address]
+    if not recipients:
+        return None
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=recipients,
+    )
+
+
+def backoff(attempts):
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+def due(now=None):
+    return OutboxEmail.objects.filter(status='pending', next_attempt_at__lte=now or timezone.now())
+
+
+def drain(batch_size=100, now=None):
+    """
+    Send up to ``batch_size`` due e-mails over a single connection. Returns
+    the numbers sent and failed; failures are rescheduled or given up on.
+    """
+    now = now or timezone.now()
+    batch = list(due(now).order_by('next_attempt_at', 'id')[:batch_size])
+    if not batch:
+        return {'sent': 0, 'failed': 0}
+
+    sent_ids = []
+    failed = 0
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as exc:
+        # Nothing can be sent this round; count it against every mail in the batch
+        for email in batch:
+            _reschedule(email, exc, now)
+        return {'sent': 0, 'failed': len(batch)}
+
+    try:
+        for email in batch:
+            message = EmailMessage(
+                email.subject, email.body, email.from_email, email.recipients, connection=connection,
+            )
+            try:
+                connection.send_messages([message])
+            except Exception as exc:
+                _reschedule(email, exc, now)
+                failed += 1
+            else:
+                sent_ids.append(email.id)
+    finally:
+        connection.close()
+
+    OutboxEmail.objects.filter(id__in=sent_ids).update(status='sent', sent_at=timezone.now(), last_error='')
+    return {'sent': len(sent_ids), 'failed': failed}
+
+
+def _reschedule(email, exc, now):
+    email.attempts += 1
+    email.last_error = f'{type(exc).__name__}: {exc}'
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = 'failed'
+        logger.error('Giving up on e-mail %s to %s: %s', email.id, email.recipients, email.last_error)
+    else:
+        email.next_attempt_at = now + backoff(email.attempts)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
@@ -0,0 +1,162 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of COUNT(*) plus OFFSET, each page continues from the sort key of the
+last row of the previous one: "WHERE (price, id) > (last price, last id)
+ORDER BY price, id LIMIT n". A page costs one query whatever its depth, and
+with an index matching the ordering the database seeks straight to it.
+
+Cursors are opaque URL-safe strings holding the sort key values, the
+direction and the ordering they belong to. Malformed cursors and cursors from
+another ordering fall back to the first page, like Paginator.get_page does
+for bad page numbers. Ordering fields must not be NULL; the primary key is
+appended as a tiebreaker when the ordering does not already end with it.
+"""
+import base64
+import datetime
+import json
+from collections.abc import Sequence
+from functools import reduce
+from operator import or_
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder truncates to milliseconds, which would skip or repeat rows
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(data):
+    payload = json.dumps(data, cls=CursorEncoder, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor, raising ValueError when malformed."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        return json.loads(payload)
+    except (TypeError, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+class CursorPage(Sequence):
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Paginate ``queryset`` by keyset on ``ordering`` (defaults to the queryset's
+    ordering, then the model's). ``count`` is an optional total, or a callable
+    returning one, exposed as ``paginator.count`` for display only.
+    """
+
+    def __init__(self, queryset, per_page, ordering=None, count=None):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        ordering = list(ordering or queryset.query.order_by or queryset.model._meta.ordering)
+        if not ordering or not all(isinstance(field, str) for field in ordering):
+            raise ValueError('Cursor pagination needs an ordering made of field names')
+        pk_name = queryset.model._meta.pk.name
+        if ordering[-1].lstrip('-') not in ('pk', pk_name):
+            # Follow the last field's direction so one composite index serves both
+            ordering.append(f'-{pk_name}' if ordering[-1].startswith('-') else pk_name)
+        self.ordering = ordering
+        self.keys = [
+            (pk_name if field.lstrip('-') == 'pk' else field.lstrip('-'), field.startswith('-'))
+            for field in ordering
+        ]
+        self._count = count
+
+    @cached_property
+    def count(self):
+        return self._count() if callable(self._count) else self._count
+
+    def _key(self, obj):
+        return [getattr(obj, name) for name, _ in self.keys]
+
+    def _seek(self, values, backwards):
+        """Rows strictly after ``values`` in the ordering, or before them when ``backwards``."""
+        def lookup(name, descending, inclusive=False):
+            after = descending == backwards
+            return f'{name}__{"gt" if after else "lt"}{"e" if inclusive else ""}'
+
+        clauses = []
+        for index, (name, descending) in enumerate(self.keys):
+            clause = Q(**{lookup(name, descending): values[index]})
+            for (prev_name, _), value in zip(self.keys[:index], values[:index]):
+                clause &= Q(**{prev_name: value})
+            clauses.append(clause)
+        # The leading inclusive bound lets the database seek an index on the first key
+        first_name, first_descending = self.keys[0]
+        return Q(**{lookup(first_name, first_descending, inclusive=True): values[0]}) & reduce(or_, clauses)
+
+    def _cursor(self, obj, backwards):
+        return encode_cursor({'o': self.ordering, 'k': self._key(obj), 'b': backwards})
+
+    def get_page(self, cursor=None):
+        position = None
+        if cursor:
+            try:
+                position = decode_cursor(cursor)
+                if (
+                    position['o'] != self.ordering
+                    or len(position['k']) != len(self.keys)
+                    or not all(isinstance(value, (str, int, float)) for value in position['k'])
+                ):
+                    position = None
+            except (ValueError, KeyError, TypeError):
+                position = None
+
+        backwards = bool(position and position.get('b') is True)
+        queryset = self.queryset
+        if position:
+            queryset = queryset.filter(self._seek(position['k'], backwards))
+        if backwards:
+            queryset = queryset.order_by(*(name if descending else f'-{name}' for name, descending in self.keys))
+        else:
+            queryset = queryset.order_by(*(f'-{name}' if descending else name for name, descending in self.keys))
+
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, position is not None
+
+        return CursorPage(
+            rows,
+            self,
+            next_cursor=self._cursor(rows[-1], False) if rows and has_next else None,
+            previous_cursor=self._cursor(rows[0], True) if rows and has_previous else None,
+        )
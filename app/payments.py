@@ -0,0 +1,212 @@
+"""
+Stripe Checkout for bookings.
+
+Creating a session is a network round trip to Stripe, so it never happens
+inside a database transaction: booking is two-phase. The view first claims the
+nights in a short transaction (creating the pending booking), then calls
+attach_checkout_session() with no transaction open. If Stripe fails, the
+compensating step deletes the booking again, which frees its nights.
+
+The session's URL, status and expiry are stored on the booking with its id,
+so the payment page and its polls are answered from the database. Stripe is
+only asked for bookings without them, through a SESSION_CACHE_TIMEOUT second
+cache entry per session that a single caller at a time refreshes.
+
+Requests go to STRIPE_API_BASE with a STRIPE_TIMEOUT second timeout, so tests
+and local development can point them at a fake Stripe server.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Booking
+
+SESSION_CACHE_TIMEOUT = 30
+# How often callers waiting for another caller's refresh look for its result
+SESSION_WAIT_INTERVAL = 0.05
+
+logger = logging.getLogger(__name__)
+
+_http_client_timeout = None
+
+
+def _configure():
+    global _http_client_timeout
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.api_base = settings.STRIPE_API_BASE
+    if _http_client_timeout != settings.STRIPE_TIMEOUT:
+        stripe.default_http_client = stripe.http_client.new_default_http_client(timeout=settings.STRIPE_TIMEOUT)
+        _http_client_timeout = settings.STRIPE_TIMEOUT
+
+
+def create_checkout_session(booking, request):
+    """Create the Stripe Checkout session paying for ``booking``."""
+    _configure()
+    nights = (booking.check_out - booking.check_in).days
+    return stripe.checkout.Session.create(
+        payment_method_types=['card'],
+        line_items=[{
+            'price_data': {
+                'currency': 'usd',
+                'product_data': {
+                    'name': f'Booking for {booking.property_obj.title}',
+                    'description': f'{nights} nights from {booking.check_in} to {booking.check_out}',
+                },
+                'unit_amount': int(booking.total_price * 100),
+            },
+            'quantity': 1,
+        }],
+        mode='payment',
+        success_url=request.build_absolute_uri(f'/booking/success/?booking_id={booking.id}'),
+        cancel_url=request.build_absolute_uri(f'/booking/cancel/?booking_id={booking.id}'),
+        customer_email=booking.guest.email,
+        metadata={
+            'booking_id': str(booking.id),
+            'property_id': str(booking.property_obj_id),
+        },
+    )
+
+
+def expire_checkout_session(session_id):
+    """Best effort: make an unused session unpayable."""
+    _configure()
+    try:
+        stripe.checkout.Session.expire(session_id)
+    except stripe.error.StripeError as e:
+        logger.warning('Could not expire Stripe session %s: %s', session_id, e)
+
+
+def attach_checkout_session(booking, request):
+    """
+    Phase two of a booking: create its payment session and attach it. Call
+    with no transaction open. Raises StripeError after deleting the booking
+    (releasing its hold) when Stripe fails. Returns the session, or None when
+    the hold was cancelled while Stripe was being called.
+    """
+    try:
+        session = create_checkout_session(booking, request)
+    except stripe.error.StripeError:
+        booking.delete()
+        raise
+
+    fields = session_fields(session)
+    attached = Booking.objects.filter(pk=booking.pk, status='pending', payment_status='pending').update(
+        updated_at=timezone.now(),
+        **fields,
+    )
+    if not attached:
+        expire_checkout_session(session.id)
+        return None
+    for name, value in fields.items():
+        setattr(booking, name, value)
+    return session
+
+
+def session_fields(session):
+    """The Booking fields describing a Stripe Checkout session."""
+    expires_at = session.get('expires_at')
+    return {
+        'stripe_session_id': session['id'],
+        'stripe_session_url': session.get('url') or '',
+        'stripe_session_status': session.get('status') or '',
+        'stripe_session_expires_at': (
+            datetime.fromtimestamp(expires_at, dt_timezone.utc) if isinstance(expires_at, int) else None
+        ),
+    }
+
+
+async def asession_state(booking):
+    """
+    The url, status and expires_at of the booking's Checkout session, from the
+    booking when stored there and from Stripe otherwise. An open session past
+    its expiry is reported as expired. Returns None when another caller's
+    refresh did not complete in time; raises StripeError when Stripe fails.
+    """
+    if booking.stripe_session_url and booking.stripe_session_status:
+        state = {
+            'url': booking.stripe_session_url,
+            'status': booking.stripe_session_status,
+            'expires_at': booking.stripe_session_expires_at,
+        }
+    else:
+        state = await arefresh_session_state(booking.stripe_session_id)
+        if state is None:
+            return None
+    if state['status'] == 'open' and state['expires_at'] and state['expires_at'] <= timezone.now():
+        state = dict(state, status='expired')
+    return state
+
+
+def _session_key(session_id):
+    return f'stripe:session:{session_id}'
+
+
+def _retrieve_checkout_session(session_id):
+    _configure()
+    return stripe.checkout.Session.retrieve(session_id)
+
+
+async def arefresh_session_state(session_id):
+    """
+    Retrieve the session from Stripe and store its details on the booking.
+    Results are cached for SESSION_CACHE_TIMEOUT seconds, and concurrent
+    callers for the same session wait for the first one's call instead of
+    making their own. The stripe library is synchronous, so the call runs on
+    a thread of its own rather than the one shared by sync code.
+    """
+    key = _session_key(session_id)
+    state = await cache.aget(key)
+    if state is not None:
+        return state
+
+    lock_key = f'{key}:lock'
+    lock_timeout = settings.STRIPE_TIMEOUT + 5
+    if not await cache.aadd(lock_key, 1, lock_timeout):
+        # Another caller is refreshing this session; wait for its result
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(SESSION_WAIT_INTERVAL)
+            state = await cache.aget(key)
+            if state is not None:
+                return state
+            if await cache.aget(lock_key) is None:
+                break
+        return None
+
+    try:
+        session = await sync_to_async(_retrieve_checkout_session, thread_sensitive=False)(session_id)
+        fields = session_fields(session)
+        await Booking.objects.filter(stripe_session_id=session_id).aupdate(**fields)
+        state = {
+            'url': fields['stripe_session_url'],
+            'status': fields['stripe_session_status'],
+            'expires_at': fields['stripe_session_expires_at'],
+        }
+        await cache.aset(key, state, SESSION_CACHE_TIMEOUT)
+        return state
+    finally:
+        await cache.adelete(lock_key)
+
+
+def update_session_status(session_id, status):
+    """Record a session status reported by a webhook; returns the number of bookings updated."""
+    cache.delete(_session_key(session_id))
+    return Booking.objects.filter(stripe_session_id=session_id).update(stripe_session_status=status)
+
+
+def list_events(since, types=None):
+    """Yield the events Stripe created since ``since`` (newest first), as plain dicts."""
+    _configure()
+    params = {'created': {'gte': int(since.timestamp())}, 'limit': 100}
+    if types:
+        params['types'] = types
+    for event in stripe.Event.list(**params).auto_paging_iter():
+        yield json.loads(json.dumps(event))
@@ -0,0 +1,84 @@
+"""
+Periodic booking maintenance.
+
+The run_booking_scheduler command calls run_once() every few seconds in each
+worker process. A worker only sweeps while it holds the SchedulerLease row
+named LEASE_NAME. Taking or renewing the lease is a single conditional UPDATE
+("set owner = me where owner = me or the lease has run out"), so of several
+workers sharing the database exactly one sweeps at a time, and another takes
+over once the holder stops renewing it (crashed or stopped).
+"""
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Booking, SchedulerLease
+
+LEASE_NAME = 'booking-maintenance'
+
+logger = logging.getLogger(__name__)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+
+
+def acquire_lease(owner, ttl, name=LEASE_NAME, now=None):
+    """Take or renew the lease for ``ttl`` seconds; True when ``owner`` now holds it."""
+    now = now or timezone.now()
+    SchedulerLease.objects.get_or_create(name=name)
+    return SchedulerLease.objects.filter(
+        Q(owner=owner) | Q(expires_at__isnull=True) | Q(expires_at__lt=now),
+        name=name,
+    ).update(owner=owner, expires_at=now + timedelta(seconds=ttl)) == 1
+
+
+def release_lease(owner, name=LEASE_NAME):
+    SchedulerLease.objects.filter(name=name, owner=owner).update(owner='', expires_at=None)
+
+
+def sweep(now=None, batch_size=500):
+    """
+    Cancel expired holds and complete finished stays. Returns how many
+    bookings were due when the sweep started and how many it processed.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    expired = Booking.objects.expired(now)
+    finished = Booking.objects.finished(today)
+    backlog = expired.count() + finished.count()
+    processed = 0
+    if backlog:
+        processed = expired.expire_holds(now, batch_size=batch_size)
+        processed += finished.complete_finished(today, batch_size=batch_size)
+    return {'backlog': backlog, 'processed': processed}
+
+
+def run_once(owner, ttl, batch_size=500, name=LEASE_NAME):
+    """
+    Sweep if ``owner`` holds (or can take) the lease and record the run on it.
+    Returns the run's figures, or None when another worker holds the lease.
+    """
+    if not acquire_lease(owner, ttl, name):
+        return None
+    started = time.monotonic()
+    result = sweep(batch_size=batch_size)
+    result['duration_ms'] = (time.monotonic() - started) * 1000
+    SchedulerLease.objects.filter(name=name, owner=owner).update(
+        last_run_at=timezone.now(),
+        last_duration_ms=result['duration_ms'],
+        last_processed=result['processed'],
+        last_backlog=result['backlog'],
+    )
+    if result['processed']:
+        logger.info(
+            'Booking sweep processed %d of %d due bookings in %.0f ms',
+            result['processed'], result['backlog'], result['duration_ms'],
+        )
+    return result
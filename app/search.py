@@ -0,0 +1,107 @@
+"""
+Full-text search over property listings.
+
+On SQLite the listing text (title, description, location and highlights) is
+indexed in the FTS5 table created by migration 0015. Triggers on app_property
+keep it current on every insert, update and delete, including bulk_create and
+queryset updates that bypass model signals. SQLite drops triggers whenever a
+migration rebuilds the table, so they are reinstalled after every migrate.
+Queries match every term as a prefix, join the index on rowid and order by its
+rank column, configured by the migration as bm25 weighting title and location
+above highlights and description.
+
+Backends without the FTS table fall back to case-insensitive containment
+across the same fields, without ranking.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import F, Q
+
+FTS_TABLE = 'app_property_fts'
+SEARCH_FIELDS = ('title', 'description', 'location', 'highlights')
+MAX_TERMS = 8
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_COLUMNS = ', '.join(SEARCH_FIELDS)
+_NEW_VALUES = ', '.join(['new.id'] + [f'new.{field}' for field in SEARCH_FIELDS])
+_OLD_VALUES = ', '.join(['old.id'] + [f'old.{field}' for field in SEARCH_FIELDS])
+TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON app_property BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS}) VALUES ({_NEW_VALUES});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON app_property BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMNS}) VALUES ('delete', {_OLD_VALUES});
+    END
+    """,
+    # Only text changes touch the index; counter refreshes leave it alone
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF {_COLUMNS} ON app_property BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMNS}) VALUES ('delete', {_OLD_VALUES});
+        INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS}) VALUES ({_NEW_VALUES});
+    END
+    """,
+]
+
+_fts_available = {}
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query.lower())[:MAX_TERMS]
+
+
+def match_expression(terms):
+    """Build an FTS5 MATCH string requiring every term, each as a prefix."""
+    # Tokens are word characters only, so quoting them cannot break the syntax
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def fts_enabled():
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts_available:
+        _fts_available[name] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_available[name]
+
+
+def search(queryset, query):
+    """
+    Restrict a Property queryset to listings matching ``query``. With the FTS
+    index the queryset is annotated with ``search_rank`` (lower is more relevant).
+    """
+    terms = tokenize(query)
+    if not terms:
+        return queryset
+
+    if not fts_enabled():
+        for term in terms:
+            term_filter = Q()
+            for field in SEARCH_FIELDS:
+                term_filter |= Q(**{f'{field}__icontains': term})
+            queryset = queryset.filter(term_filter)
+        return queryset
+
+    return queryset.filter(
+        search_document__document__match=match_expression(terms),
+    ).annotate(search_rank=F('search_document__rank'))
+
+
+def install_triggers(using=None):
+    """(Re)create the triggers that keep the FTS index in sync, if it exists."""
+    conn = connections[using or DEFAULT_DB_ALIAS]
+    if conn.vendor != 'sqlite' or FTS_TABLE not in conn.introspection.table_names():
+        return
+    with conn.cursor() as cursor:
+        for statement in TRIGGERS:
+            cursor.execute(statement)
+
+
+def rebuild_index():
+    """Repopulate the FTS index from app_property."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
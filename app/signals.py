@@ -1,7 +1,10 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, post_migrate, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from django.db import transaction
+from django.db.models import F
+from .models import UserProfile, Booking, Property, PropertyImage, Review, PropertyComment, Wishlist, Amenity
+from . import availability, broadcast, cards, facets, geo, images, listing_cache, search
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -19,4 +22,100 @@ def save_user_profile(sender, instance, **kwargs):
         profile.save()
     except UserProfile.DoesNotExist:
         role = 'admin' if instance.is_superuser else 'user'
-        UserProfile.objects.create(user=instance, role=role) 
\ No newline at end of file
+        UserProfile.objects.create(user=instance, role=role)
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def invalidate_property_availability(sender, instance, **kwargs):
+    availability.invalidate(instance.property_obj_id)
+
+@receiver(post_save, sender=Booking)
+def publish_booking_status(sender, instance, created, **kwargs):
+    if not created:
+        broadcast.publish(instance.pk, status=instance.status, payment_status=instance.payment_status)
+
+@receiver(post_save, sender=Property)
+@receiver(post_delete, sender=Property)
+def invalidate_facet_snapshot(sender, instance, **kwargs):
+    facets.invalidate()
+
+@receiver(post_save, sender=Property)
+@receiver(post_delete, sender=Property)
+@receiver(post_save, sender=PropertyImage)
+@receiver(post_delete, sender=PropertyImage)
+@receiver(post_save, sender=Amenity)
+@receiver(post_delete, sender=Amenity)
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def invalidate_listing_cache(sender, instance, **kwargs):
+    listing_cache.bump_version()
+
+@receiver(post_save, sender=PropertyImage)
+def generate_image_variants(sender, instance, **kwargs):
+    if instance.image and not images.is_current(instance):
+        # Written once the upload commits (still within the request), so a
+        # rolled-back upload leaves no derivatives behind
+        transaction.on_commit(lambda: images.refresh(instance))
+
+@receiver(post_delete, sender=PropertyImage)
+def delete_image_variants(sender, instance, **kwargs):
+    if instance.variants:
+        transaction.on_commit(lambda: images.delete(instance.image.storage, instance.variants))
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=PropertyComment)
+@receiver(post_delete, sender=PropertyComment)
+def refresh_property_rating(sender, instance, **kwargs):
+    Property.objects.filter(pk=instance.property_id).refresh_aggregates()
+    # update() sends no post_save, so the receivers above do not run
+    listing_cache.bump_version()
+    cards.invalidate()
+
+@receiver(post_save, sender=Wishlist)
+def increment_wishlist_count(sender, instance, created, **kwargs):
+    if created:
+        Property.objects.filter(pk=instance.property_id).update(wishlist_count=F('wishlist_count') + 1)
+        listing_cache.bump_version()
+        cards.invalidate()
+
+@receiver(post_delete, sender=Wishlist)
+def decrement_wishlist_count(sender, instance, **kwargs):
+    Property.objects.filter(pk=instance.property_id, wishlist_count__gt=0).update(wishlist_count=F('wishlist_count') - 1)
+    listing_cache.bump_version()
+    cards.invalidate()
+
+@receiver(m2m_changed, sender=Amenity.properties.through)
+def refresh_amenity_mask(sender, instance, action, pk_set, **kwargs):
+    if isinstance(instance, Property):
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            Property.objects.filter(pk=instance.pk).refresh_amenity_mask()
+    elif action == 'pre_clear':
+        # The links are gone by post_clear, so remember which properties had them
+        instance._cleared_property_ids = list(instance.properties.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        property_ids = pk_set if action != 'post_clear' else instance.__dict__.pop('_cleared_property_ids', [])
+        Property.objects.filter(pk__in=property_ids).refresh_amenity_mask()
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        facets.invalidate()
+        listing_cache.bump_version()
+
+@receiver(post_save, sender=Amenity)
+@receiver(post_delete, sender=Amenity)
+def invalidate_cards(sender, instance, **kwargs):
+    # Every card may show the amenity's name
+    cards.invalidate()
+
+@receiver(post_delete, sender=Amenity)
+def clear_amenity_bit(sender, instance, **kwargs):
+    # Deleting an amenity drops its links without m2m_changed; clear its bit
+    # before a new amenity reuses it
+    Property.objects.with_amenities([instance]).update(amenity_mask=F('amenity_mask') - instance.mask)
+    facets.invalidate()
+
+@receiver(post_migrate)
+def install_index_triggers(sender, using, **kwargs):
+    # Table rebuilds in later migrations drop the search and geo index triggers
+    if sender.name == 'app':
+        search.install_triggers(using)
+        geo.install_triggers(using)
@@ -4,7 +4,8 @@ class PaymentProcessor {
         this.bookingId = bookingId;
         this.timeRemaining = Math.max(0, initialTimeRemaining);
         this.countdownInterval = null;
-        this.statusCheckInterval = null;
+        this.eventSource = null;
+        this.stopped = false;
         
         this.init();
     }
@@ -63,27 +64,56 @@ class PaymentProcessor {
     }
     
     startStatusCheck() {
-        this.statusCheckInterval = setInterval(() => {
-            this.checkBookingStatus();
-        }, 5000); // Check every 5 seconds
+        // Status changes are pushed over Server-Sent Events; where the server
+        // cannot stream (no ASGI, old browsers) fall back to polling
+        const streamUrl = `/api/booking/${this.bookingId}/stream/`;
+        if (!window.EventSource) {
+            this.longPoll(streamUrl);
+            return;
+        }
+        this.eventSource = new EventSource(streamUrl);
+        this.eventSource.addEventListener('status', (event) => {
+            this.applyStatus(JSON.parse(event.data));
+        });
+        this.eventSource.onerror = () => {
+            // CLOSED means the server refused to stream; otherwise the browser reconnects
+            if (this.eventSource && this.eventSource.readyState === EventSource.CLOSED) {
+                this.eventSource = null;
+                this.longPoll(streamUrl);
+            }
+        };
     }
     
-    async checkBookingStatus() {
-        try {
-            const response = await fetch(`/api/booking/${this.bookingId}/status/`);
-            const data = await response.json();
-            
-            if (data.success) {
-                if (data.status === 'confirmed' && data.payment_status === 'paid') {
-                    this.handleSuccess();
-                } else if (data.status === 'cancelled') {
-                    this.handleCancellation();
-                } else if (data.is_expired) {
-                    this.handleExpiration();
+    async longPoll(streamUrl) {
+        let known = {};
+        while (!this.stopped) {
+            try {
+                const response = await fetch(`${streamUrl}?${new URLSearchParams(known)}`);
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                const data = await response.json();
+                known = {status: data.status, payment_status: data.payment_status};
+                this.applyStatus(data);
+                // Servers that cannot hold the request answer at once and say when to ask again
+                const retryAfter = response.headers.get('Retry-After');
+                if (retryAfter && !this.stopped) {
+                    await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
                 }
+            } catch (error) {
+                console.error('Error checking booking status:', error);
+                await new Promise((resolve) => setTimeout(resolve, 5000));
+            }
+        }
+    }
+    
+    applyStatus(data) {
+        if (data.success) {
+            if (data.status === 'confirmed' && data.payment_status === 'paid') {
+                this.handleSuccess();
+            } else if (data.status === 'cancelled') {
+                this.handleCancellation();
+            } else if (data.is_expired) {
+                this.handleExpiration();
             }
-        } catch (error) {
-            console.error('Error checking booking status:', error);
         }
     }
     
@@ -157,11 +187,20 @@ class PaymentProcessor {
     }
     
     cleanup() {
+        this.stopped = true;
         if (this.countdownInterval) clearInterval(this.countdownInterval);
-        if (this.statusCheckInterval) clearInterval(this.statusCheckInterval);
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
     }
     
     async proceedToPayment() {
+        // The session URL rendered with the page saves a round trip
+        if (window.stripeSessionUrl) {
+            window.location.href = window.stripeSessionUrl;
+            return;
+        }
         try {
             const response = await fetch(`/api/booking/${this.bookingId}/stripe-session/`);
             const data = await response.json();
@@ -0,0 +1,10 @@
+from django import template
+
+from app import cards
+
+register = template.Library()
+
+@register.simple_tag(takes_context=True)
+def property_cards(context, properties, template_name):
+    """(property, card html) pairs for a page of properties, served from the card cache."""
+    return cards.render_cards(properties, template_name, context.get('user_language', 'en'))
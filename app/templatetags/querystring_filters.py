@@ -4,4 +4,12 @@ register = template.Library()
 
 @register.filter
 def getlist(querydict, key):
-    return querydict.getlist(key) 
\ No newline at end of file
+    return querydict.getlist(key) 
+
+@register.simple_tag
+def cursor_query(querydict, cursor):
+    """The current query string pointing at another cursor page."""
+    params = querydict.copy()
+    params.pop('page', None)
+    params['cursor'] = cursor
+    return params.urlencode()
@@ -0,0 +1,18 @@
+from django import template
+
+from app import images
+
+register = template.Library()
+
+@register.inclusion_tag('includes/responsive_image.html')
+def responsive_image(image, alt='', css_class='', sizes='100vw', style=''):
+    """A <picture> offering the derivatives of a PropertyImage, falling back to the original."""
+    return {
+        'image': image,
+        'alt': alt,
+        'css_class': css_class,
+        'sizes': sizes,
+        'style': style,
+        'webp_srcset': images.srcset(image, 'WEBP'),
+        'jpeg_srcset': images.srcset(image, 'JPEG'),
+    }
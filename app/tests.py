@@ -1,3 +1,1505 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import hmac
+import json
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import import_module
+from io import BytesIO, StringIO
+from smtplib import SMTPException
+from unittest.mock import ANY, Mock, patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.contrib.messages import ERROR, get_messages
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import QueryDict
+from django.conf import settings
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import availability, broadcast, cards, facets, images, listing_cache, outbox, payments, scheduler, urls as app_urls, views, webhooks
+from .models import (
+    Amenity, Booking, Comment, HostApplication, OutboxEmail, Post, Property, PropertyComment,
+    PropertyImage, PropertyNight, Review, SchedulerLease, WebhookEvent, Wishlist,
+)
+from .pagination import CursorPaginator
+
+# Values of the required Property fields for tests that do not care about them
+PROPERTY_DEFAULTS = dict(
+    title='Listing', description='A place to stay', property_type='house', location='Paris',
+    price_per_night=100, bedrooms=2, bathrooms=1, max_guests=4, cleaning_fee=10, service_fee=5,
+)
+
+
+def create_property(host, **fields):
+    return Property.objects.create(host=host, **{**PROPERTY_DEFAULTS, **fields})
+
+
+# Every named route in app/urls.py with the user it is requested as, its URL
+# kwargs and the maximum number of queries it may issue on the seeded dataset.
+# Lists are seeded with several rows each, so an N+1 blows the budget.
+ROUTES = {
+    'home': (None, lambda data: {}, 2),
+    'properties': (None, lambda data: {}, 4),  # one more when the facet snapshot reloads
+    'property_detail': ('guest', lambda data: {'pk': data.property.pk}, 11),
+    'dashboard': ('admin', lambda data: {}, 4),
+    'dashboard_tab': ('admin', lambda data: {'tab': 'all_bookings'}, 4),
+    'login': (None, lambda data: {}, 11),
+    'logout': ('guest', lambda data: {}, 4),
+    'register': (None, lambda data: {}, 14),
+    'create_booking': ('guest', lambda data: {'pk': data.property.pk}, 11),
+    'cancel_booking': ('guest', lambda data: {'pk': data.booking.pk}, 7),
+    'booking_success': ('guest', lambda data: {}, 11),
+    'booking_cancel': ('guest', lambda data: {}, 7),
+    'payment_processing': ('guest', lambda data: {'booking_id': data.hold.pk}, 5),
+    'get_stripe_session_url': ('guest', lambda data: {'booking_id': data.hold.pk}, 3),
+    'stripe_webhook': (None, lambda data: {}, 1),
+    'check_availability_api': (None, lambda data: {'property_id': data.property.pk}, 2),
+    'batch_availability_api': (None, lambda data: {}, 2),
+    'properties_map_api': (None, lambda data: {}, 2),  # likewise
+    'get_unavailable_dates_api': (None, lambda data: {'property_id': data.property.pk}, 2),
+    'get_booking_status_api': ('guest', lambda data: {'booking_id': data.hold.pk}, 3),
+    'booking_status_stream': ('guest', lambda data: {'booking_id': data.hold.pk}, 3),
+    'create_listing': ('host', lambda data: {}, 6),
+    'edit_listing': ('host', lambda data: {'pk': data.property.pk}, 4),
+    'delete_listing': ('host', lambda data: {'pk': data.property.pk}, 22),
+    'property_bookings': ('host', lambda data: {'pk': data.property.pk}, 5),
+    'edit_review': ('guest', lambda data: {'pk': data.review.pk}, 3),
+    'delete_review': ('guest', lambda data: {'pk': data.review.pk}, 5),
+    'edit_profile': ('guest', lambda data: {}, 6),
+    'change_password': ('guest', lambda data: {}, 2),
+    'become_host': ('guest', lambda data: {}, 10),
+    'terms': (None, lambda data: {}, 0),
+    'privacy': (None, lambda data: {}, 0),
+    'create_post': ('host', lambda data: {}, 5),
+    'manage_posts': ('admin', lambda data: {}, 4),
+    'approve_post': ('admin', lambda data: {'post_id': data.post.pk}, 5),
+    'decline_post': ('admin', lambda data: {'post_id': data.post.pk}, 5),
+    'approve_host_application': ('admin', lambda data: {'application_id': data.application.pk}, 11),
+    'reject_host_application': ('admin', lambda data: {'application_id': data.application.pk}, 10),
+    'manage_users': ('admin', lambda data: {}, 4),
+    'edit_user': ('admin', lambda data: {'user_id': data.guest.pk}, 8),
+    # The cascade updates the counters of each property the guest reviewed or wishlisted
+    'delete_user': ('admin', lambda data: {'user_id': data.guest.pk}, 33),
+    'toggle_user_status': ('admin', lambda data: {'user_id': data.guest.pk}, 7),
+    'bulk_action': ('admin', lambda data: {}, 5),
+    'add_to_wishlist': ('guest', lambda data: {'property_id': data.unwished.pk}, 8),
+    'remove_from_wishlist': ('guest', lambda data: {'property_id': data.property.pk}, 6),
+    'wishlist_page': ('guest', lambda data: {}, 5),
+    'change_language': ('guest', lambda data: {'language_code': 'fr'}, 7),
+    'pending_paid_bookings_dashboard': ('admin', lambda data: {}, 4),
+    'confirm_pending_booking_dashboard': ('admin', lambda data: {'booking_id': data.booking.pk}, 13),
+    'booking_detail': ('guest', lambda data: {'booking_id': data.booking.pk}, 9),
+    'add_comment': ('guest', lambda data: {'booking_id': data.booking.pk}, 5),
+    'delete_comment': ('guest', lambda data: {'comment_id': data.comment.pk}, 6),
+    'add_property_comment': ('guest', lambda data: {'property_id': data.stayed.pk}, 7),
+    'delete_property_comment': ('guest', lambda data: {'comment_id': data.property_comment.pk}, 7),
+}
+
+# The request each route is measured on, as keyword arguments of
+# Client.generic(); routes missing here get a plain GET. Every route is sent
+# a request it accepts, so budgets cover its real work rather than an early
+# 405 or validation error.
+REQUESTS = {
+    'login': lambda data: {'method': 'post', 'data': {'username': 'guest', 'password': 'password'}},
+    'logout': lambda data: {'method': 'post'},
+    'register': lambda data: {'method': 'post', 'data': {
+        'username': 'newcomer', 'first_name': 'New', 'last_name': 'Comer', 'email': 'newcomer@example.com',
+        'password1': 'a-long-passphrase', 'password2': 'a-long-passphrase',
+    }},
+    'create_booking': lambda data: {'method': 'post', 'data': {
+        'check_in': data.free_check_in.isoformat(),
+        'check_out': (data.free_check_in + timedelta(days=2)).isoformat(), 'guests': 2,
+    }},
+    'cancel_booking': lambda data: {'method': 'post'},
+    'booking_success': lambda data: {'data': {'booking_id': data.hold.pk}},
+    'booking_cancel': lambda data: {'data': {'booking_id': data.hold.pk}},
+    'stripe_webhook': lambda data: data.signed_event('checkout.session.completed', data.hold),
+    'check_availability_api': lambda data: {'data': {
+        'check_in': data.free_check_in.isoformat(),
+        'check_out': (data.free_check_in + timedelta(days=2)).isoformat(),
+    }},
+    'batch_availability_api': lambda data: {
+        'method': 'post', 'content_type': 'application/json', 'data': {'queries': [
+            [property.pk, data.free_check_in.isoformat(), (data.free_check_in + timedelta(days=2)).isoformat()]
+            for property in data.properties
+        ]},
+    },
+    'properties_map_api': lambda data: {'data': {'bbox': '48.5,2.0,49.5,3.0'}},
+    'create_listing': lambda data: {'method': 'post', 'data': {
+        'title': 'Loft', 'description': 'A place to stay', 'property_type': 'apartment',
+        'space_type': 'entire', 'location': 'Lyon', 'price_per_night': 90, 'bedrooms': 1,
+        'bathrooms': 1, 'beds': 1, 'max_guests': 2, 'cleaning_fee': 10, 'service_fee': 5,
+        'highlights': '[]', 'photos': data.photo(),
+    }},
+    'delete_listing': lambda data: {'method': 'post'},
+    'delete_review': lambda data: {'method': 'post'},
+    'edit_profile': lambda data: {'method': 'post', 'data': {
+        'first_name': 'Guest', 'last_name': 'User', 'email': 'guest@example.com',
+        'language': 'French', 'currency': 'EUR',
+    }},
+    'become_host': lambda data: {'method': 'post', 'data': {
+        'business_name': 'Stays', 'business_address': '1 Main St', 'business_phone': '0600000000',
+        'description': 'Hosting',
+    }},
+    'create_post': lambda data: {'method': 'post', 'data': {
+        'property': data.property.pk, 'title': 'Open house', 'content': 'News',
+    }},
+    'approve_post': lambda data: {'method': 'post'},
+    'decline_post': lambda data: {'method': 'post'},
+    'approve_host_application': lambda data: {'method': 'post'},
+    'reject_host_application': lambda data: {'method': 'post'},
+    'edit_user': lambda data: {'method': 'post', 'data': {
+        'username': 'guest', 'email': 'guest@example.com', 'is_active': 'on', 'role': 'user',
+        'phone_number': '0600000000',
+    }},
+    'delete_user': lambda data: {'method': 'post'},
+    'toggle_user_status': lambda data: {'method': 'post'},
+    'bulk_action': lambda data: {
+        'method': 'post', 'content_type': 'application/json',
+        'data': {'action': 'deactivate', 'user_ids': [data.guest.pk, data.application.user_id]},
+    },
+    'add_to_wishlist': lambda data: {'method': 'post'},
+    'remove_from_wishlist': lambda data: {'method': 'post'},
+    'change_language': lambda data: {'data': {'next': '/properties/'}},
+    'confirm_pending_booking_dashboard': lambda data: {'method': 'post'},
+    'add_comment': lambda data: {'method': 'post', 'data': {'content': 'Is there parking?'}},
+    'delete_comment': lambda data: {'method': 'post'},
+    'add_property_comment': lambda data: {'method': 'post', 'data': {'content': 'Lovely stay', 'rating': 5}},
+    'delete_property_comment': lambda data: {'method': 'post'},
+}
+
+
+# Let view errors propagate instead of rendering and mailing an error report,
+# so a broken route fails its subtest
+@override_settings(DEBUG_PROPAGATE_EXCEPTIONS=True)
+class QueryBudgetTests(TestCase):
+    LIST_SIZE = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.host.userprofile.role = 'host'
+        cls.host.userprofile.save()
+        cls.guest = User.objects.create_user('guest', 'guest@example.com', 'password')
+
+        amenities = [Amenity.objects.create(name=f'Amenity {i}', icon='fas fa-star') for i in range(6)]
+        start = timezone.now().date() + timedelta(days=7)
+        cls.free_check_in = start + timedelta(days=30)
+        cls.properties = []
+        for i in range(cls.LIST_SIZE):
+            property = create_property(
+                cls.host, title=f'Property {i}', latitude=48.85 + i / 100, longitude=2.35,
+            )
+            PropertyImage.objects.create(property=property, image=f'properties/{i}-a.jpg')
+            PropertyImage.objects.create(property=property, image=f'properties/{i}-b.jpg', is_primary=True)
+            property.amenities.set(amenities)
+            Review.objects.create(property=property, user=cls.guest, rating=4, comment='Nice')
+            if i < cls.LIST_SIZE - 1:
+                Wishlist.objects.create(user=cls.guest, property=property)
+            Post.objects.create(property=property, host=cls.host, title=f'Post {i}', content='News')
+            booking = Booking.objects.create(
+                property_obj=property, guest=cls.guest, guests=2, total_price=215,
+                check_in=start, check_out=start + timedelta(days=2), status='pending', payment_status='paid',
+            )
+            for _ in range(2):
+                Comment.objects.create(booking=booking, user=cls.guest, content='Question')
+            cls.properties.append(property)
+
+        cls.property = cls.properties[0]
+        cls.unwished = cls.properties[-1]
+        cls.stayed = cls.properties[1]
+        cls.booking = cls.property.bookings.get()
+        cls.review = cls.property.reviews.get()
+        cls.post = cls.property.posts.get()
+        cls.comment = cls.booking.comments.first()
+        cls.property_comment = PropertyComment.objects.create(
+            property=cls.property, user=cls.guest, content='Lovely stay', rating=5,
+        )
+        Booking.objects.create(
+            property_obj=cls.stayed, guest=cls.guest, guests=2, total_price=215, status='completed',
+            payment_status='paid', check_in=start - timedelta(days=30), check_out=start - timedelta(days=28),
+        )
+        # A hold waiting on its Checkout session, for the payment page routes
+        cls.hold = Booking.objects.create(
+            property_obj=cls.property, guest=cls.guest, guests=2, total_price=215,
+            check_in=start + timedelta(days=10), check_out=start + timedelta(days=12),
+            stripe_session_id='cs_test_hold', stripe_session_url='https://checkout.stripe.com/c/pay/cs_test_hold',
+            stripe_session_status='open', stripe_session_expires_at=timezone.now() + timedelta(minutes=30),
+        )
+        cls.application = HostApplication.objects.create(
+            user=User.objects.create_user('applicant', 'applicant@example.com', 'password'),
+            business_name='Stays', business_address='1 Main St', business_phone='0600000000',
+            description='Hosting', identity_document='host_documents/id.pdf',
+        )
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.stripe = FakeStripe()
+        self.stripe.start()
+        self.addCleanup(self.stripe.stop)
+        patcher = self.settings(MEDIA_ROOT=media_root, STRIPE_API_BASE=self.stripe.url)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def photo(self):
+        buffer = BytesIO()
+        Image.new('RGB', (64, 48), (200, 120, 40)).save(buffer, 'JPEG')
+        return SimpleUploadedFile('loft.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def signed_event(self, event_type, booking):
+        payload = json.dumps({
+            'id': f'evt_{booking.pk}', 'object': 'event', 'type': event_type, 'created': int(time.time()),
+            'data': {'object': {'id': booking.stripe_session_id, 'metadata': {'booking_id': str(booking.pk)}}},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(
+            settings.STRIPE_WEBHOOK_SECRET.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256
+        ).hexdigest()
+        return {
+            'method': 'post', 'data': payload, 'content_type': 'application/json',
+            'HTTP_STRIPE_SIGNATURE': f't={timestamp},v1={signature}',
+        }
+
+    def request_route(self, name):
+        """
+        Send ``name`` its request on a cold cache and return the response and
+        the number of queries it issued. Whatever the request changes is
+        rolled back afterwards.
+        """
+        user_key, get_kwargs, _ = ROUTES[name]
+        client = Client()
+        if user_key:
+            client.force_login(getattr(self, user_key))
+        url = reverse(name, kwargs=get_kwargs(self))
+        request = REQUESTS.get(name, lambda data: {})(self)
+        send = getattr(client, request.pop('method', 'get'))
+        cache.clear()
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                response = send(url, **request)
+            transaction.set_rollback(True)
+        return response, len(queries)
+
+    def assertRouteSucceeded(self, name, response):
+        self.assertLess(response.status_code, 400, f'{name} answered {response.status_code}')
+        if response.status_code == 302:
+            self.assertFalse(
+                response.url.startswith(reverse('login')), f'{name} redirected to the login page',
+            )
+        errors = [str(message) for message in get_messages(response.wsgi_request) if message.level == ERROR]
+        self.assertEqual(errors, [], f'{name} reported an error')
+        if response.get('Content-Type') == 'application/json':
+            self.assertIsNot(response.json().get('success'), False, f'{name} answered {response.json()}')
+
+    def test_every_route_has_a_budget(self):
+        names = {pattern.name for pattern in app_urls.urlpatterns if pattern.name}
+        self.assertEqual(names - set(ROUTES), set())
+
+    def test_routes_stay_within_query_budget(self):
+        for name, (_, _, budget) in ROUTES.items():
+            with self.subTest(route=name):
+                response, query_count = self.request_route(name)
+                self.assertRouteSucceeded(name, response)
+                self.assertLessEqual(
+                    query_count, budget,
+                    f'{name} issued {query_count} queries (budget {budget})',
+                )
+
+    def test_query_count_headers(self):
+        response, query_count = self.request_route('properties')
+        self.assertEqual(response['X-DB-Query-Count'], str(query_count))
+        self.assertIn('X-DB-Query-Time-Ms', response)
+
+
+class BenchmarkCommandTests(TestCase):
+    def setUp(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        self.output = f'{output_dir}/report.json'
+
+    def benchmark(self, *args):
+        call_command(
+            'benchmark', '--requests', '2', '--warmup', '0', '--output', self.output, *args, stdout=StringIO(),
+        )
+        with open(self.output) as f:
+            return json.load(f)['scenarios']
+
+    def test_scenarios_exercise_the_real_handlers(self):
+        call_command(
+            'seed_large_dataset', '--users', '5', '--hosts', '2', '--properties', '10', '--bookings', '200',
+            '--reviews', '20', '--wishlists', '10', '--amenities', '3', '--images-per-property', '1',
+            stdout=StringIO(),
+        )
+        scenarios = self.benchmark()
+        for name, result in scenarios.items():
+            with self.subTest(scenario=name):
+                self.assertEqual(result['errors'], 0, f'{name} answered {result["status_codes"]}')
+        self.assertEqual(scenarios['booking_status_api']['status_codes'], {'200': 2})
+        self.assertEqual(scenarios['stripe_session_url']['status_codes'], {'200': 2})
+        self.assertFalse(Booking.objects.filter(stripe_session_id__startswith='cs_bench_').exists())
+
+    def test_requires_a_pending_booking(self):
+        create_property(User.objects.create_user('host', 'host@example.com', 'password'))
+        with self.assertRaisesMessage(CommandError, 'No pending bookings found'):
+            self.benchmark()
+
+    def test_requires_measured_requests(self):
+        with self.assertRaisesMessage(CommandError, '--requests must be positive'):
+            call_command('benchmark', '--requests', '0', stdout=StringIO())
+
+
+class AvailabilityIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.guest = User.objects.create_user('guest', 'guest@example.com', 'password')
+        cls.property = create_property(
+            host, title='Mill', location='Colmar', price_per_night=110, cleaning_fee=15, service_fee=10,
+        )
+        cls.day = timezone.now().date() + timedelta(days=10)
+
+    def setUp(self):
+        cache.clear()
+
+    def days(self, start, end):
+        return self.day + timedelta(days=start), self.day + timedelta(days=end)
+
+    def test_stays_touch_at_check_in_and_check_out(self):
+        index = availability.AvailabilityIndex.from_ranges([self.days(3, 5), self.days(0, 3), self.days(8, 9)])
+        # Back-to-back stays merge into one interval
+        self.assertEqual(len(index.starts), 2)
+        self.assertTrue(index.is_available(*self.days(-2, 0)))
+        self.assertTrue(index.is_available(*self.days(5, 8)))
+        self.assertTrue(index.is_available(*self.days(9, 12)))
+        self.assertFalse(index.is_available(*self.days(-1, 1)))
+        self.assertFalse(index.is_available(*self.days(4, 6)))
+        self.assertFalse(index.is_available(*self.days(2, 3)))
+        self.assertFalse(index.is_available(*self.days(-1, 10)))
+        self.assertEqual(index.unavailable_dates(*self.days(4, 9)), [
+            self.day + timedelta(days=4), self.day + timedelta(days=8),
+        ])
+
+    def book(self, start, end, **fields):
+        check_in, check_out = self.days(start, end)
+        return Booking.objects.create(
+            property_obj=self.property, guest=self.guest, guests=2, total_price=245,
+            check_in=check_in, check_out=check_out, **fields,
+        )
+
+    def test_cached_index_follows_booking_writes(self):
+        booking = self.book(0, 2)
+        with self.assertNumQueries(1):
+            self.assertFalse(availability.is_available(self.property.pk, *self.days(1, 3)))
+        with self.assertNumQueries(0):
+            self.assertFalse(availability.is_available(self.property.pk, *self.days(1, 3)))
+
+        booking.check_out = self.day + timedelta(days=1)
+        booking.save()
+        self.assertTrue(availability.is_available(self.property.pk, *self.days(1, 3)))
+
+        booking.delete()
+        self.assertEqual(availability.unavailable_dates(self.property.pk, self.day), [])
+
+        released = self.book(4, 6, status='confirmed')
+        self.assertFalse(availability.is_available(self.property.pk, *self.days(4, 5)))
+        Booking.objects.filter(pk=released.pk).release(status='completed')
+        self.assertTrue(availability.is_available(self.property.pk, *self.days(4, 5)))
+
+    async def test_async_lookups(self):
+        await sync_to_async(self.book)(0, 2)
+        self.assertEqual(
+            await availability.aunavailable_dates(self.property.pk, self.day),
+            [self.day, self.day + timedelta(days=1)],
+        )
+        self.assertTrue(await availability.ais_available(self.property.pk, *self.days(2, 4)))
+        self.assertFalse(await availability.ais_available(self.property.pk, *self.days(1, 4)))
+
+
+class NightClaimTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.guest = User.objects.create_user('guest', 'guest@example.com', 'password')
+        cls.property = create_property(
+            host, title='Cabin', location='Annecy', price_per_night=120, cleaning_fee=20, service_fee=10,
+        )
+        cls.check_in = timezone.now().date() + timedelta(days=14)
+
+    def book(self, start, nights, **fields):
+        return Booking.objects.create(
+            property_obj=self.property, guest=self.guest, guests=2, total_price=300,
+            check_in=self.check_in + timedelta(days=start),
+            check_out=self.check_in + timedelta(days=start + nights), **fields,
+        )
+
+    def test_overlapping_bookings_are_rejected(self):
+        booking = self.book(0, 3)
+        self.assertEqual(sorted(booking.nights.values_list('night', flat=True)), list(booking.iter_nights()))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.book(2, 2)
+        self.assertEqual(Booking.objects.count(), 1)
+        # The check-out day is free for the next guest's check-in
+        self.book(3, 2)
+
+    def test_released_bookings_free_their_nights(self):
+        cancelled = self.book(0, 3)
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        self.assertFalse(cancelled.nights.exists())
+        completed = self.book(0, 3, status='confirmed')
+
+        Booking.objects.filter(pk=completed.pk).release(status='completed')
+        self.assertFalse(PropertyNight.objects.exists())
+        self.assertTrue(Booking.check_availability(self.property, completed.check_in, completed.check_out))
+        self.book(1, 3)
+
+    def test_backfill_claims_the_nights_of_active_bookings(self):
+        # Bookings made before PropertyNight existed: bulk_create() skips save()
+        first, overlapping, cancelled = Booking.objects.bulk_create([
+            Booking(
+                property_obj=self.property, guest=self.guest, guests=2, total_price=300, status=status,
+                check_in=self.check_in + timedelta(days=start), check_out=self.check_in + timedelta(days=start + 3),
+            )
+            for start, status in [(0, 'confirmed'), (2, 'pending'), (5, 'cancelled')]
+        ])
+        now = timezone.now()
+        for minutes, booking in enumerate([first, overlapping, cancelled]):
+            Booking.objects.filter(pk=booking.pk).update(created_at=now + timedelta(minutes=minutes))
+        self.assertFalse(PropertyNight.objects.exists())
+
+        migration = import_module('app.migrations.0013_propertynight')
+        migration.claim_active_booking_nights(django_apps, None)
+        claims = dict(PropertyNight.objects.values_list('night', 'booking_id'))
+        # Overlaps keep the earlier booking's claim
+        self.assertEqual(claims, {
+            self.check_in: first.pk,
+            self.check_in + timedelta(days=1): first.pk,
+            self.check_in + timedelta(days=2): first.pk,
+            self.check_in + timedelta(days=3): overlapping.pk,
+            self.check_in + timedelta(days=4): overlapping.pk,
+        })
+
+
+class DateSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        guest = User.objects.create_user('guest', 'guest@example.com', 'password')
+        cls.booked, cls.free = [
+            create_property(host, title=title, location='Lille', price_per_night=80)
+            for title in ('Booked house', 'Free house')
+        ]
+        cls.check_in = timezone.now().date() + timedelta(days=10)
+        Booking.objects.create(
+            property_obj=cls.booked, guest=guest, guests=2, total_price=175,
+            check_in=cls.check_in, check_out=cls.check_in + timedelta(days=2),
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, check_in, check_out):
+        response = self.client.get(reverse('properties'), {'check_in': check_in, 'check_out': check_out})
+        return {p.pk for p in response.context['properties']}
+
+    def test_properties_with_a_claimed_night_are_left_out(self):
+        day = self.check_in
+        self.assertEqual(self.search(day + timedelta(days=1), day + timedelta(days=4)), {self.free.pk})
+        self.assertEqual(self.search(day - timedelta(days=3), day + timedelta(days=1)), {self.free.pk})
+        # Stays ending on the booking's check-in or starting on its check-out fit
+        self.assertEqual(self.search(day - timedelta(days=2), day), {self.booked.pk, self.free.pk})
+        self.assertEqual(self.search(day + timedelta(days=2), day + timedelta(days=3)), {self.booked.pk, self.free.pk})
+
+    def test_invalid_ranges_are_ignored(self):
+        both = {self.booked.pk, self.free.pk}
+        self.assertEqual(self.search(self.check_in + timedelta(days=1), self.check_in), both)
+        self.assertEqual(self.search('soon', self.check_in), both)
+
+    def test_the_filter_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            available = list(Property.objects.available_between(self.check_in, self.check_in + timedelta(days=1)))
+        self.assertEqual(available, [self.free])
+
+
+class BatchAvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        guest = User.objects.create_user('guest', 'guest@example.com', 'password')
+        cls.booked, cls.free = [
+            create_property(
+                host, title=title, property_type='apartment', location='Bordeaux', price_per_night=95,
+                bedrooms=1, max_guests=2,
+            )
+            for title in ('Booked flat', 'Free flat')
+        ]
+        cls.check_in = timezone.now().date() + timedelta(days=10)
+        Booking.objects.create(
+            property_obj=cls.booked, guest=guest, guests=2, total_price=200,
+            check_in=cls.check_in, check_out=cls.check_in + timedelta(days=2),
+        )
+
+    def post(self, body):
+        return self.client.post(reverse('batch_availability_api'), body, content_type='application/json')
+
+    def day(self, offset):
+        return (self.check_in + timedelta(days=offset)).isoformat()
+
+    def test_every_query_is_answered_in_constant_queries(self):
+        queries = [
+            [self.booked.pk, self.day(1), self.day(3)],
+            [self.booked.pk, self.day(2), self.day(4)],
+            [self.free.pk, self.day(0), self.day(2)],
+            {'property_id': self.booked.pk, 'check_in': self.day(-2), 'check_out': self.day(0)},
+            [0, self.day(0), self.day(1)],
+            [self.free.pk, self.day(2), self.day(1)],
+            [self.free.pk, 'soon'],
+        ]
+        # One lookup of the properties and one of their claimed nights
+        with self.assertNumQueries(2):
+            results = self.post({'queries': queries}).json()['results']
+        self.assertEqual([result.get('available') for result in results], [False, True, True, True, None, None, None])
+        self.assertEqual(results[4]['error'], 'Property not found')
+        self.assertTrue(results[5]['error'].startswith('Invalid query'))
+        self.assertTrue(results[6]['error'].startswith('Invalid query'))
+
+    def test_malformed_requests_are_rejected(self):
+        self.assertEqual(self.client.get(reverse('batch_availability_api')).status_code, 405)
+        self.assertEqual(self.post('not json').status_code, 400)
+        self.assertEqual(self.post({'queries': []}).status_code, 400)
+        too_many = [[self.free.pk, self.day(0), self.day(1)]] * (views.MAX_BATCH_AVAILABILITY_QUERIES + 1)
+        self.assertEqual(self.post({'queries': too_many}).status_code, 400)
+
+
+class PropertyAggregateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.guest = User.objects.create_user('guest', 'guest@example.com', 'password')
+        cls.other = User.objects.create_user('other', 'other@example.com', 'password')
+        cls.property = create_property(
+            cls.host, title='Farmhouse', property_type='farm', location='Dijon', price_per_night=130,
+            bedrooms=3, bathrooms=2, max_guests=6, cleaning_fee=25, service_fee=15,
+        )
+
+    def counters(self):
+        self.property.refresh_from_db()
+        return self.property.rating_avg, self.property.rating_count, self.property.wishlist_count
+
+    def test_ratings_track_reviews_and_comments(self):
+        review = Review.objects.create(property=self.property, user=self.guest, rating=4, comment='Nice')
+        self.assertEqual(self.counters(), (4, 1, 0))
+        comment = PropertyComment.objects.create(property=self.property, user=self.other, content='Great', rating=5)
+        self.assertEqual(self.counters(), (4.5, 2, 0))
+
+        review.rating = 2
+        review.save()
+        self.assertEqual(self.counters(), (3.5, 2, 0))
+        comment.delete()
+        self.assertEqual(self.counters(), (2, 1, 0))
+        review.delete()
+        self.assertEqual(self.counters(), (0, 0, 0))
+
+    def test_wishlist_count_never_goes_negative(self):
+        wishlist = Wishlist.objects.create(user=self.guest, property=self.property)
+        Wishlist.objects.create(user=self.other, property=self.property)
+        self.assertEqual(self.counters()[2], 2)
+        wishlist.delete()
+        self.assertEqual(self.counters()[2], 1)
+
+        # A counter already out of step with the table stops at zero
+        Property.objects.filter(pk=self.property.pk).update(wishlist_count=0)
+        Wishlist.objects.get().delete()
+        self.assertEqual(self.counters()[2], 0)
+
+    def test_rebuild_command_and_rating_sort(self):
+        other = create_property(
+            self.host, title='Barn', property_type='farm', location='Dijon', price_per_night=90, bedrooms=1,
+            max_guests=2,
+        )
+        Review.objects.create(property=self.property, user=self.guest, rating=3, comment='Fine')
+        Review.objects.create(property=other, user=self.guest, rating=5, comment='Lovely')
+        Wishlist.objects.create(user=self.guest, property=other)
+        Property.objects.update(rating_avg=0, rating_count=0, wishlist_count=7)
+
+        out = StringIO()
+        call_command('rebuild_property_aggregates', '--batch-size', '1', stdout=out)
+        self.assertIn('Successfully rebuilt aggregates for 2 properties', out.getvalue())
+        self.assertEqual(self.counters(), (3, 1, 0))
+        response = self.client.get(reverse('properties'), {'sort': 'rating'})
+        self.assertEqual([p.pk for p in response.context['properties']], [other.pk, self.property.pk])
+        self.assertEqual(Property.objects.get(pk=other.pk).wishlist_count, 1)
+
+
+class PrimaryImageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.with_primary, cls.without_primary, cls.without_images = [
+            create_property(
+                host, title=title, property_type='cottage', location='Quimper', price_per_night=75,
+                bedrooms=1, max_guests=2,
+            )
+            for title in ('Primary', 'No primary', 'No images')
+        ]
+        PropertyImage.objects.create(property=cls.with_primary, image='properties/a.jpg')
+        PropertyImage.objects.create(property=cls.with_primary, image='properties/b.jpg', is_primary=True)
+        PropertyImage.objects.create(property=cls.without_primary, image='properties/c.jpg')
+        PropertyImage.objects.create(property=cls.without_primary, image='properties/d.jpg')
+
+    def primary_images(self, properties):
+        return {p.pk: p.primary_image for p in properties}
+
+    def test_prefetched_images_are_resolved_without_queries(self):
+        expected = {
+            self.with_primary.pk: '/media/properties/b.jpg',
+            self.without_primary.pk: '/media/properties/c.jpg',
+            self.without_images.pk: None,
+        }
+        with self.assertNumQueries(2):
+            properties = list(Property.objects.with_images())
+        with self.assertNumQueries(0):
+            self.assertEqual(self.primary_images(properties), expected)
+        # Without the prefetch each property looks its images up
+        with self.assertNumQueries(6):
+            self.assertEqual(self.primary_images(Property.objects.all()), expected)
+
+
+class PropertySearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.riad = create_property(
+            host, title='Riad near the medina', description='Quiet patio', location='Marrakech',
+        )
+        cls.flat = create_property(
+            host, title='City flat', description='Walk to the riad district', location='Marrakech',
+        )
+        cls.villa = create_property(
+            host, title='Seaside villa', description='Pool', location='Agadir', highlights='ocean view',
+        )
+
+    def search(self, query):
+        response = self.client.get(reverse('properties'), {'location': query})
+        return [property.pk for property in response.context['properties']]
+
+    def test_matches_prefixes_across_fields_ranked_by_relevance(self):
+        self.assertEqual(self.search('riad'), [self.riad.pk, self.flat.pk])
+        self.assertCountEqual(self.search('marrak'), [self.riad.pk, self.flat.pk])
+        self.assertEqual(self.search('ocean vi'), [self.villa.pk])
+        self.assertEqual(self.search('riad agadir'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.villa.title = 'Surf lodge'
+        self.villa.save()
+        self.assertEqual(self.search('surf'), [self.villa.pk])
+        self.assertEqual(self.search('seaside'), [])
+
+        self.villa.delete()
+        self.assertEqual(self.search('surf'), [])
+
+
+class GeoSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.paris = create_property(host, title='Paris', latitude='48.856600', longitude='2.352200')
+        cls.versailles = create_property(
+            host, title='Versailles', location='Versailles', latitude='48.804900', longitude='2.120400',
+        )
+        cls.lyon = create_property(
+            host, title='Lyon', location='Lyon', latitude='45.764000', longitude='4.835700',
+        )
+        cls.fiji = create_property(
+            host, title='Fiji', location='Suva', latitude='-18.124800', longitude='178.450100',
+        )
+        create_property(host, title='Unmapped', location='Nowhere')
+
+    def listing(self, **params):
+        response = self.client.get(reverse('properties'), params)
+        return [property.pk for property in response.context['properties']]
+
+    def test_radius_search_orders_by_distance(self):
+        self.assertEqual(self.listing(lat=48.86, lng=2.35, radius=30), [self.paris.pk, self.versailles.pk])
+        self.assertEqual(
+            self.listing(lat=48.86, lng=2.35, radius=500),
+            [self.paris.pk, self.versailles.pk, self.lyon.pk],
+        )
+
+    def test_map_api_returns_markers_in_viewport(self):
+        response = self.client.get(reverse('properties_map_api'), {'bbox': '45,2.2,49,5'})
+        self.assertEqual({marker['id'] for marker in response.json()['results']}, {self.paris.pk, self.lyon.pk})
+
+        # A viewport spanning the antimeridian
+        response = self.client.get(reverse('properties_map_api'), {'bbox': '-20,170,-10,-170'})
+        self.assertEqual([marker['id'] for marker in response.json()['results']], [self.fiji.pk])
+
+        response = self.client.get(reverse('properties_map_api'), {'bbox': '49,2,45,5'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_index_follows_coordinate_changes(self):
+        self.lyon.latitude, self.lyon.longitude = '48.900000', '2.300000'
+        self.lyon.save()
+        self.assertIn(self.lyon.pk, self.listing(lat=48.86, lng=2.35, radius=30))
+
+        self.lyon.latitude = self.lyon.longitude = None
+        self.lyon.save()
+        self.assertNotIn(self.lyon.pk, self.listing(bbox='-90,-180,90,180'))
+
+
+class AmenityFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.wifi, cls.pool, cls.parking = (
+            Amenity.objects.create(name=name, icon='fas fa-star') for name in ('Wi-Fi', 'Pool', 'Parking')
+        )
+        cls.both = create_property(host, title='Both')
+        cls.both.amenities.set([cls.wifi, cls.pool])
+        cls.wifi_only = create_property(host, title='Wifi only')
+        cls.wifi.properties.add(cls.wifi_only)
+
+    def listing(self, *slugs):
+        response = self.client.get(reverse('properties'), {'amenities': slugs})
+        return {property.pk for property in response.context['properties']}
+
+    def test_filter_requires_every_selected_amenity(self):
+        self.assertEqual(self.listing('wi-fi'), {self.both.pk, self.wifi_only.pk})
+        self.assertEqual(self.listing('wi-fi', 'pool'), {self.both.pk})
+        self.assertEqual(self.listing('wi-fi', 'unknown'), set())
+
+    def test_filter_accepts_amenity_names(self):
+        self.assertEqual(self.listing('Wi-Fi', 'Pool'), {self.both.pk})
+        self.assertEqual(self.listing('Wi-Fi', 'pool'), {self.both.pk})
+        response = self.client.get(reverse('properties'), {'amenities': ['Wi-Fi']})
+        self.assertContains(
+            response, '<input type="checkbox" name="amenities" value="wi-fi" id="amenity_wi-fi" checked>', html=True,
+        )
+
+    def test_mask_follows_amenity_links(self):
+        self.pool.properties.add(self.wifi_only)
+        self.assertEqual(self.listing('pool'), {self.both.pk, self.wifi_only.pk})
+
+        self.both.amenities.remove(self.pool)
+        self.pool.properties.clear()
+        self.assertEqual(self.listing('pool'), set())
+
+        self.wifi.delete()
+        self.assertEqual(Property.objects.get(pk=self.both.pk).amenity_mask, 0)
+
+    def test_backfill_numbers_colliding_slugs(self):
+        migration = import_module('app.migrations.0017_amenity_bitmask')
+        Amenity.objects.filter(pk=self.wifi.pk).update(name=f'Pool {self.parking.pk}')
+        Amenity.objects.filter(pk=self.parking.pk).update(name='Pool')
+        migration.backfill_amenity_bits(django_apps, None)
+        self.assertEqual(
+            list(Amenity.objects.order_by('id').values_list('slug', flat=True)),
+            [f'pool-{self.parking.pk}', 'pool', 'pool-2'],
+        )
+
+
+class FacetCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.wifi = Amenity.objects.create(name='Wi-Fi', icon='fas fa-wifi')
+        cls.house = create_property(host, title='House', price_per_night=80)
+        cls.house.amenities.add(cls.wifi)
+        create_property(host, title='Flat', property_type='apartment', price_per_night=150, bedrooms=1)
+        create_property(host, title='Villa', property_type='villa', price_per_night=600, bedrooms=5)
+
+    def setUp(self):
+        # Test transactions roll back without the signals that version the snapshot
+        facets.invalidate()
+
+    def facets(self, **params):
+        return self.client.get(reverse('properties'), params).context['facets']
+
+    def test_groups_are_counted_without_their_own_selection(self):
+        counts = self.facets(type=['house', 'villa'], bedrooms='4')
+        self.assertEqual(counts['total'], 1)
+        # Property types ignore the type selection but respect the bedrooms one
+        self.assertEqual({t['value']: t['count'] for t in counts['types'] if t['count']}, {'villa': 1})
+        self.assertEqual(counts['bedrooms'], {'1': 0, '2': 1, '3': 0, '4': 1})
+        self.assertEqual([price['count'] for price in counts['prices']], [0, 0, 0, 0, 1])
+
+    def test_amenities_are_counted_within_the_results(self):
+        counts = self.facets(max_price='100')
+        self.assertEqual(counts['total'], 1)
+        self.assertEqual([(a['amenity'], a['count']) for a in counts['amenities']], [(self.wifi, 1)])
+        self.assertEqual(self.facets(location='villa')['amenities'][0]['count'], 0)
+
+    def test_snapshot_follows_property_writes(self):
+        self.assertEqual(self.facets(type='house')['total'], 1)
+        self.house.property_type = 'villa'
+        self.house.save()
+        self.assertEqual(self.facets(type='house')['total'], 0)
+        self.house.amenities.clear()
+        self.assertEqual(self.facets()['amenities'][0]['count'], 0)
+
+
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        # Repeated prices make the id tiebreaker matter
+        for n in range(30):
+            create_property(host, title=f'Listing {n}', price_per_night=50 + n % 4, bedrooms=1, max_guests=2)
+
+    def walk(self, ordering, per_page=7):
+        queryset = Property.objects.order_by(*ordering)
+        paginator = CursorPaginator(queryset, per_page)
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        return queryset, paginator, pages
+
+    def test_pages_follow_the_ordering_both_ways(self):
+        for ordering in (['price_per_night'], ['-price_per_night'], ['-created_at']):
+            with self.subTest(ordering=ordering):
+                queryset, paginator, pages = self.walk(ordering)
+                expected = list(queryset.order_by(*paginator.ordering).values_list('id', flat=True))
+                self.assertEqual([p.pk for page in pages for p in page], expected)
+                self.assertFalse(pages[0].has_previous())
+
+                backwards = [pages[-1]]
+                while backwards[-1].has_previous():
+                    backwards.append(paginator.get_page(backwards[-1].previous_cursor))
+                self.assertEqual([[p.pk for p in page] for page in backwards[1:]],
+                                 [[p.pk for p in page] for page in reversed(pages[:-1])])
+
+    def test_bad_or_foreign_cursors_give_the_first_page(self):
+        _, paginator, pages = self.walk(['price_per_night'])
+        first = [p.pk for p in pages[0]]
+        price_desc = CursorPaginator(Property.objects.order_by('-price_per_night'), 7)
+        for cursor in ('garbage', 'e30', price_desc.get_page().next_cursor):
+            with self.subTest(cursor=cursor):
+                self.assertEqual([p.pk for p in paginator.get_page(cursor)], first)
+
+    def test_listing_links_to_the_next_page(self):
+        response = self.client.get(reverse('properties'), {'sort': 'price_asc'})
+        page = response.context['properties']
+        self.assertEqual(len(page), 12)
+        self.assertContains(response, f'cursor={page.next_cursor}')
+        response = self.client.get(reverse('properties'), {'sort': 'price_asc', 'cursor': page.next_cursor})
+        self.assertEqual(len(response.context['properties']), 12)
+        self.assertTrue(response.context['properties'].has_previous())
+
+
+class ListingCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.guest = User.objects.create_user('guest', 'guest@example.com', 'password')
+        cls.property = create_property(
+            cls.host, title='Loft', property_type='apartment', location='Lyon', price_per_night=120,
+        )
+
+    def setUp(self):
+        # Test transactions roll back without the signals that version the cache
+        listing_cache.bump_version()
+        facets.invalidate()
+
+    def get(self, query):
+        return self.client.get(reverse('properties') + '?' + query)
+
+    def test_equivalent_queries_share_an_entry(self):
+        self.assertEqual(
+            listing_cache.normalize(QueryDict('type=house&type=villa&min_price=100.00&utm=x&location=Old++Town')),
+            listing_cache.normalize(QueryDict('location=old%20town&min_price=100&type=villa&type=house&type=')),
+        )
+        self.assertEqual(self.get('type=apartment&min_price=100.00')['X-Listing-Cache'], 'miss')
+        response = self.get('min_price=100&type=apartment')
+        self.assertEqual(response['X-Listing-Cache'], 'hit')
+        self.assertEqual([p.pk for p in response.context['properties']], [self.property.pk])
+        self.assertEqual(response.context['facets']['total'], 1)
+
+    def test_writes_invalidate_and_counters_track(self):
+        listing_cache.reset_stats()
+        self.get('')
+        self.get('')
+        self.assertEqual(self.get('')['X-Listing-Cache'], 'hit')
+
+        Booking.objects.create(
+            property_obj=self.property, guest=self.guest, check_in=timezone.now().date() + timedelta(days=3),
+            check_out=timezone.now().date() + timedelta(days=5), guests=2, total_price=250,
+        )
+        self.assertEqual(self.get('')['X-Listing-Cache'], 'miss')
+
+        self.property.title = 'Renamed loft'
+        self.property.save()
+        response = self.get('')
+        self.assertEqual(response['X-Listing-Cache'], 'miss')
+        self.assertContains(response, 'Renamed loft')
+        self.assertEqual(listing_cache.stats()['hits'], 2)
+        self.assertEqual(listing_cache.stats()['misses'], 3)
+
+    def test_reviews_invalidate(self):
+        Booking.objects.create(
+            property_obj=self.property, guest=self.guest, check_in=timezone.now().date() - timedelta(days=5),
+            check_out=timezone.now().date() - timedelta(days=3), guests=2, total_price=250, status='completed',
+        )
+        self.get('sort=rating')
+        self.assertEqual(self.get('sort=rating')['X-Listing-Cache'], 'hit')
+
+        self.client.force_login(self.guest)
+        self.client.post(
+            reverse('add_property_comment', kwargs={'property_id': self.property.pk}),
+            {'content': 'Lovely', 'rating': 4},
+        )
+        response = self.get('sort=rating')
+        self.assertEqual(response['X-Listing-Cache'], 'miss')
+        self.assertContains(response, '4.0')
+
+        Wishlist.objects.create(user=self.guest, property=self.property)
+        self.assertEqual(self.get('sort=rating')['X-Listing-Cache'], 'miss')
+
+    def test_swept_holds_reappear_in_date_filtered_results(self):
+        check_in = timezone.now().date() + timedelta(days=3)
+        Booking.objects.create(
+            property_obj=self.property, guest=self.guest, check_in=check_in,
+            check_out=check_in + timedelta(days=2), guests=2, total_price=250,
+            expires_at=timezone.now() - timedelta(minutes=1),
+        )
+        query = f'check_in={check_in}&check_out={check_in + timedelta(days=1)}'
+        self.assertEqual(list(self.get(query).context['properties']), [])
+        self.assertEqual(self.get(query)['X-Listing-Cache'], 'hit')
+
+        self.assertEqual(scheduler.sweep()['processed'], 1)
+        response = self.get(query)
+        self.assertEqual(response['X-Listing-Cache'], 'miss')
+        self.assertEqual([p.pk for p in response.context['properties']], [self.property.pk])
+
+
+class CardCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.guest = User.objects.create_user('guest', 'guest@example.com', 'password')
+        cls.property = create_property(
+            host, title='Cabin', property_type='cabin', location='Annecy', price_per_night=90, bedrooms=1,
+            max_guests=2,
+        )
+
+    def setUp(self):
+        cards.invalidate()
+
+    def test_cards_are_rendered_once_per_version(self):
+        with self.assertTemplateUsed('cards/listing.html'):
+            self.client.get(reverse('properties'))
+        with self.assertTemplateNotUsed('cards/listing.html'):
+            response = self.client.get(reverse('properties'), {'sort': 'newest'})
+        self.assertContains(response, 'Cabin')
+
+        self.property.title = 'Log cabin'
+        self.property.save()
+        with self.assertTemplateUsed('cards/listing.html'):
+            self.assertContains(self.client.get(reverse('properties')), 'Log cabin')
+
+    def test_wishlist_state_is_not_cached(self):
+        filled_heart = '<i class="fas fa-heart"></i>'
+        self.assertNotContains(self.client.get(reverse('properties')), filled_heart, html=True)
+        Wishlist.objects.create(user=self.guest, property=self.property)
+        self.client.force_login(self.guest)
+        self.assertContains(self.client.get(reverse('properties')), filled_heart, html=True)
+
+
+class DashboardTabTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.guest = User.objects.create_user('guest', 'guest@example.com', 'password')
+        start = timezone.now().date() + timedelta(days=7)
+        for i in range(15):
+            property = create_property(
+                cls.host, title=f'Flat {i}', property_type='apartment', location='Nice', price_per_night=80,
+                bedrooms=1, max_guests=2,
+            )
+            Booking.objects.create(
+                property_obj=property, guest=cls.guest, guests=2, total_price=175,
+                check_in=start, check_out=start + timedelta(days=2),
+            )
+
+    def test_tabs_are_paginated(self):
+        self.client.force_login(self.guest)
+        url = reverse('dashboard_tab', args=['bookings'])
+        first = self.client.get(url).json()
+        self.assertTrue(first['success'])
+        self.assertEqual(first['html'].count('Flat '), views.DASHBOARD_PAGE_SIZE)
+        second = self.client.get(url, {'cursor': first['next_cursor']}).json()
+        self.assertEqual(second['html'].count('Flat '), 15 - views.DASHBOARD_PAGE_SIZE)
+        self.assertIsNone(second['next_cursor'])
+        self.assertIsNotNone(second['previous_cursor'])
+
+    def test_stats_and_role_checks(self):
+        self.client.force_login(self.guest)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['stats'], {'booking_count': 15, 'review_count': 0, 'property_count': 0})
+        self.assertEqual(self.client.get(reverse('dashboard_tab', args=['all_bookings'])).status_code, 403)
+        self.assertEqual(self.client.get(reverse('dashboard_tab', args=['unknown'])).status_code, 404)
+
+
+class BookingExpiryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.guest = User.objects.create_user('guest', 'guest@example.com', 'password')
+        cls.property = create_property(
+            host, title='Studio', property_type='apartment', location='Lille', price_per_night=60,
+            bedrooms=1, max_guests=2,
+        )
+
+    def book(self, days_ahead, **fields):
+        check_in = timezone.now().date() + timedelta(days=days_ahead)
+        return Booking.objects.create(
+            property_obj=self.property, guest=self.guest, guests=1, total_price=135,
+            check_in=check_in, check_out=check_in + timedelta(days=2), **fields,
+        )
+
+    def test_expired_holds_are_swept_in_batches(self):
+        past = timezone.now() - timedelta(minutes=1)
+        expired = [self.book(10 + 3 * i, expires_at=past) for i in range(3)]
+        paid = self.book(30, expires_at=past, payment_status='paid')
+        live = self.book(40)
+        self.assertAlmostEqual(live.expires_at, live.created_at + Booking.HOLD_DURATION, delta=timedelta(seconds=1))
+        self.assertFalse(live.is_expired)
+        self.assertTrue(expired[0].is_expired)
+
+        self.assertEqual(Booking.objects.expire_holds(batch_size=2), 3)
+        self.assertEqual(
+            set(Booking.objects.filter(status='cancelled').values_list('id', flat=True)),
+            {booking.pk for booking in expired},
+        )
+        self.assertFalse(PropertyNight.objects.filter(booking__in=expired).exists())
+        for booking in (paid, live):
+            booking.refresh_from_db()
+            self.assertEqual(booking.status, 'pending')
+
+    def test_finished_stays_are_completed_in_batches(self):
+        finished = [self.book(-20 + 3 * i, status='confirmed') for i in range(5)]
+        current = self.book(-1, status='confirmed')
+        self.assertEqual(Booking.objects.finished().count(), 5)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(scheduler.sweep(batch_size=2), {'backlog': 5, 'processed': 5})
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "app_booking"')]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(
+            set(Booking.objects.filter(status='completed').values_list('id', flat=True)),
+            {booking.pk for booking in finished},
+        )
+        self.assertFalse(PropertyNight.objects.filter(booking__in=finished).exists())
+        current.refresh_from_db()
+        self.assertEqual(current.status, 'confirmed')
+
+    def test_cleanup_command_reports_count(self):
+        self.book(10, expires_at=timezone.now() - timedelta(minutes=1))
+        out = StringIO()
+        call_command('cleanup_expired_bookings', stdout=out)
+        self.assertIn('cleaned up 1 expired bookings', out.getvalue())
+
+    def test_scheduler_lease_admits_one_worker(self):
+        self.book(10, expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(scheduler.run_once('worker-a', ttl=60), {'backlog': 1, 'processed': 1, 'duration_ms': ANY})
+        self.assertIsNone(scheduler.run_once('worker-b', ttl=60))
+        lease = SchedulerLease.objects.get(name=scheduler.LEASE_NAME)
+        self.assertEqual((lease.owner, lease.last_backlog, lease.last_processed), ('worker-a', 1, 1))
+
+        # A lease that was not renewed in time passes to the next worker
+        later = timezone.now() + timedelta(seconds=61)
+        self.assertTrue(scheduler.acquire_lease('worker-b', ttl=60, now=later))
+        self.assertFalse(scheduler.acquire_lease('worker-a', ttl=60, now=later))
+        scheduler.release_lease('worker-b')
+        self.assertTrue(scheduler.acquire_lease('worker-a', ttl=60))
+
+
+class OutboxTests(TestCase):
+    def test_mail_is_queued_with_the_transaction(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            outbox.queue_mail('Rolled back', 'Body', None, ['guest@example.com'])
+            raise RuntimeError
+        outbox.queue_mail('Welcome', 'Body', None, ['guest@example.com'])
+        self.assertEqual(mail.outbox, [])
+
+        self.assertEqual(outbox.drain(), {'sent': 1, 'failed': 0})
+        self.assertEqual([message.subject for message in mail.outbox], ['Welcome'])
+        self.assertEqual(OutboxEmail.objects.get().status, 'sent')
+        self.assertEqual(outbox.drain(), {'sent': 0, 'failed': 0})
+
+    def test_failures_back_off_then_give_up(self):
+        email = outbox.queue_mail('Receipt', 'Body', None, ['guest@example.com'])
+        now = timezone.now()
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=SMTPException('down')):
+            self.assertEqual(outbox.drain(now=now), {'sent': 0, 'failed': 1})
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), ('pending', 1))
+            self.assertEqual(email.next_attempt_at, now + outbox.BACKOFF_BASE)
+            self.assertEqual(outbox.drain(now=now), {'sent': 0, 'failed': 0})
+
+            with self.assertLogs('app.outbox', 'ERROR'):
+                for _ in range(outbox.MAX_ATTEMPTS - 1):
+                    outbox.drain(now=email.next_attempt_at)
+                    email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', outbox.MAX_ATTEMPTS))
+        self.assertIn('down', email.last_error)
+
+
+class FakeStripe(ThreadingHTTPServer):
+    """A local stand-in for the Stripe API's Checkout session endpoints."""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeStripeHandler)
+        self.decline = False
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        self.server.requests.append((self.path, body))
+        if self.server.decline:
+            self.reply(402, {'error': {'type': 'card_error', 'message': 'Your card was declined.'}})
+        else:
+            self.reply(200, self.session(f'cs_test_{len(self.server.requests)}'))
+
+    def do_GET(self):
+        self.server.requests.append((self.path, ''))
+        self.reply(200, self.session(self.path.rsplit('/', 1)[-1]))
+
+    def session(self, session_id):
+        return {
+            'id': session_id, 'object': 'checkout.session', 'status': 'open',
+            'url': f'{self.server.url}/pay/{session_id}', 'expires_at': int(time.time()) + 1800,
+        }
+
+    def reply(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class TwoPhaseBookingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.guest = User.objects.create_user('guest', 'guest@example.com', 'password')
+        cls.property = create_property(
+            host, title='Chalet', location='Chamonix', price_per_night=200, bedrooms=3, bathrooms=2,
+            max_guests=6, cleaning_fee=30, service_fee=20,
+        )
+
+    def setUp(self):
+        self.client.force_login(self.guest)
+        self.stripe = FakeStripe()
+        self.stripe.start()
+        self.addCleanup(self.stripe.stop)
+        patcher = self.settings(STRIPE_API_BASE=self.stripe.url)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def book(self):
+        check_in = timezone.now().date() + timedelta(days=20)
+        return self.client.post(reverse('create_booking', args=[self.property.pk]), {
+            'check_in': check_in.isoformat(), 'check_out': (check_in + timedelta(days=3)).isoformat(), 'guests': 2,
+        })
+
+    def test_session_is_created_outside_the_booking_transaction(self):
+        depth = len(connection.atomic_blocks)
+        depths = []
+        create = payments.create_checkout_session
+
+        def record_depth(*args):
+            depths.append(len(connection.atomic_blocks))
+            return create(*args)
+
+        with patch.object(payments, 'create_checkout_session', side_effect=record_depth):
+            response = self.book()
+        booking = Booking.objects.get()
+        self.assertRedirects(response, reverse('payment_processing', args=[booking.pk]), fetch_redirect_response=False)
+        self.assertEqual(depths, [depth])
+        self.assertEqual(booking.stripe_session_id, 'cs_test_1')
+        self.assertEqual(booking.nights.count(), 3)
+        path, body = self.stripe.requests[0]
+        self.assertEqual(path, '/v1/checkout/sessions')
+        self.assertIn(f'metadata[booking_id]={booking.pk}', body)
+
+    def test_failed_session_releases_the_hold(self):
+        self.stripe.decline = True
+        response = self.book()
+        self.assertRedirects(response, reverse('property_detail', args=[self.property.pk]), fetch_redirect_response=False)
+        self.assertFalse(Booking.objects.exists())
+        self.assertFalse(PropertyNight.objects.exists())
+
+        # The dates can be booked again once Stripe recovers
+        self.stripe.decline = False
+        self.book()
+        self.assertEqual(Booking.objects.get().status, 'pending')
+
+    def test_session_url_is_served_from_the_booking(self):
+        self.book()
+        booking = Booking.objects.get()
+        self.assertEqual(booking.stripe_session_status, 'open')
+        self.assertGreater(booking.stripe_session_expires_at, timezone.now())
+
+        page = self.client.get(reverse('payment_processing', args=[booking.pk]))
+        self.assertContains(page, f'window.stripeSessionUrl = "{booking.stripe_session_url}"')
+        response = self.client.get(reverse('get_stripe_session_url', args=[booking.pk]))
+        self.assertEqual(response.json(), {'url': booking.stripe_session_url})
+        self.assertEqual(len(self.stripe.requests), 1)
+
+        Booking.objects.filter(pk=booking.pk).update(stripe_session_expires_at=timezone.now())
+        response = self.client.get(reverse('get_stripe_session_url', args=[booking.pk]))
+        self.assertEqual(response.status_code, 400)
+
+    def test_sessions_without_stored_details_are_retrieved_once(self):
+        cache.clear()
+        self.book()
+        Booking.objects.update(stripe_session_url='', stripe_session_status='', stripe_session_expires_at=None)
+        url = reverse('get_stripe_session_url', args=[Booking.objects.get().pk])
+        for _ in range(3):
+            self.assertEqual(self.client.get(url).json(), {'url': f'{self.stripe.url}/pay/cs_test_1'})
+        self.assertEqual([path for path, body in self.stripe.requests], [
+            '/v1/checkout/sessions', '/v1/checkout/sessions/cs_test_1',
+        ])
+        self.assertEqual(Booking.objects.get().stripe_session_status, 'open')
+
+    async def test_concurrent_refreshes_share_one_stripe_call(self):
+        await cache.aclear()
+        await sync_to_async(self.book)()
+        await Booking.objects.aupdate(stripe_session_url='', stripe_session_status='')
+        states = await asyncio.gather(*[payments.arefresh_session_state('cs_test_1') for _ in range(5)])
+        self.assertEqual({state['url'] for state in states}, {f'{self.stripe.url}/pay/cs_test_1'})
+        self.assertEqual([path for path, body in self.stripe.requests][1:], ['/v1/checkout/sessions/cs_test_1'])
+
+
+class WebhookLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        guest = User.objects.create_user('guest', 'guest@example.com', 'password')
+        property = create_property(host, title='Barn', location='Rouen', price_per_night=70)
+        check_in = timezone.now().date() + timedelta(days=12)
+        cls.booking = Booking.objects.create(
+            property_obj=property, guest=guest, guests=2, total_price=155,
+            check_in=check_in, check_out=check_in + timedelta(days=2), stripe_session_id='cs_test_barn',
+        )
+
+    def deliver(self, event_id):
+        event = {
+            'id': event_id, 'object': 'event', 'type': 'checkout.session.completed', 'created': int(time.time()),
+            'data': {'object': {'id': 'cs_test_barn', 'metadata': {'booking_id': str(self.booking.pk)}}},
+        }
+        if event_id is None:
+            del event['id']
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = hmac.new(
+            settings.STRIPE_WEBHOOK_SECRET.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256
+        ).hexdigest()
+        return self.client.post(
+            reverse('stripe_webhook'), payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+        )
+
+    def test_events_are_recorded_once_and_applied_by_the_worker(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.deliver('evt_paid').json(), {'status': 'received'})
+        self.deliver('evt_paid')
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.payment_status, 'pending')
+
+        self.assertEqual(webhooks.process(), {'processed': 1, 'failed': 0})
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.payment_status, 'paid')
+        self.assertEqual(WebhookEvent.objects.get().result, 'success')
+
+        # A redelivery after processing is neither recorded nor applied again
+        self.deliver('evt_paid')
+        self.assertEqual(webhooks.process(), {'processed': 0, 'failed': 0})
+
+    def test_events_without_an_id_are_rejected(self):
+        with self.assertLogs('app.views', 'ERROR'):
+            self.assertEqual(self.deliver(None).status_code, 400)
+            self.assertEqual(self.deliver('').status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_failed_events_are_retried_and_replayed(self):
+        self.deliver('evt_flaky')
+        now = timezone.now()
+        with patch.dict(webhooks.HANDLERS, {'checkout.session.completed': Mock(side_effect=RuntimeError('db down'))}):
+            self.assertEqual(webhooks.process(now=now), {'processed': 0, 'failed': 1})
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        self.assertEqual(webhooks.process(now=now), {'processed': 0, 'failed': 0})
+
+        WebhookEvent.objects.update(status='failed')
+        call_command('replay_webhook_events', '--process', stdout=StringIO())
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.result), ('processed', 'success'))
+
+
+class BookingStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        cls.guest = User.objects.create_user('guest', 'guest@example.com', 'password')
+        property = create_property(
+            host, title='Loft', property_type='apartment', location='Nantes', price_per_night=90, bedrooms=1,
+            max_guests=2,
+        )
+        check_in = timezone.now().date() + timedelta(days=8)
+        cls.booking = Booking.objects.create(
+            property_obj=property, guest=cls.guest, guests=2, total_price=195,
+            check_in=check_in, check_out=check_in + timedelta(days=2),
+        )
+        cls.url = reverse('booking_status_stream', args=[cls.booking.pk])
+
+    async def subscribed(self):
+        channel = broadcast.channel(self.booking.pk)
+        while not broadcast.get_broker()._subscribers.get(channel):
+            await asyncio.sleep(0.01)
+
+    def cancel(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.filter(pk=self.booking.pk).release(status='cancelled', payment_status='failed')
+
+    async def test_status_changes_are_pushed_to_the_stream(self):
+        await self.async_client.aforce_login(self.guest)
+        response = await self.async_client.get(self.url, headers={'accept': 'text/event-stream'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        self.assertTrue((await anext(events)).startswith(b'retry:'))
+        self.assertIn(b'"status": "pending"', await anext(events))
+
+        pushed = asyncio.ensure_future(anext(events))
+        await asyncio.wait_for(self.subscribed(), 5)
+        await sync_to_async(self.cancel)()
+        self.assertIn(b'"status": "cancelled"', await asyncio.wait_for(pushed, 5))
+        with self.assertRaises(StopAsyncIteration):
+            await anext(events)
+
+    async def test_long_poll_answers_when_the_status_changes(self):
+        await self.async_client.aforce_login(self.guest)
+        current = await self.async_client.get(self.url)
+        self.assertEqual(current.json()['status'], 'pending')
+
+        poll = asyncio.ensure_future(self.async_client.get(self.url, {'status': 'pending', 'payment_status': 'pending'}))
+        await asyncio.wait_for(self.subscribed(), 5)
+        await sync_to_async(self.cancel)()
+        response = await asyncio.wait_for(poll, 5)
+        self.assertEqual((response.json()['status'], response.json()['payment_status']), ('cancelled', 'failed'))
+
+    def test_wsgi_requests_are_answered_at_once(self):
+        self.client.force_login(self.guest)
+        self.assertEqual(self.client.get(self.url, headers={'accept': 'text/event-stream'}).status_code, 204)
+        started = time.monotonic()
+        response = self.client.get(self.url, {'status': 'pending', 'payment_status': 'pending'})
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(response.json()['status'], 'pending')
+        self.assertEqual(response['Retry-After'], str(views.SHORT_POLL_INTERVAL))
+        self.client.force_login(User.objects.get(username='host'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        patcher = self.settings(MEDIA_ROOT=media_root)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+        host = User.objects.create_user('host', 'host@example.com', 'password')
+        self.property = create_property(host, title='Riad', location='Fes', price_per_night=80)
+
+    def upload(self, width, height, name='photo.jpg'):
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), (200, 120, 40)).save(buffer, 'JPEG')
+        with self.captureOnCommitCallbacks(execute=True):
+            image = PropertyImage.objects.create(
+                property=self.property, image=SimpleUploadedFile(name, buffer.getvalue()), is_primary=True,
+            )
+        image.refresh_from_db()
+        return image
+
+    def test_uploads_get_derivatives_in_each_width_and_format(self):
+        image = self.upload(2400, 1600)
+        self.assertEqual(image.variants, {'source': image.image.name, 'widths': [480, 960, 1600]})
+        storage = image.image.storage
+        with storage.open(images.variant_name(image.image.name, 960, 'WEBP')) as f:
+            derivative = Image.open(f)
+            self.assertEqual((derivative.format, derivative.size), ('WEBP', (960, 640)))
+        self.assertTrue(storage.exists(images.variant_name(image.image.name, 480, 'JPEG')))
+
+        html = cards.render_cards(Property.objects.with_images(), 'cards/listing.html')[0][1]
+        self.assertIn('<source type="image/webp" srcset="', html)
+        self.assertIn(f'{storage.url(images.variant_name(image.image.name, 1600, "JPEG"))} 1600w', html)
+        self.assertIn(f'src="{image.image.url}"', html)
+
+    def test_derivatives_are_deleted_with_their_file(self):
+        image = self.upload(1200, 800)
+        storage, old_name = image.image.storage, image.image.name
+        old_derivative = images.variant_name(old_name, 960, 'WEBP')
+        self.assertTrue(storage.exists(old_derivative))
+
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), (40, 120, 200)).save(buffer, 'PNG')
+        image.image = SimpleUploadedFile('photo.png', buffer.getvalue())
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        self.assertFalse(storage.exists(old_derivative))
+        self.assertEqual(image.variants, {'source': image.image.name, 'widths': [480, 800]})
+        new_derivative = images.variant_name(image.image.name, 800, 'WEBP')
+        self.assertTrue(storage.exists(new_derivative))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(storage.exists(new_derivative))
+
+    def test_small_and_unreadable_images(self):
+        self.assertEqual(self.upload(600, 400).variants['widths'], [480, 600])
+
+        with self.assertLogs('app.images', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            broken = PropertyImage.objects.create(
+                property=self.property, image=SimpleUploadedFile('broken.jpg', b'not an image'),
+            )
+        broken.refresh_from_db()
+        self.assertEqual(broken.variants, {})
+        self.assertEqual(images.srcset(broken, 'WEBP'), '')
+
+        with patch.object(Image, 'MAX_IMAGE_PIXELS', 1000), self.assertLogs('app.images', 'WARNING'):
+            self.assertEqual(self.upload(100, 100).variants, {})
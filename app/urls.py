@@ -10,6 +10,7 @@ urlpatterns = [
     path('properties/', views.properties, name='properties'),
     path('property/<int:pk>/', views.property_detail, name='property_detail'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/tabs/<str:tab>/', views.dashboard_tab, name='dashboard_tab'),
     path('login/', views.login_view, name='login'),
     path('logout/', auth_views.LogoutView.as_view(next_page='home'), name='logout'),
     path('register/', views.register, name='register'),
@@ -21,8 +22,11 @@ urlpatterns = [
     path('api/booking/<int:booking_id>/stripe-session/', views.get_stripe_session_url, name='get_stripe_session_url'),
     path('webhooks/stripe/', views.stripe_webhook, name='stripe_webhook'),
     path('api/property/<int:property_id>/availability/', views.check_availability_api, name='check_availability_api'),
+    path('api/availability/batch/', views.batch_availability_api, name='batch_availability_api'),
+    path('api/properties/map/', views.properties_map_api, name='properties_map_api'),
     path('api/property/<int:property_id>/unavailable-dates/', views.get_unavailable_dates_api, name='get_unavailable_dates_api'),
     path('api/booking/<int:booking_id>/status/', views.get_booking_status_api, name='get_booking_status_api'),
+    path('api/booking/<int:booking_id>/stream/', views.booking_status_stream, name='booking_status_stream'),
     path('property/create/', views.create_listing, name='create_listing'),
     path('property/<int:pk>/edit/', views.edit_listing, name='edit_listing'),
     path('property/<int:pk>/delete/', views.delete_listing, name='delete_listing'),
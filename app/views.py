@@ -1,12 +1,13 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth import login, authenticate, logout
+from django.contrib.auth.views import redirect_to_login
 from django.contrib import messages
 from django.utils import timezone
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.utils.translation import activate, gettext as _
 from django.conf import settings
-from .models import Property, PropertyImage, Booking, Review, UserProfile, HostApplication, Post, Wishlist, Comment, PropertyComment
+from .models import Property, PropertyImage, Amenity, Booking, Review, UserProfile, HostApplication, Post, Wishlist, Comment, PropertyComment
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.core.validators import validate_email
@@ -14,19 +15,29 @@ from django.core.exceptions import ValidationError
 from .forms import ProfileForm, PropertyCreationForm
 from .forms import RegistrationForm
 from .forms import HostApplicationForm
-from django.core.paginator import Paginator
-from django.db.models import Q
+from . import availability, broadcast, facets, geo, listing_cache, outbox, payments, search, webhooks
+from .pagination import CursorPage, CursorPaginator
+from django.db.models import Q, Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.template.loader import render_to_string
 import stripe
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.urls import reverse
 from django.views.decorators.http import require_POST
+import asyncio
 import json
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.admin.views.decorators import staff_member_required
-from django.core.mail import send_mail
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
+# Rows per page on the admin management lists
+ADMIN_PAGE_SIZE = 50
+# Items per page on each dashboard tab
+DASHBOARD_PAGE_SIZE = 12
+
 def check_user_active(view_func):
     """Decorator to check if user is still active"""
     def wrapper(request, *args, **kwargs):
@@ -37,84 +48,144 @@ def check_user_active(view_func):
     return wrapper
 
 def home(request):
-    featured_properties = Property.objects.all()[:6]
+    featured_properties = Property.objects.with_images()[:6]
     return render(request, 'home.html', {'featured_properties': featured_properties})
 
-def properties(request):
-    properties = Property.objects.prefetch_related('images', 'amenities').all()
-    property_types = Property._meta.get_field('property_type').choices
-
-    # Get user's wishlist if authenticated
-    user_wishlist = []
-    if request.user.is_authenticated:
-        user_wishlist = list(request.user.wishlist_items.values_list('property_id', flat=True))
-
-    # Filtering
-    location = request.GET.get('location')
+def filter_properties(properties, params, amenity_choices=None, with_facets=True):
+    """
+    Apply the listing filters in ``params`` (the listing page's GET parameters).
+    Pass the already loaded amenities as ``amenity_choices`` to skip looking them
+    up, and with_facets=False to leave out the facet group selections.
+    """
+    # The search box matches title, description, location and highlights
+    location = params.get('location')
     if location:
-        properties = properties.filter(location__icontains=location)
-
-    min_price = request.GET.get('min_price')
-    if min_price:
-        properties = properties.filter(price_per_night__gte=min_price)
-    max_price = request.GET.get('max_price')
-    if max_price:
-        properties = properties.filter(price_per_night__lte=max_price)
-
-    type_filters = request.GET.getlist('type')
-    if type_filters:
-        properties = properties.filter(property_type__in=type_filters)
-
-    space_types = request.GET.getlist('space_type')
-    if space_types:
-        properties = properties.filter(space_type__in=space_types)
-
-    amenities = request.GET.getlist('amenities')
-    if amenities:
-        for amenity in amenities:
-            properties = properties.filter(amenities__name__iexact=amenity)
-
-    bedrooms = request.GET.get('bedrooms')
-    if bedrooms:
-        if bedrooms == '4':
-            properties = properties.filter(bedrooms__gte=4)
+        properties = search.search(properties, location)
+
+    # Price, property type, space type and bedrooms
+    if with_facets:
+        properties = facets.narrow(properties, params)
+
+    # Amenities are selected by slug, or by name in links made before slugs;
+    # having all of them is one bitmask test
+    amenity_values = set(params.getlist('amenities'))
+    if amenity_values:
+        if amenity_choices is None:
+            selected = list(Amenity.objects.filter(Q(slug__in=amenity_values) | Q(name__in=amenity_values)))
+        else:
+            selected = [
+                amenity for amenity in amenity_choices
+                if amenity.slug in amenity_values or amenity.name in amenity_values
+            ]
+        if amenity_values - {amenity.slug for amenity in selected} - {amenity.name for amenity in selected}:
+            # No property has an amenity that does not exist
+            properties = properties.none()
         else:
-            properties = properties.filter(bedrooms=bedrooms)
+            properties = properties.with_amenities(selected)
 
-    if request.GET.get('superhost'):
+    if params.get('superhost'):
         properties = properties.filter(host__userprofile__role='host', host__userprofile__is_superhost=True)
 
-    guests = request.GET.get('guests')
+    guests = params.get('guests')
     if guests:
         properties = properties.filter(max_guests__gte=guests)
 
+    # Only keep properties that are free for the whole requested stay
+    check_in = params.get('check_in')
+    check_out = params.get('check_out')
+    if check_in and check_out:
+        try:
+            check_in_date = timezone.datetime.strptime(check_in, '%Y-%m-%d').date()
+            check_out_date = timezone.datetime.strptime(check_out, '%Y-%m-%d').date()
+        except ValueError:
+            check_in_date = check_out_date = None
+        if check_in_date and check_out_date and check_in_date < check_out_date:
+            properties = properties.available_between(check_in_date, check_out_date)
+
+    # Map viewport as "south,west,north,east", and/or a radius in km around lat/lng
+    bbox = params.get('bbox')
+    if bbox:
+        try:
+            properties = geo.within_bbox(properties, geo.BoundingBox.parse(bbox))
+        except ValueError:
+            pass
+    lat, lng, radius = params.get('lat'), params.get('lng'), params.get('radius')
+    if lat and lng and radius:
+        try:
+            properties = geo.within_radius(properties, *geo.parse_point(lat, lng, radius))
+        except ValueError:
+            pass
+
+    return properties
+
+def listing_page(params, amenity_choices):
+    """The page of listings and the facet counts for the listing page's ``params``."""
+    properties = filter_properties(Property.objects.with_images(), params, amenity_choices, with_facets=False)
+    facet_counts = facets.facet_counts(properties, params, amenity_choices)
+    properties = facets.narrow(properties, params)
+
     # Sorting
-    sort = request.GET.get('sort')
+    sort = params.get('sort')
     if sort == 'price_asc':
         properties = properties.order_by('price_per_night')
     elif sort == 'price_desc':
         properties = properties.order_by('-price_per_night')
     elif sort == 'rating':
-        # Property does not have average_rating, fallback to default ordering
-        pass
+        properties = properties.order_by('-rating_avg', '-rating_count', '-id')
     elif sort == 'newest':
         properties = properties.order_by('-id')
+    elif sort == 'distance' and 'distance_km' in properties.query.annotations:
+        properties = properties.order_by('distance_km', '-id')
+    elif 'search_rank' in properties.query.annotations:
+        properties = properties.order_by('search_rank', '-id')
+    elif 'distance_km' in properties.query.annotations:
+        properties = properties.order_by('distance_km', '-id')
+
+    # Keyset pagination on the active sort; the facet snapshot already knows the total
+    paginator = CursorPaginator(properties, 12, count=facet_counts['total'])
+    return paginator.get_page(params.get('cursor')), facet_counts
+
+def properties(request):
+    amenity_choices = list(Amenity.objects.order_by('name'))
+
+    # Get user's wishlist if authenticated
+    user_wishlist = []
+    if request.user.is_authenticated:
+        user_wishlist = list(request.user.wishlist_items.values_list('property_id', flat=True))
+
+    # Repeated filter combinations are served from the ids cached per page
+    cache_key = listing_cache.make_key(request.GET)
+    cached = listing_cache.get(cache_key)
+    if cached is None:
+        page_obj, facet_counts = listing_page(request.GET, amenity_choices)
+        listing_cache.store(cache_key, page_obj, facet_counts)
+    else:
+        found = Property.objects.with_images().in_bulk(cached['ids'])
+        page_obj = CursorPage(
+            [found[pk] for pk in cached['ids'] if pk in found],
+            None,
+            next_cursor=cached['next_cursor'],
+            previous_cursor=cached['previous_cursor'],
+        )
+        facet_counts = listing_cache.facets_of(cached, request.GET, amenity_choices)
 
-    # Pagination
-    paginator = Paginator(properties, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Card chips are decoded from the bitmask instead of loading the links
+    for property in page_obj:
+        property.card_amenities = [amenity for amenity in amenity_choices if property.amenity_mask & amenity.mask]
 
-    return render(request, 'properties.html', {
+    response = render(request, 'properties.html', {
         'properties': page_obj,
-        'property_types': property_types,
+        'amenity_choices': amenity_choices,
+        'facets': facet_counts,
         'user_wishlist': user_wishlist,
         'request': request,
     })
+    response['X-Listing-Cache'] = 'hit' if cached is not None else 'miss'
+    return response
 
 def property_detail(request, pk):
     property = get_object_or_404(
-        Property.objects.prefetch_related('images', 'amenities', 'reviews', 'host__userprofile'),
+        Property.objects.with_images().select_related('host__userprofile').prefetch_related('amenities', 'reviews__user__userprofile'),
         pk=pk
     )
     
@@ -134,46 +205,74 @@ def property_detail(request, pk):
         'today': timezone.now().date(),
     })
 
+def count_of(queryset, field):
+    """
+    Correlated count of ``queryset`` rows whose ``field`` is the outer row. Unlike
+    annotate(Count(...)) it needs no GROUP BY over the outer query, so a sorted
+    and limited outer query can still walk its index.
+    """
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(n=Count('*')).values('n'),
+        output_field=IntegerField(),
+    ), 0)
+
 @login_required
 @check_user_active
 def dashboard(request):
-    user_bookings = request.user.bookings.all()
-    user_properties = request.user.properties.all()
-    user_reviews = request.user.reviews.all()
-    wishlist_properties = Property.objects.filter(wishlisted_by__user=request.user)
-    
+    # Tab contents are fetched from dashboard_tab when first shown, so the page
+    # itself only needs the headline counts, taken in one query
+    stats = User.objects.filter(pk=request.user.pk).annotate(
+        booking_count=count_of(Booking.objects.all(), 'guest'),
+        review_count=count_of(Review.objects.all(), 'user'),
+        property_count=count_of(Property.objects.all(), 'host'),
+    ).values('booking_count', 'review_count', 'property_count').get()
+
     # Get host application if exists
     host_application = None
     if request.user.userprofile.role == 'pending_host':
         host_application = request.user.host_applications.last()
-    
-    # Get properties for host/admin
-    managed_properties = []
-    if request.user.userprofile.role in ['host', 'admin']:
-        managed_properties = Property.objects.filter(host=request.user)
-    
-    # Get pending host applications for admin
-    pending_applications = []
-    if request.user.userprofile.role == 'admin':
-        pending_applications = HostApplication.objects.filter(status='pending')
-    
-    # Get all bookings for admin
-    all_bookings = []
-    if request.user.userprofile.role == 'admin':
-        all_bookings = Booking.objects.all().order_by('-created_at')
-    
+
     return render(request, 'dashboard.html', {
-        'bookings': user_bookings,
-        'properties': user_properties,
-        'reviews': user_reviews,
-        'wishlist_properties': wishlist_properties,
+        'stats': stats,
         'host_application': host_application,
-        'managed_properties': managed_properties,
-        'pending_applications': pending_applications,
-        'all_bookings': all_bookings,
         'user_role': request.user.userprofile.role,
     })
 
+@login_required
+@check_user_active
+def dashboard_tab(request, tab):
+    """One page of a dashboard tab as rendered HTML, with the cursors of its neighbours."""
+    role = request.user.userprofile.role
+    if tab == 'bookings':
+        name, items = 'bookings', request.user.bookings.select_related('property_obj').order_by('-created_at')
+    elif tab == 'wishlist':
+        name, items = 'wishlist_properties', Property.objects.with_images().filter(wishlisted_by__user=request.user)
+    elif tab == 'reviews':
+        name, items = 'reviews', request.user.reviews.select_related('property').order_by('-created_at')
+    elif tab == 'properties' and role in ['host', 'admin']:
+        name, items = 'managed_properties', Property.objects.with_images().filter(host=request.user)
+    elif tab == 'applications' and role == 'admin':
+        name, items = 'pending_applications', HostApplication.objects.filter(status='pending').select_related(
+            'user__userprofile'
+        ).order_by('created_at')
+    elif tab == 'all_bookings' and role == 'admin':
+        name, items = 'all_bookings', Booking.objects.select_related('property_obj', 'guest').annotate(
+            comment_count=count_of(Comment.objects.all(), 'booking')
+        ).order_by('-created_at')
+    elif tab in ('properties', 'applications', 'all_bookings'):
+        return JsonResponse({'success': False, 'error': 'Forbidden'}, status=403)
+    else:
+        return JsonResponse({'success': False, 'error': 'Unknown tab'}, status=404)
+
+    page = CursorPaginator(items, DASHBOARD_PAGE_SIZE).get_page(request.GET.get('cursor'))
+    html = render_to_string(f'dashboard/tabs/{tab}.html', {name: page, 'page': page}, request=request)
+    return JsonResponse({
+        'success': True,
+        'html': html,
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+    })
+
 def register(request):
     if request.method == 'POST':
         form = RegistrationForm(request.POST, request.FILES)
@@ -208,66 +307,42 @@ def create_booking(request, pk):
             messages.error(request, 'Check-out must be after check-in.')
             return redirect('property_detail', pk=pk)
         
-        # Check availability with database transaction
-        with transaction.atomic():
-            # Double-check availability before creating booking
-            if not Booking.check_availability(property, check_in_date, check_out_date):
-                messages.error(request, 'Selected dates are no longer available. Please choose different dates.')
-                return redirect('property_detail', pk=pk)
-            
-            # Calculate total price
-            nights = (check_out_date - check_in_date).days
-            total_price = (property.price_per_night * nights) + property.cleaning_fee + property.service_fee
-            
-            # Create a temporary booking to hold the slot
-            temp_booking = Booking.objects.create(
-                property_obj=property,
-                guest=request.user,
-                check_in=check_in_date,
-                check_out=check_out_date,
-                guests=guests,
-                total_price=total_price,
-                status='pending',
-                payment_status='pending'
-            )
-            
-            # Create Stripe Checkout session
-            try:
-                session = stripe.checkout.Session.create(
-                    payment_method_types=['card'],
-                    line_items=[{
-                        'price_data': {
-                            'currency': 'usd',
-                            'product_data': {
-                                'name': f'Booking for {property.title}',
-                                'description': f'{nights} nights from {check_in} to {check_out}',
-                            },
-                            'unit_amount': int(total_price * 100),
-                        },
-                        'quantity': 1,
-                    }],
-                    mode='payment',
-                    success_url=request.build_absolute_uri(f'/booking/success/?booking_id={temp_booking.id}'),
-                    cancel_url=request.build_absolute_uri(f'/booking/cancel/?booking_id={temp_booking.id}'),
-                    customer_email=request.user.email,
-                    metadata={
-                        'booking_id': str(temp_booking.id),
-                        'property_id': str(property.id),
-                    }
+        # Calculate total price
+        nights = (check_out_date - check_in_date).days
+        total_price = (property.price_per_night * nights) + property.cleaning_fee + property.service_fee
+
+        # Phase one: claim the nights in a short transaction. Saving claims
+        # them, so a night already taken raises IntegrityError here.
+        try:
+            with transaction.atomic():
+                temp_booking = Booking.objects.create(
+                    property_obj=property,
+                    guest=request.user,
+                    check_in=check_in_date,
+                    check_out=check_out_date,
+                    guests=guests,
+                    total_price=total_price,
+                    status='pending',
+                    payment_status='pending'
                 )
-                
-                # Update booking with session ID
-                temp_booking.stripe_session_id = session.id
-                temp_booking.save()
-                
-                # Redirect to payment processing page instead of directly to Stripe
-                return redirect('payment_processing', booking_id=temp_booking.id)
-                
-            except stripe.error.StripeError as e:
-                # If Stripe fails, delete the temporary booking
-                temp_booking.delete()
-                messages.error(request, f'Payment processing error: {str(e)}')
-                return redirect('property_detail', pk=pk)
+        except IntegrityError:
+            messages.error(request, 'Selected dates are no longer available. Please choose different dates.')
+            return redirect('property_detail', pk=pk)
+
+        # Phase two: create the Stripe Checkout session outside any transaction,
+        # so no database lock is held during the round trip
+        try:
+            session = payments.attach_checkout_session(temp_booking, request)
+        except stripe.error.StripeError as e:
+            # The booking was deleted, releasing the hold
+            messages.error(request, f'Payment processing error: {str(e)}')
+            return redirect('property_detail', pk=pk)
+        if session is None:
+            messages.warning(request, 'Your reservation has expired. Please try booking again.')
+            return redirect('property_detail', pk=pk)
+
+        # Redirect to payment processing page instead of directly to Stripe
+        return redirect('payment_processing', booking_id=temp_booking.id)
     
     return redirect('property_detail', pk=pk)
 
@@ -339,26 +414,35 @@ def payment_processing(request, booking_id):
             messages.warning(request, 'Your reservation has expired. Please try booking again.')
             return redirect('dashboard')
         
-        return render(request, 'payment_processing.html', {'booking': booking})
+        # Lets the page go straight to Stripe without asking for the URL first
+        session_url = ''
+        if booking.stripe_session_url and booking.stripe_session_status == 'open':
+            session_url = booking.stripe_session_url
+        
+        return render(request, 'payment_processing.html', {'booking': booking, 'session_url': session_url})
         
     except Booking.DoesNotExist:
         messages.error(request, 'Booking not found.')
         return redirect('dashboard')
 
-@login_required
-def get_stripe_session_url(request, booking_id):
+async def get_stripe_session_url(request, booking_id):
     """Get Stripe session URL for a booking"""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
     try:
-        booking = get_object_or_404(Booking, id=booking_id, guest=request.user)
+        booking = await aget_object_or_404(Booking, id=booking_id, guest_id=user.id)
         
         if not booking.stripe_session_id:
             return JsonResponse({'error': 'No payment session found'}, status=404)
         
-        # Retrieve the session from Stripe
-        session = stripe.checkout.Session.retrieve(booking.stripe_session_id)
+        # Stored with the session; Stripe is only asked (through the cache) for older bookings
+        session = await payments.asession_state(booking)
+        if session is None:
+            return JsonResponse({'error': 'Payment session is being refreshed, please retry'}, status=503)
         
-        if session.status == 'open':
-            return JsonResponse({'url': session.url})
+        if session['status'] == 'open':
+            return JsonResponse({'url': session['url']})
         else:
             return JsonResponse({'error': 'Payment session is no longer valid'}, status=400)
             
@@ -367,11 +451,11 @@ def get_stripe_session_url(request, booking_id):
     except stripe.error.StripeError as e:
         return JsonResponse({'error': str(e)}, status=500)
 
-def check_availability_api(request, property_id):
+async def check_availability_api(request, property_id):
     """API endpoint to check availability for a property"""
     if request.method == 'GET':
         try:
-            property = get_object_or_404(Property, id=property_id)
+            property = await aget_object_or_404(Property.objects.only('id'), id=property_id)
             check_in = request.GET.get('check_in')
             check_out = request.GET.get('check_out')
             
@@ -381,8 +465,8 @@ def check_availability_api(request, property_id):
                     'error': 'Both check_in and check_out dates are required'
                 })
             
-            # Check availability
-            is_available = Booking.check_availability(property, check_in, check_out)
+            # Check availability against the cached interval index
+            is_available = await availability.ais_available(property.id, check_in, check_out)
             
             return JsonResponse({
                 'success': True,
@@ -400,11 +484,109 @@ def check_availability_api(request, property_id):
     
     return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
 
-def get_unavailable_dates_api(request, property_id):
+# Upper bound on the number of date ranges answered by one batch request
+MAX_BATCH_AVAILABILITY_QUERIES = 500
+
+@csrf_exempt
+def batch_availability_api(request):
+    """
+    API endpoint to check many (property_id, check_in, check_out) ranges at once.
+    Expects a JSON body: {"queries": [[property_id, "YYYY-MM-DD", "YYYY-MM-DD"], ...]}
+    Items may also be objects with property_id, check_in and check_out keys.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
+
+    try:
+        items = json.loads(request.body).get('queries')
+    except (ValueError, AttributeError):
+        return JsonResponse({'success': False, 'error': 'Invalid JSON body'}, status=400)
+
+    if not isinstance(items, list) or not items:
+        return JsonResponse({'success': False, 'error': 'A non-empty list of queries is required'}, status=400)
+    if len(items) > MAX_BATCH_AVAILABILITY_QUERIES:
+        return JsonResponse({
+            'success': False,
+            'error': f'At most {MAX_BATCH_AVAILABILITY_QUERIES} queries are allowed per request'
+        }, status=400)
+
+    # Parse every item first so the valid ones can be answered together
+    results = []
+    parsed = []
+    for item in items:
+        try:
+            if isinstance(item, dict):
+                property_id, check_in, check_out = item['property_id'], item['check_in'], item['check_out']
+            else:
+                property_id, check_in, check_out = item
+            result = {'property_id': int(property_id), 'check_in': check_in, 'check_out': check_out}
+            check_in_date = timezone.datetime.strptime(check_in, '%Y-%m-%d').date()
+            check_out_date = timezone.datetime.strptime(check_out, '%Y-%m-%d').date()
+            if check_in_date >= check_out_date:
+                raise ValueError('Check-out must be after check-in')
+        except (KeyError, TypeError, ValueError) as e:
+            results.append({'error': f'Invalid query: {e}'})
+            continue
+        results.append(result)
+        parsed.append((result, (result['property_id'], check_in_date, check_out_date)))
+
+    existing_ids = set(Property.objects.filter(
+        id__in={query[0] for _, query in parsed}
+    ).values_list('id', flat=True))
+    for result, query in parsed:
+        if query[0] not in existing_ids:
+            result['error'] = 'Property not found'
+    parsed = [(result, query) for result, query in parsed if query[0] in existing_ids]
+
+    answers = availability.batch_is_available([query for _, query in parsed])
+    for (result, _), is_available in zip(parsed, answers):
+        result['available'] = is_available
+
+    return JsonResponse({'success': True, 'results': results})
+
+# Upper bound on the number of markers returned for one map viewport
+MAX_MAP_RESULTS = 500
+
+def properties_map_api(request):
+    """
+    API endpoint returning map markers for the properties inside a viewport.
+    Requires bbox=south,west,north,east and accepts every listing filter.
+    The best rated MAX_MAP_RESULTS properties are returned.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
+
+    try:
+        geo.BoundingBox.parse(request.GET.get('bbox'))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    properties = filter_properties(Property.objects.all(), request.GET).order_by(
+        '-rating_avg', '-rating_count', '-id'
+    ).values(
+        'id', 'title', 'latitude', 'longitude', 'price_per_night', 'rating_avg', 'rating_count'
+    )
+    rows = list(properties[:MAX_MAP_RESULTS + 1])
+
+    return JsonResponse({
+        'success': True,
+        'truncated': len(rows) > MAX_MAP_RESULTS,
+        'results': [{
+            'id': row['id'],
+            'title': row['title'],
+            'latitude': float(row['latitude']),
+            'longitude': float(row['longitude']),
+            'price_per_night': float(row['price_per_night']),
+            'rating': round(row['rating_avg'], 2) if row['rating_count'] else None,
+            'url': reverse('property_detail', kwargs={'pk': row['id']}),
+        } for row in rows[:MAX_MAP_RESULTS]],
+    })
+
+async def get_unavailable_dates_api(request, property_id):
     """API endpoint to get unavailable dates for a property"""
     if request.method == 'GET':
         try:
-            property = get_object_or_404(Property, id=property_id)
+            property = await aget_object_or_404(Property.objects.only('id'), id=property_id)
             start_date = request.GET.get('start_date')
             end_date = request.GET.get('end_date')
             
@@ -414,7 +596,7 @@ def get_unavailable_dates_api(request, property_id):
             if end_date:
                 end_date = timezone.datetime.strptime(end_date, '%Y-%m-%d').date()
             
-            unavailable_dates = Booking.get_unavailable_dates(property, start_date, end_date)
+            unavailable_dates = await availability.aunavailable_dates(property.id, start_date, end_date)
             
             # Convert dates to strings for JSON serialization
             unavailable_dates_str = [date.strftime('%Y-%m-%d') for date in unavailable_dates]
@@ -433,32 +615,21 @@ def get_unavailable_dates_api(request, property_id):
     
     return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
 
-def get_booking_status_api(request, booking_id):
+async def get_booking_status_api(request, booking_id):
     """API endpoint to get booking status and time remaining"""
     if request.method == 'GET':
         try:
-            booking = get_object_or_404(Booking, id=booking_id)
+            booking = await aget_object_or_404(Booking, id=booking_id)
+            user = await request.auser()
             
             # Check if user has permission to view this booking
-            if not request.user.is_authenticated or booking.guest != request.user:
+            if not user.is_authenticated or booking.guest_id != user.id:
                 return JsonResponse({
                     'success': False,
                     'error': 'Permission denied'
                 }, status=403)
             
-            time_remaining = booking.time_remaining_seconds
-            is_expired = booking.is_expired
-            
-            return JsonResponse({
-                'success': True,
-                'booking_id': booking_id,
-                'status': booking.status,
-                'payment_status': booking.payment_status,
-                'time_remaining_seconds': time_remaining,
-                'is_expired': is_expired,
-                'reservation_expires_at': booking.reservation_expires_at.isoformat(),
-                'created_at': booking.created_at.isoformat()
-            })
+            return JsonResponse(booking_status_data(booking))
             
         except Booking.DoesNotExist:
             return JsonResponse({
@@ -473,6 +644,79 @@ def get_booking_status_api(request, booking_id):
     
     return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
 
+def booking_status_data(booking):
+    return {
+        'success': True,
+        'booking_id': booking.id,
+        'status': booking.status,
+        'payment_status': booking.payment_status,
+        'time_remaining_seconds': booking.time_remaining_seconds,
+        'is_expired': booking.is_expired,
+        'reservation_expires_at': booking.reservation_expires_at.isoformat(),
+        'created_at': booking.created_at.isoformat()
+    }
+
+# Seconds a status stream stays open before the browser reconnects (after
+# STREAM_RETRY_MS), how long a long poll waits for a change, and how long
+# clients wait between polls when the server cannot hold them (WSGI)
+STREAM_DURATION = 300
+STREAM_RETRY_MS = 3000
+LONG_POLL_TIMEOUT = 25
+SHORT_POLL_INTERVAL = 5
+
+async def booking_status_stream(request, booking_id):
+    """
+    Push a booking's status to the payment page as it changes. Clients that
+    accept text/event-stream get Server-Sent Events (under ASGI only: a WSGI
+    worker would be tied up, so they get 204 and fall back). Other requests
+    long-poll: pass the status and payment_status already known and the
+    response comes as soon as they change, or after LONG_POLL_TIMEOUT. Under
+    WSGI they are answered at once with a Retry-After of SHORT_POLL_INTERVAL.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'success': False, 'error': 'Permission denied'}, status=403)
+    booking = await Booking.objects.filter(id=booking_id, guest_id=user.id).afirst()
+    if booking is None:
+        return JsonResponse({'success': False, 'error': 'Booking not found'}, status=404)
+
+    loop = asyncio.get_running_loop()
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        if not isinstance(request, ASGIRequest):
+            return HttpResponse(status=204)
+        response = StreamingHttpResponse(
+            booking_status_events(booking, loop.time() + STREAM_DURATION),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    if not isinstance(request, ASGIRequest):
+        response = JsonResponse(booking_status_data(booking))
+        response['Retry-After'] = SHORT_POLL_INTERVAL
+        return response
+    known = (request.GET.get('status'), request.GET.get('payment_status'))
+    if known == (booking.status, booking.payment_status) and not broadcast.is_final(booking):
+        async for changed in broadcast.watch(booking, loop.time() + LONG_POLL_TIMEOUT):
+            if changed is not None:
+                break
+    return JsonResponse(booking_status_data(booking))
+
+async def booking_status_events(booking, until):
+    # Clients reconnect after ``retry`` ms when the stream ends
+    yield f'retry: {STREAM_RETRY_MS}\n'
+    yield f'event: status\ndata: {json.dumps(booking_status_data(booking))}\n\n'
+    if broadcast.is_final(booking):
+        return
+    async for changed in broadcast.watch(booking, until):
+        if changed is None:
+            yield ': keepalive\n\n'
+            continue
+        yield f'event: status\ndata: {json.dumps(booking_status_data(changed))}\n\n'
+        if broadcast.is_final(changed):
+            return
+
 @login_required
 def cancel_booking(request, pk):
     booking = get_object_or_404(Booking, pk=pk, guest=request.user)
@@ -529,7 +773,7 @@ def delete_listing(request, pk):
 @login_required
 def property_bookings(request, pk):
     property = get_object_or_404(Property, pk=pk, host=request.user)
-    bookings = property.bookings.all()
+    bookings = property.bookings.select_related('guest').order_by('check_in')
     return render(request, 'property_bookings.html', {'property': property, 'bookings': bookings})
 
 @login_required
@@ -636,25 +880,23 @@ def become_host(request):
                 profile.role = 'pending_host'
                 profile.save()
                 
-                # Send email notification to admin(s)
+                # Queue email notification to admin(s)
                 admin_emails = [email for name, email in getattr(settings, 'ADMINS', [])]
                 if not admin_emails:
                     admin_emails = [getattr(settings, 'DEFAULT_FROM_EMAIL', 'admin@example.com')]
-                send_mail(
+                outbox.queue_mail(
                     subject='New Host Application Submitted',
                     message=f'User {request.user.username} has submitted a new host application.\n\nBusiness Name: {business_name}\nBusiness Address: {business_address}\nBusiness Phone: {business_phone}\nDescription: {description}',
                     from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
                     recipient_list=admin_emails,
-                    fail_silently=True,
                 )
                 
-                # Send email notification to user (approved)
-                send_mail(
+                # Queue email notification to user (approved)
+                outbox.queue_mail(
                     subject='Your Host Application Has Been Approved',
                     message=f'Congratulations {request.user.get_full_name() or request.user.username},\n\nYour host application has been approved! You can now list properties and start hosting on StayBooking.\n\nThank you for joining us!',
                     from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
                     recipient_list=[request.user.email],
-                    fail_silently=True,
                 )
                 
                 messages.success(request, 'Your host application has been submitted successfully! We will review it and get back to you soon.')
@@ -705,7 +947,8 @@ def create_post(request):
 @login_required
 @user_passes_test(is_admin)
 def manage_posts(request):
-    posts = Post.objects.all().order_by('-created_at')
+    posts = Post.objects.select_related('property', 'host').order_by('-created_at')
+    posts = CursorPaginator(posts, ADMIN_PAGE_SIZE).get_page(request.GET.get('cursor'))
     return render(request, 'posts/manage_posts.html', {'posts': posts})
 
 @login_required
@@ -739,6 +982,7 @@ def manage_users(request):
             Q(email__icontains=query) |
             Q(userprofile__phone_number__icontains=query)
         )
+    users = CursorPaginator(users, ADMIN_PAGE_SIZE).get_page(request.GET.get('cursor'))
     return render(request, 'users/manage_users.html', {'users': users})
 
 @login_required
@@ -937,7 +1181,8 @@ def change_language(request, language_code):
 @csrf_exempt
 def stripe_webhook(request):
     """
-    Handle Stripe webhook events for payment confirmation and failure
+    Receive Stripe webhook events for payment confirmation and failure: verify
+    the signature and record the event in the WebhookEvent ledger
     """
     import logging
     logger = logging.getLogger(__name__)
@@ -956,7 +1201,7 @@ def stripe_webhook(request):
     
     # Verify webhook signature
     try:
-        event = stripe.Webhook.construct_event(
+        stripe.Webhook.construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
     except ValueError as e:
@@ -966,143 +1211,14 @@ def stripe_webhook(request):
         logger.error(f"Invalid signature: {e}")
         return JsonResponse({'error': 'Invalid signature'}, status=400)
     
-    # Handle the event
-    try:
-        event_type = event['type']
-        logger.info(f"Processing webhook event: {event_type}")
-        
-        if event_type == 'checkout.session.completed':
-            return handle_checkout_session_completed(event)
-        elif event_type == 'payment_intent.succeeded':
-            return handle_payment_intent_succeeded(event)
-        elif event_type == 'payment_intent.payment_failed':
-            return handle_payment_intent_failed(event)
-        else:
-            logger.info(f"Unhandled event type: {event_type}")
-            return JsonResponse({'status': 'ignored'})
-            
-    except Exception as e:
-        logger.error(f"Error processing webhook event {event.get('type', 'unknown')}: {str(e)}")
-        return JsonResponse({'error': 'Internal server error'}, status=500)
-
-def handle_checkout_session_completed(event):
-    """
-    Handle successful checkout session completion
-    """
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    session = event['data']['object']
-    booking_id = session.get('metadata', {}).get('booking_id')
-    
-    if not booking_id:
-        logger.error("Checkout session completed without booking_id in metadata")
-        return JsonResponse({'error': 'No booking_id in metadata'}, status=400)
-    
+    # Processing happens in the process_webhook_events worker; redeliveries
+    # of an event already in the ledger are ignored
     try:
-        with transaction.atomic():
-            booking = get_object_or_404(Booking, id=booking_id)
-            
-            # Verify the booking is still available
-            if not Booking.check_availability(booking.property_obj, booking.check_in, booking.check_out, exclude_booking=booking):
-                # Cancel the booking if no longer available
-                booking.status = 'cancelled'
-                booking.payment_status = 'failed'
-                booking.save()
-                logger.warning(f"Booking {booking_id} cancelled due to availability conflict")
-                return JsonResponse({'status': 'booking_cancelled'})
-            
-            # Update booking status
-            booking.status = 'pending'  # Admin must confirm
-            booking.payment_status = 'paid'
-            booking.save()
-            
-            logger.info(f"Booking {booking_id} confirmed successfully via webhook")
-            return JsonResponse({'status': 'success'})
-            
-    except Booking.DoesNotExist:
-        logger.error(f"Booking {booking_id} not found")
-        return JsonResponse({'error': 'Booking not found'}, status=404)
-    except Exception as e:
-        logger.error(f"Error processing checkout session for booking {booking_id}: {str(e)}")
-        return JsonResponse({'error': 'Internal server error'}, status=500)
-
-def handle_payment_intent_succeeded(event):
-    """
-    Handle successful payment intent
-    """
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    payment_intent = event['data']['object']
-    session_id = payment_intent.get('metadata', {}).get('session_id')
-    
-    if not session_id:
-        logger.info("Payment intent succeeded without session_id, ignoring")
-        return JsonResponse({'status': 'ignored'})
-    
-    try:
-        booking = Booking.objects.get(stripe_session_id=session_id)
-        
-        # Only update if booking is still pending
-        if booking.status == 'pending' and booking.payment_status == 'pending':
-            with transaction.atomic():
-                # Verify availability again
-                if not Booking.check_availability(booking.property_obj, booking.check_in, booking.check_out, exclude_booking=booking):
-                    booking.status = 'cancelled'
-                    booking.payment_status = 'failed'
-                    booking.save()
-                    logger.warning(f"Booking {booking.id} cancelled due to availability conflict")
-                    return JsonResponse({'status': 'booking_cancelled'})
-                
-                booking.status = 'pending'  # Admin must confirm
-                booking.payment_status = 'paid'
-                booking.save()
-                
-                logger.info(f"Booking {booking.id} confirmed via payment intent webhook")
-                return JsonResponse({'status': 'success'})
-        else:
-            logger.info(f"Booking {booking.id} already processed, ignoring")
-            return JsonResponse({'status': 'already_processed'})
-            
-    except Booking.DoesNotExist:
-        logger.error(f"Booking with session_id {session_id} not found")
-        return JsonResponse({'error': 'Booking not found'}, status=404)
-    except Exception as e:
-        logger.error(f"Error processing payment intent for session {session_id}: {str(e)}")
-        return JsonResponse({'error': 'Internal server error'}, status=500)
-
-def handle_payment_intent_failed(event):
-    """
-    Handle failed payment intent
-    """
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    payment_intent = event['data']['object']
-    session_id = payment_intent.get('metadata', {}).get('session_id')
-    
-    if not session_id:
-        logger.info("Payment intent failed without session_id, ignoring")
-        return JsonResponse({'status': 'ignored'})
-    
-    try:
-        booking = Booking.objects.get(stripe_session_id=session_id)
-        
-        # Update booking status to failed
-        booking.status = 'cancelled'
-        booking.payment_status = 'failed'
-        booking.save()
-        
-        logger.info(f"Booking {booking.id} marked as failed due to payment failure")
-        return JsonResponse({'status': 'booking_cancelled'})
-        
-    except Booking.DoesNotExist:
-        logger.error(f"Booking with session_id {session_id} not found")
-        return JsonResponse({'error': 'Booking not found'}, status=404)
-    except Exception as e:
-        logger.error(f"Error processing failed payment intent for session {session_id}: {str(e)}")
-        return JsonResponse({'error': 'Internal server error'}, status=500)
+        webhooks.record(json.loads(payload))
+    except ValueError as e:
+        logger.error(f"Invalid payload: {e}")
+        return JsonResponse({'error': 'Invalid payload'}, status=400)
+    return JsonResponse({'status': 'received'})
 
 @login_required
 @user_passes_test(is_admin)
@@ -1112,23 +1228,23 @@ def approve_host_application(request, application_id):
         try:
             application = get_object_or_404(HostApplication, id=application_id, status='pending')
             
-            # Update application status
-            application.status = 'approved'
-            application.save()
+            with transaction.atomic():
+                # Update application status
+                application.status = 'approved'
+                application.save()
             
-            # Update user profile role
-            profile = application.user.userprofile
-            profile.role = 'host'
-            profile.save()
+                # Update user profile role
+                profile = application.user.userprofile
+                profile.role = 'host'
+                profile.save()
             
-            # Send email notification to user (approved)
-            send_mail(
-                subject='Your Host Application Has Been Approved',
-                message=f'Congratulations {application.user.get_full_name() or application.user.username},\n\nYour host application has been approved! You can now list properties and start hosting on StayBooking.\n\nThank you for joining us!',
-                from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
-                recipient_list=[application.user.email],
-                fail_silently=True,
-            )
+                # Queue email notification to user (approved)
+                outbox.queue_mail(
+                    subject='Your Host Application Has Been Approved',
+                    message=f'Congratulations {application.user.get_full_name() or application.user.username},\n\nYour host application has been approved! You can now list properties and start hosting on StayBooking.\n\nThank you for joining us!',
+                    from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
+                    recipient_list=[application.user.email],
+                )
             
             messages.success(request, f'Host application for {application.user.username} has been approved.')
             
@@ -1162,24 +1278,24 @@ def reject_host_application(request, application_id):
         try:
             application = get_object_or_404(HostApplication, id=application_id, status='pending')
             
-            # Update application status
-            application.status = 'rejected'
-            application.save()
+            with transaction.atomic():
+                # Update application status
+                application.status = 'rejected'
+                application.save()
             
-            # Update user profile role back to regular user if they were pending
-            profile = application.user.userprofile
-            if profile.role == 'pending_host':
-                profile.role = 'user'
-                profile.save()
+                # Update user profile role back to regular user if they were pending
+                profile = application.user.userprofile
+                if profile.role == 'pending_host':
+                    profile.role = 'user'
+                    profile.save()
             
-            # Send email notification to user (rejected)
-            send_mail(
-                subject='Your Host Application Has Been Rejected',
-                message=f'Dear {application.user.get_full_name() or application.user.username},\n\nWe regret to inform you that your host application has been rejected. If you have questions or wish to reapply, please contact support.\n\nThank you for your interest in StayBooking.',
-                from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
-                recipient_list=[application.user.email],
-                fail_silently=True,
-            )
+                # Queue email notification to user (rejected)
+                outbox.queue_mail(
+                    subject='Your Host Application Has Been Rejected',
+                    message=f'Dear {application.user.get_full_name() or application.user.username},\n\nWe regret to inform you that your host application has been rejected. If you have questions or wish to reapply, please contact support.\n\nThank you for your interest in StayBooking.',
+                    from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
+                    recipient_list=[application.user.email],
+                )
             
             messages.success(request, f'Host application for {application.user.username} has been rejected.')
             
@@ -1208,7 +1324,8 @@ def reject_host_application(request, application_id):
 @login_required
 @user_passes_test(lambda u: u.userprofile.role == 'admin')
 def pending_paid_bookings_dashboard(request):
-    bookings = Booking.objects.filter(status='pending', payment_status='paid')
+    bookings = Booking.objects.select_related('property_obj', 'guest').filter(status='pending', payment_status='paid')
+    bookings = CursorPaginator(bookings, ADMIN_PAGE_SIZE, ordering=['created_at']).get_page(request.GET.get('cursor'))
     return render(request, 'pending_paid_bookings.html', {'bookings': bookings})
 
 @login_required
@@ -1216,16 +1333,16 @@ def pending_paid_bookings_dashboard(request):
 @require_POST
 def confirm_pending_booking_dashboard(request, booking_id):
     booking = get_object_or_404(Booking, id=booking_id, status='pending', payment_status='paid')
-    booking.status = 'confirmed'
-    booking.save()
-    # Send confirmation email
-    send_mail(
-        subject='Your booking is confirmed!',
-        message=f'Dear {booking.guest.get_full_name() or booking.guest.username},\n\nYour booking for {booking.property_obj.title} from {booking.check_in} to {booking.check_out} has been confirmed by the admin.\n\nThank you for booking with us!',
-        from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
-        recipient_list=[booking.guest.email],
-        fail_silently=True,
-    )
+    with transaction.atomic():
+        booking.status = 'confirmed'
+        booking.save()
+        # Queue confirmation email
+        outbox.queue_mail(
+            subject='Your booking is confirmed!',
+            message=f'Dear {booking.guest.get_full_name() or booking.guest.username},\n\nYour booking for {booking.property_obj.title} from {booking.check_in} to {booking.check_out} has been confirmed by the admin.\n\nThank you for booking with us!',
+            from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@example.com'),
+            recipient_list=[booking.guest.email],
+        )
     return redirect('pending_paid_bookings_dashboard')
 
 @login_required
@@ -1348,7 +1465,7 @@ def delete_property_comment(request, comment_id):
 
 @login_required
 def wishlist_page(request):
-    wishlist_properties = Property.objects.filter(wishlisted_by__user=request.user)
+    wishlist_properties = Property.objects.with_images().filter(wishlisted_by__user=request.user)
     return render(request, 'wishlist.html', {
         'wishlist_properties': wishlist_properties,
         'is_french': getattr(request, 'LANGUAGE_CODE', 'en') == 'fr',
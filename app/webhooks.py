@@ -0,0 +1,164 @@
+"""
+Stripe webhook ingestion.
+
+The stripe_webhook view only verifies the signature and calls record(), one
+INSERT that ignores event ids already in the WebhookEvent ledger, so Stripe
+gets its 200 in constant time and redeliveries are recorded once. The
+process_webhook_events worker then calls process() to apply pending events in
+the order Stripe created them. Handlers are idempotent and return a short
+result; an exception marks the event for retry with exponential backoff until
+MAX_ATTEMPTS, after which it is left as failed for replay_webhook_events.
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import payments
+from .models import Booking, WebhookEvent
+
+MAX_ATTEMPTS = 10
+BACKOFF_BASE = timedelta(seconds=15)
+BACKOFF_MAX = timedelta(hours=1)
+
+logger = logging.getLogger(__name__)
+
+
+def record(event):
+    """
+    Add the event (a decoded Stripe event payload) to the ledger unless already
+    there. Raises ValueError when the payload is not an event with an id.
+    """
+    if not isinstance(event, dict) or not isinstance(event.get('id'), str) or not event['id']:
+        raise ValueError('Event payload without an id')
+    created = event.get('created')
+    WebhookEvent.objects.bulk_create([WebhookEvent(
+        event_id=event['id'],
+        type=event.get('type', ''),
+        payload=event,
+        stripe_created=datetime.fromtimestamp(created, dt_timezone.utc) if isinstance(created, int) else None,
+    )], ignore_conflicts=True)
+
+
+def due(now=None):
+    return WebhookEvent.objects.filter(status='pending', next_attempt_at__lte=now or timezone.now())
+
+
+def process(batch_size=100, now=None):
+    """Apply up to ``batch_size`` due events in order. Returns the numbers processed and failed."""
+    now = now or timezone.now()
+    processed = failed = 0
+    for event in due(now).order_by('stripe_created', 'id')[:batch_size]:
+        try:
+            with transaction.atomic():
+                result = handle(event.payload)
+                event.status = 'processed'
+                event.result = result
+                event.processed_at = timezone.now()
+                event.last_error = ''
+                event.save(update_fields=['status', 'result', 'processed_at', 'last_error'])
+            processed += 1
+        except Exception as exc:
+            _reschedule(event, exc, now)
+            failed += 1
+    return {'processed': processed, 'failed': failed}
+
+
+def _reschedule(event, exc, now):
+    event.attempts += 1
+    event.last_error = f'{type(exc).__name__}: {exc}'
+    if event.attempts >= MAX_ATTEMPTS:
+        event.status = 'failed'
+        logger.error('Giving up on webhook event %s (%s): %s', event.event_id, event.type, event.last_error)
+    else:
+        event.next_attempt_at = now + min(BACKOFF_BASE * 2 ** (event.attempts - 1), BACKOFF_MAX)
+    event.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def requeue(events):
+    """Put ledger events back in the queue, e.g. after fixing a handler."""
+    return events.update(status='pending', attempts=0, next_attempt_at=timezone.now(), last_error='')
+
+
+def handle(event):
+    handler = HANDLERS.get(event.get('type'))
+    if handler is None:
+        return 'ignored'
+    return handler(event['data']['object'])
+
+
+def _mark_paid(booking):
+    """Record the payment of ``booking``, cancelling it if its nights were taken meanwhile."""
+    if booking.payment_status == 'paid':
+        return 'already_processed'
+    booking.status = 'pending'  # Admin must confirm
+    booking.payment_status = 'paid'
+    try:
+        # A hold that expired before payment claims its nights again here
+        with transaction.atomic():
+            booking.save()
+    except IntegrityError:
+        booking.status = 'cancelled'
+        booking.payment_status = 'failed'
+        booking.save()
+        logger.warning(f"Booking {booking.id} cancelled due to availability conflict")
+        return 'booking_cancelled'
+    logger.info(f"Booking {booking.id} marked as paid via webhook")
+    return 'success'
+
+
+def handle_checkout_session_completed(session):
+    if session.get('id'):
+        payments.update_session_status(session['id'], 'complete')
+    booking_id = session.get('metadata', {}).get('booking_id')
+    if not booking_id:
+        logger.error("Checkout session completed without booking_id in metadata")
+        return 'no_booking_id'
+    booking = Booking.objects.select_for_update().filter(id=booking_id).first()
+    if booking is None:
+        logger.error(f"Booking {booking_id} not found")
+        return 'booking_not_found'
+    return _mark_paid(booking)
+
+
+def handle_checkout_session_expired(session):
+    return 'updated' if payments.update_session_status(session['id'], 'expired') else 'ignored'
+
+
+def handle_payment_intent_succeeded(payment_intent):
+    session_id = payment_intent.get('metadata', {}).get('session_id')
+    if not session_id:
+        return 'ignored'
+    booking = Booking.objects.select_for_update().filter(stripe_session_id=session_id).first()
+    if booking is None:
+        logger.error(f"Booking with session_id {session_id} not found")
+        return 'booking_not_found'
+    if booking.status != 'pending':
+        return 'already_processed'
+    return _mark_paid(booking)
+
+
+def handle_payment_intent_failed(payment_intent):
+    session_id = payment_intent.get('metadata', {}).get('session_id')
+    if not session_id:
+        return 'ignored'
+    booking = Booking.objects.select_for_update().filter(stripe_session_id=session_id).first()
+    if booking is None:
+        logger.error(f"Booking with session_id {session_id} not found")
+        return 'booking_not_found'
+    if booking.status != 'pending' or booking.payment_status != 'pending':
+        return 'already_processed'
+    booking.status = 'cancelled'
+    booking.payment_status = 'failed'
+    booking.save()
+    logger.info(f"Booking {booking.id} marked as failed due to payment failure")
+    return 'booking_cancelled'
+
+
+HANDLERS = {
+    'checkout.session.completed': handle_checkout_session_completed,
+    'checkout.session.expired': handle_checkout_session_expired,
+    'payment_intent.succeeded': handle_payment_intent_succeeded,
+    'payment_intent.payment_failed': handle_payment_intent_failed,
+}
@@ -2,6 +2,10 @@
 ASGI config for pfa project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it (e.g. ``uvicorn pfa.asgi:application``) for the booking status
+streams, which need an async server to hold their connections open, and so
+the async JSON APIs polled by the booking pages do not each take a thread.
+Compare with ``manage.py benchmark --mode asgi`` against ``--mode server``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -40,8 +40,20 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'app.middleware.QueryCountMiddleware',
 ]
 
+# Requests issuing more queries than this are logged as warnings on 'app.queries'
+QUERY_COUNT_WARNING_THRESHOLD = int(os.getenv('QUERY_COUNT_WARNING_THRESHOLD', '50'))
+
+# Seconds between booking maintenance sweeps in run_booking_scheduler, and how
+# long a worker's lease lasts without renewal before another worker takes over
+BOOKING_SCHEDULER_INTERVAL = float(os.getenv('BOOKING_SCHEDULER_INTERVAL', '15'))
+BOOKING_SCHEDULER_LEASE_TTL = int(os.getenv('BOOKING_SCHEDULER_LEASE_TTL', '120'))
+# Pub/sub carrying booking status changes to the payment page streams (see
+# app/broadcast.py); the default only reaches streams in the same process
+BOOKING_BROKER = os.getenv('BOOKING_BROKER', 'app.broadcast.LocalBroker')
+
 ROOT_URLCONF = 'pfa.urls'
 
 TEMPLATES = [
@@ -131,8 +143,16 @@ MEDIA_ROOT = BASE_DIR / 'media'
 STRIPE_PUBLIC_KEY = 'pk_test_TYooMQauvdEDq54NiTphI7jx'  # Replace with your test public key
 STRIPE_SECRET_KEY = 'sk_test_BQokikJOvBiI2HlWgH4olfQ2'  # Replace with your test secret key
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', 'whsec_test_webhook_secret')  # Replace with your webhook secret
-
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Point STRIPE_API_BASE at a fake Stripe server for local testing
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+# Seconds before a Stripe API call is abandoned
+STRIPE_TIMEOUT = int(os.getenv('STRIPE_TIMEOUT', '10'))
+
+# Mail is queued in the outbox and sent by `manage.py send_queued_mail`. Set
+# EMAIL_BACKEND=django.core.mail.backends.filebased.EmailBackend to write the
+# messages to EMAIL_FILE_PATH instead of sending them when working locally.
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_FILE_PATH = os.getenv('EMAIL_FILE_PATH', str(BASE_DIR / 'sent_emails'))
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True